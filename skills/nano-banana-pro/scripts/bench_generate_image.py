@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for generate_image.py using the stub backend.
+
+Usage:
+    python3 bench_generate_image.py
+    python3 bench_generate_image.py --inputs 0,1,14 --resolutions 1K,4K --repeat 3 --latency 0.5
+    python3 bench_generate_image.py --stub-format jpeg
+
+Every (input count, resolution) pair runs generate_image.py in a fresh
+process with `--backend stub --timings json` and reports wall time, peak RSS
+and the per-phase costs the script measured itself. Inputs are synthetic
+PNGs written once per run, so loading and saving work can be tracked
+without a Gemini key or network.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from generate_image import STUB_FORMATS, SUPPORTED_RESOLUTIONS, peak_rss_mb, synthetic_png
+
+SCRIPT_PATH = Path(__file__).with_name("generate_image.py")
+PHASES = ("imports", "load_inputs", "build_request", "api", "save")
+
+
+def run_once(args: list[str], env: dict[str, str]) -> tuple[float, int, float, dict]:
+    """Run generate_image.py once; return (wall seconds, exit code, peak RSS MiB, timings)."""
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, str(SCRIPT_PATH), *args],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    stderr = proc.stderr.read()
+    proc.stderr.close()
+    _, status, rusage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - started
+    # wait4 collected the child together with its rusage; set the status on
+    # the Popen object too, or its cleanup would try to wait for a reaped pid.
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    timings = {}
+    lines = stderr.strip().splitlines()
+    if lines:
+        try:
+            timings = json.loads(lines[-1])
+        except json.JSONDecodeError:
+            pass
+    return elapsed, proc.returncode, peak_rss_mb(rusage), timings
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Benchmark generate_image.py against the stub backend.")
+    ap.add_argument("--inputs", default="0,1,14", help="Comma-separated input image counts.")
+    ap.add_argument("--resolutions", default=",".join(SUPPORTED_RESOLUTIONS), help="Comma-separated resolutions.")
+    ap.add_argument("--input-size", default="3000x2000", help="Synthetic input image size, WxH.")
+    ap.add_argument("--latency", type=float, default=0.0, help="Stub API latency in seconds.")
+    ap.add_argument("--payload-bytes", type=int, default=0, help="Pad stub output images to this size.")
+    ap.add_argument(
+        "--stub-format",
+        choices=tuple(STUB_FORMATS),
+        default="png",
+        help="Stub output format; rgba and jpeg exercise the decode-and-convert save path.",
+    )
+    ap.add_argument("--repeat", type=int, default=1, help="Runs per scenario; the median wall time is shown.")
+    ap.add_argument("script_args", nargs=argparse.REMAINDER, help="Extra generate_image.py args after `--`.")
+    args = ap.parse_args()
+
+    try:
+        counts = [int(v) for v in args.inputs.split(",") if v.strip()]
+        resolutions = [v.strip() for v in args.resolutions.split(",") if v.strip()]
+        width, _, height = args.input_size.lower().partition("x")
+        input_size = (int(width), int(height))
+    except ValueError as e:
+        print(f"Invalid argument: {e}", file=sys.stderr)
+        return 2
+    unknown = [r for r in resolutions if r not in SUPPORTED_RESOLUTIONS]
+    if unknown:
+        print(f"Unknown resolution(s): {', '.join(unknown)}", file=sys.stderr)
+        return 2
+    extra_args = [a for a in args.script_args if a != "--"]
+
+    env = {
+        **os.environ,
+        "NANO_BANANA_STUB_LATENCY": str(args.latency),
+        "NANO_BANANA_STUB_BYTES": str(args.payload_bytes),
+        "NANO_BANANA_STUB_FORMAT": args.stub_format,
+    }
+    env.pop("NANO_BANANA_TIMINGS", None)
+
+    header = f"{'inputs':>6} {'res':>4} {'wall_s':>7} {'rss_mb':>7} " + " ".join(f"{p:>13}" for p in PHASES)
+    print(header + f" {'in_mb':>7} {'out_mb':>7}")
+    failed = False
+    with tempfile.TemporaryDirectory(prefix="bench-nano-") as tmp:
+        tmp_dir = Path(tmp)
+        input_bytes = synthetic_png(*input_size)
+        inputs = []
+        for i in range(max(counts, default=0)):
+            path = tmp_dir / f"input-{i:02d}.png"
+            path.write_bytes(input_bytes)
+            inputs.append(str(path))
+
+        for count in counts:
+            for resolution in resolutions:
+                cmd = [
+                    "--backend", "stub", "--no-worker", "--timings", "json",
+                    "--prompt", "benchmark", "--filename", str(tmp_dir / "out.png"),
+                    "--resolution", resolution,
+                    *(arg for path in inputs[:count] for arg in ("-i", path)),
+                    *extra_args,
+                ]
+                runs = [run_once(cmd, env) for _ in range(max(1, args.repeat))]
+                wall = statistics.median(r[0] for r in runs)
+                code = max(r[1] for r in runs)
+                rss = max(r[2] for r in runs)
+                timings = runs[-1][3]
+                phases = timings.get("phases", {})
+                print(
+                    f"{count:>6} {resolution:>4} {wall:>7.3f} {rss:>7.1f} "
+                    + " ".join(f"{phases.get(p, 0.0):>13.4f}" for p in PHASES)
+                    + f" {timings.get('input_bytes', 0) / 1e6:>7.2f} {timings.get('output_bytes', 0) / 1e6:>7.2f}"
+                    + ("" if code == 0 else f"  (exited {code})")
+                )
+                failed = failed or code != 0
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -14,13 +14,58 @@ Usage:
 
 Multi-image editing (up to 14 images):
     uv run generate_image.py --prompt "combine these images" --filename "output.png" -i img1.png -i img2.png -i img3.png
+
+Reuse earlier results for identical requests (opt-in, see --cache):
+    uv run generate_image.py --prompt "..." --filename "output.png" --cache
+
+Warm worker (imports and client stay loaded; later runs forward to it automatically):
+    uv run generate_image.py --serve &
+    uv run generate_image.py --prompt "..." --filename "output.png"   # runs in the worker
+    uv run generate_image.py --prompt "..." --filename "output.png" --no-worker
+
+Iterative editing session (one chat; instructions on stdin, one per line):
+    uv run generate_image.py --session --filename "edit.png" -i photo.png --prompt "make it dusk"
+    # then type "add street lights", "/quit"; steps are saved as edit-01.png, edit-02.png, ...
+
+Extra sizes/formats from one generation (decoded once, rendered in parallel):
+    uv run generate_image.py --prompt "..." --filename "hero.png" -r 4K --derivatives 2K,1K,512:webp
+    # -> hero.png, hero-2K.png, hero-1K.png, hero-512.webp, each with its own MEDIA: line
+
+Offline (synthetic images, no key or network; see NANO_BANANA_STUB_* and bench_generate_image.py):
+    uv run generate_image.py --backend stub --prompt "..." --filename "output.png" --timings
+
+Batch (one process and client for many images):
+    uv run generate_image.py --batch jobs.jsonl [--batch-concurrency 4]
+    # jobs.jsonl: {"prompt": "...", "filename": "a.png", "input_images": ["in.png"], "resolution": "2K", "aspect_ratio": "16:9"}
 """
 
 import argparse
+import contextlib
+import hashlib
+import io
+import itertools
+import json
 import os
+import random
+import shutil
+import signal
+import socket
+import socketserver
+import struct
 import sys
+import threading
+import time
+import traceback
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from functools import partial
 from pathlib import Path
+from types import SimpleNamespace
 
+MODEL_ID = "gemini-3-pro-image-preview"
+MAX_INPUT_IMAGES = 14
+SUPPORTED_RESOLUTIONS = ["1K", "2K", "4K"]
 SUPPORTED_ASPECT_RATIOS = [
     "1:1",
     "2:3",
@@ -35,6 +80,446 @@ SUPPORTED_ASPECT_RATIOS = [
 ]
 
 
+class GenerationError(Exception):
+    """A single generation job failed; the message is shown to the user."""
+
+
+# Formats Gemini accepts as inline image parts; anything else is transcoded to PNG.
+GEMINI_IMAGE_MIME_TYPES = {"image/png", "image/jpeg", "image/webp", "image/heic", "image/heif"}
+
+# JPEG start-of-frame markers that carry the image dimensions.
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def probe_image_size(data: bytes) -> tuple[str, int, int] | None:
+    """Read (mime_type, width, height) from PNG, JPEG, GIF or WebP headers.
+
+    Only header bytes are inspected; nothing is decoded. Returns None for
+    formats this does not recognise.
+    """
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and data[12:16] == b"IHDR":
+        width, height = struct.unpack(">II", data[16:24])
+        return "image/png", width, height
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        width, height = struct.unpack("<HH", data[6:10])
+        return "image/gif", width, height
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        chunk = data[12:16]
+        if chunk == b"VP8 " and len(data) >= 30:
+            width, height = struct.unpack("<HH", data[26:30])
+            return "image/webp", width & 0x3FFF, height & 0x3FFF
+        if chunk == b"VP8L" and len(data) >= 25:
+            bits = int.from_bytes(data[21:25], "little")
+            return "image/webp", (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b"VP8X" and len(data) >= 30:
+            width = int.from_bytes(data[24:27], "little") + 1
+            height = int.from_bytes(data[27:30], "little") + 1
+            return "image/webp", width, height
+        return None
+    if data[:2] == b"\xff\xd8":
+        pos = 2
+        while pos + 4 <= len(data):
+            if data[pos] != 0xFF:
+                return None
+            marker = data[pos + 1]
+            if marker == 0xFF:  # fill byte
+                pos += 1
+                continue
+            if marker in (0x01, *range(0xD0, 0xD8)):  # standalone markers
+                pos += 2
+                continue
+            (length,) = struct.unpack(">H", data[pos + 2 : pos + 4])
+            if marker in _JPEG_SOF_MARKERS and pos + 9 <= len(data):
+                height, width = struct.unpack(">HH", data[pos + 5 : pos + 9])
+                return "image/jpeg", width, height
+            pos += 2 + length
+    return None
+
+
+@dataclass
+class InputImage:
+    """An input image kept in its original encoding, plus its dimensions."""
+
+    path: str
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+
+
+def load_input_image(path: str, PILImage=None) -> InputImage:
+    """Read an input image without decoding its pixels.
+
+    Dimensions come from the file header. Pillow is only used for formats the
+    header probe does not know, and pixels are only decoded when the format
+    has to be transcoded to PNG because Gemini does not accept it.
+    """
+    data = Path(path).read_bytes()
+    probed = probe_image_size(data)
+    if probed and probed[0] in GEMINI_IMAGE_MIME_TYPES:
+        mime_type, width, height = probed
+        return InputImage(path, data, mime_type, width, height)
+
+    if PILImage is None:
+        from PIL import Image as PILImage
+    from io import BytesIO
+
+    with PILImage.open(BytesIO(data)) as img:
+        width, height = img.size
+        mime_type = PILImage.MIME.get(img.format or "", "")
+        if mime_type not in GEMINI_IMAGE_MIME_TYPES:
+            converted = img if img.mode in ("RGB", "RGBA", "L", "LA") else img.convert("RGBA")
+            buf = BytesIO()
+            converted.save(buf, "PNG")
+            data, mime_type = buf.getvalue(), "image/png"
+    return InputImage(path, data, mime_type, width, height)
+
+
+# Longest output edge for each resolution; inputs larger than this are downscaled.
+RESOLUTION_MAX_EDGE = {"1K": 1024, "2K": 2048, "4K": 4096}
+
+
+def default_cache_dir() -> Path:
+    """Cache root: $NANO_BANANA_CACHE_DIR, else $XDG_CACHE_HOME (or ~/.cache)/openclaw/nano-banana-pro."""
+    override = os.environ.get("NANO_BANANA_CACHE_DIR")
+    if override:
+        return Path(override).expanduser()
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "openclaw" / "nano-banana-pro"
+
+
+def make_derivative(data: bytes, max_edge: int, dest_stem: str) -> tuple[str, str, int, int]:
+    """Downscale encoded image bytes to fit max_edge and write them next to `dest_stem`.
+
+    Opaque images become `<stem>.jpg` and images with alpha `<stem>.webp`.
+    Returns (path, mime_type, width, height) so the caller can report each
+    derivative without reopening it.
+    """
+    from io import BytesIO
+
+    from PIL import Image, ImageOps
+
+    with Image.open(BytesIO(data)) as img:
+        # Camera JPEG inputs decode at 1/2-1/8 scale here; PNGs ignore draft().
+        img.draft("RGB", (max_edge, max_edge))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+        dest = f"{dest_stem}.webp" if has_alpha else f"{dest_stem}.jpg"
+        tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if has_alpha:
+            img.convert("RGBA").save(tmp, "WEBP", quality=90, method=4)
+            mime_type = "image/webp"
+        else:
+            img.convert("RGB").save(tmp, "JPEG", quality=90, optimize=True)
+            mime_type = "image/jpeg"
+        os.replace(tmp, dest)
+        return dest, mime_type, img.width, img.height
+
+
+# One lock per derivative cache key, so batch jobs that share an input wait
+# for a single resize instead of each doing their own. Each entry is
+# [lock, users] and is dropped when its last user is done, so a --serve
+# worker only holds locks for keys in use, not for every input it has seen.
+_DERIVATIVE_LOCKS: dict[str, list] = {}
+_DERIVATIVE_LOCKS_LOCK = threading.Lock()
+
+
+@contextlib.contextmanager
+def _derivative_lock(key: str):
+    with _DERIVATIVE_LOCKS_LOCK:
+        entry = _DERIVATIVE_LOCKS.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _DERIVATIVE_LOCKS_LOCK:
+            entry[1] -= 1
+            if not entry[1]:
+                del _DERIVATIVE_LOCKS[key]
+
+
+def _cached_derivative(derivative_dir: Path, key: str) -> tuple[bytes, str, int, int] | None:
+    for ext, mime_type in ((".jpg", "image/jpeg"), (".webp", "image/webp")):
+        cached = derivative_dir / f"{key}{ext}"
+        if cached.exists():
+            data = cached.read_bytes()
+            _, width, height = probe_image_size(data) or (mime_type, 0, 0)
+            return data, mime_type, width, height
+    return None
+
+
+def downscale_inputs(
+    images: list[InputImage],
+    resolution: str,
+    cache_dir: Path,
+    log=print,
+) -> list[InputImage]:
+    """Shrink inputs larger than the output resolution, reusing cached derivatives.
+
+    Derivatives are keyed by the SHA-256 of the source bytes and the target
+    edge, so repeated edits of the same sources skip the resize entirely.
+    Cache misses are resized in parallel in a process pool, each key at most
+    once even when concurrent batch jobs ask for it.
+    """
+    max_edge = RESOLUTION_MAX_EDGE[resolution]
+    derivative_dir = cache_dir / "derivatives"
+    result = list(images)
+    keys: dict[int, str] = {}
+    for idx, img in enumerate(images):
+        if max(img.width, img.height) > max_edge:
+            keys[idx] = f"{hashlib.sha256(img.data).hexdigest()}-{max_edge}"
+    if not keys:
+        return result
+
+    def finish(idx: int, data: bytes, mime_type: str, width: int, height: int, cached: bool) -> None:
+        src = images[idx]
+        result[idx] = InputImage(src.path, data, mime_type, width, height)
+        note = ", cached" if cached else ""
+        log(f"Downscaled input image: {src.path} ({src.width}x{src.height} -> {width}x{height}{note})")
+
+    with contextlib.ExitStack() as stack:
+        # Sorted, so two jobs needing overlapping keys cannot deadlock.
+        for key in sorted(set(keys.values())):
+            stack.enter_context(_derivative_lock(key))
+        found: dict[str, tuple[bytes, str, int, int]] = {}
+        misses: dict[str, int] = {}
+        for idx, key in keys.items():
+            if key not in found and key not in misses:
+                hit = _cached_derivative(derivative_dir, key)
+                if hit is None:
+                    misses[key] = idx
+                else:
+                    found[key] = hit
+        made: dict[str, tuple[bytes, str, int, int]] = {}
+        if misses:
+            derivative_dir.mkdir(parents=True, exist_ok=True)
+
+            def read_back(dest: str, mime_type: str, width: int, height: int) -> tuple[bytes, str, int, int]:
+                return Path(dest).read_bytes(), mime_type, width, height
+
+            if len(misses) == 1:
+                key, idx = next(iter(misses.items()))
+                made[key] = read_back(*make_derivative(images[idx].data, max_edge, str(derivative_dir / key)))
+            else:
+                with ProcessPoolExecutor(max_workers=min(len(misses), os.cpu_count() or 1)) as pool:
+                    futures = {
+                        key: pool.submit(make_derivative, images[idx].data, max_edge, str(derivative_dir / key))
+                        for key, idx in misses.items()
+                    }
+                    for key, future in futures.items():
+                        made[key] = read_back(*future.result())
+
+    for idx, key in keys.items():
+        if key in made:
+            finish(idx, *made[key], cached=False)
+        else:
+            finish(idx, *found[key], cached=True)
+    return result
+
+
+INPUT_LOAD_WORKERS = 8
+
+
+def load_input_images(paths: list[str], PILImage=None, log=print) -> list[InputImage]:
+    """Load input images concurrently, keeping the caller's order.
+
+    Reads and header probes overlap in a thread pool, which matters on slow
+    network mounts. Every failing file is reported, in argument order.
+    """
+    images: list[InputImage] = []
+    errors: list[str] = []
+    with ThreadPoolExecutor(max_workers=min(len(paths), INPUT_LOAD_WORKERS)) as pool:
+        futures = [pool.submit(load_input_image, path, PILImage) for path in paths]
+        for path, future in zip(paths, futures):
+            try:
+                images.append(future.result())
+            except Exception as e:
+                errors.append(f"Error loading input image '{path}': {e}")
+                continue
+            log(f"Loaded input image: {path}")
+    if errors:
+        raise GenerationError("\n".join(errors))
+    return images
+
+
+# PNG IHDR color types for 8-bit truecolor without and with alpha.
+_PNG_COLOR_TYPE_RGB = 2
+_PNG_COLOR_TYPE_RGBA = 6
+
+
+def is_rgb_png(data: bytes) -> bool:
+    """True when `data` is an 8-bit RGB PNG, i.e. already what we save."""
+    return (
+        data[:8] == b"\x89PNG\r\n\x1a\n"
+        and data[12:16] == b"IHDR"
+        and len(data) >= 26
+        and data[24] == 8
+        and data[25] == _PNG_COLOR_TYPE_RGB
+    )
+
+
+def save_output_image(image_data: bytes, output_path: Path, PILImage=None) -> None:
+    """Save returned image bytes as an RGB PNG at `output_path`.
+
+    RGB PNGs are written byte-for-byte without decoding. Anything else is
+    decoded once; transparency is flattened onto white in a single paste
+    using only the alpha band, instead of splitting every channel.
+    """
+    if is_rgb_png(image_data):
+        output_path.write_bytes(image_data)
+        return
+
+    if PILImage is None:
+        from PIL import Image as PILImage
+    from io import BytesIO
+
+    with PILImage.open(BytesIO(image_data)) as image:
+        if image.mode == "P" and "transparency" in image.info:
+            image = image.convert("RGBA")
+        if image.mode in ("RGBA", "LA", "PA"):
+            flattened = PILImage.new("RGB", image.size, (255, 255, 255))
+            flattened.paste(image, mask=image.getchannel("A"))
+            flattened.save(str(output_path), "PNG")
+        elif image.mode == "RGB":
+            image.save(str(output_path), "PNG")
+        else:
+            image.convert("RGB").save(str(output_path), "PNG")
+
+
+# --derivatives output formats: Pillow format name and file extension.
+DERIVATIVE_FORMATS = {"png": ("PNG", ".png"), "webp": ("WEBP", ".webp"), "jpeg": ("JPEG", ".jpg"), "jpg": ("JPEG", ".jpg")}
+
+
+@dataclass(frozen=True)
+class DerivativeSpec:
+    """One extra output: a long-edge size (named like "1K" or "512") and a format."""
+
+    label: str
+    max_edge: int
+    fmt: str = "png"
+
+
+def parse_derivatives(spec: str) -> list[DerivativeSpec]:
+    """Parse `2K,1K,512:webp`: comma-separated SIZE[:FORMAT] items, PNG by default."""
+    specs: list[DerivativeSpec] = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        size, _, fmt = item.partition(":")
+        size, fmt = size.strip().upper(), (fmt.strip().lower() or "png")
+        if fmt not in DERIVATIVE_FORMATS:
+            raise ValueError(f"unknown derivative format {fmt!r} (use {', '.join(DERIVATIVE_FORMATS)})")
+        if size in RESOLUTION_MAX_EDGE:
+            max_edge = RESOLUTION_MAX_EDGE[size]
+        elif size.isdigit() and int(size) > 0:
+            max_edge = int(size)
+        else:
+            raise ValueError(f"invalid derivative size {size!r} (use 1K, 2K, 4K or pixels)")
+        derivative = DerivativeSpec(size, max_edge, fmt)
+        if derivative not in specs:
+            specs.append(derivative)
+    if not specs:
+        raise ValueError("no derivatives given")
+    return specs
+
+
+def derivative_path(output_path: Path, spec: DerivativeSpec) -> Path:
+    """`out.png` + 512:webp -> `out-512.webp`, next to the main output."""
+    return output_path.with_name(f"{output_path.stem}-{spec.label}{DERIVATIVE_FORMATS[spec.fmt][1]}")
+
+
+def render_derivative(img, spec: DerivativeSpec, dest: str) -> tuple[str, int, int]:
+    """Resize a decoded image to fit spec.max_edge (never upscaling) and save it to `dest`."""
+    from PIL import Image
+
+    longest = max(img.size)
+    if longest > spec.max_edge:
+        scale = spec.max_edge / longest
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        img = img.resize(size, Image.Resampling.LANCZOS)
+    pil_format = DERIVATIVE_FORMATS[spec.fmt][0]
+    options = {"quality": 90, "method": 4} if pil_format == "WEBP" else {"quality": 90, "optimize": True}
+    tmp = f"{dest}.{os.getpid()}.tmp"
+    img.save(tmp, pil_format, **({} if pil_format == "PNG" else options))
+    os.replace(tmp, dest)
+    return dest, img.width, img.height
+
+
+def render_shared_derivative(
+    shm_name: str, mode: str, size: tuple[int, int], spec: DerivativeSpec, dest: str
+) -> tuple[str, int, int]:
+    """Process-pool worker: render one derivative from pixels in shared memory."""
+    from multiprocessing import shared_memory
+
+    from PIL import Image
+
+    # Pool workers share the parent's resource tracker, so attaching here does
+    # not take ownership; the parent unlinks the block when all are done.
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        img = Image.frombuffer(mode, size, shm.buf, "raw", mode, 0, 1)
+        try:
+            return render_derivative(img, spec, dest)
+        finally:
+            # Drop the buffer export before closing the mapping.
+            del img
+    finally:
+        shm.close()
+
+
+def write_derivatives(
+    output_path: Path, specs: list[DerivativeSpec], pool: ProcessPoolExecutor | None = None
+) -> tuple[list[tuple[Path, int, int]], list[DerivativeSpec]]:
+    """Decode the saved image once and write every derivative next to it.
+
+    Images are never upscaled, so a spec larger than the image (or a PNG of
+    the same size, which would just copy it) is skipped rather than written
+    under a label that does not match its size. With several derivatives the
+    decoded pixels go into shared memory and each size/format is rendered in
+    its own worker process without decoding again, in `pool` if given (a
+    batch shares one) or else in a pool of its own. Returns (path, width,
+    height) for each written spec, in order, and the skipped specs.
+    """
+    from PIL import Image
+
+    with Image.open(output_path) as opened:
+        longest = max(opened.size)
+        skipped = [
+            spec for spec in specs if spec.max_edge > longest or (spec.max_edge == longest and spec.fmt == "png")
+        ]
+        specs = [spec for spec in specs if spec not in skipped]
+        if not specs:
+            return [], skipped
+        img = opened.convert("RGB") if opened.mode != "RGB" else opened.copy()
+    dests = [str(derivative_path(output_path, spec)) for spec in specs]
+    if len(specs) == 1:
+        dest, width, height = render_derivative(img, specs[0], dests[0])
+        return [(Path(dest), width, height)], skipped
+
+    from multiprocessing import shared_memory
+
+    raw = img.tobytes()
+    shm = shared_memory.SharedMemory(create=True, size=len(raw))
+    try:
+        shm.buf[: len(raw)] = raw
+        del raw
+        with contextlib.ExitStack() as stack:
+            if pool is None:
+                pool = stack.enter_context(ProcessPoolExecutor(max_workers=min(len(specs), os.cpu_count() or 1)))
+            futures = [
+                pool.submit(render_shared_derivative, shm.name, img.mode, img.size, spec, dest)
+                for spec, dest in zip(specs, dests)
+            ]
+            results = [future.result() for future in futures]
+    finally:
+        shm.close()
+        shm.unlink()
+    return [(Path(dest), width, height) for dest, width, height in results], skipped
+
+
 def get_api_key(provided_key: str | None) -> str | None:
     """Get API key from argument first, then environment."""
     if provided_key:
@@ -69,18 +554,1434 @@ def choose_output_resolution(
     return "1K", False
 
 
-def main():
+@dataclass
+class Job:
+    """One image to generate: a CLI invocation or a line of a --batch file."""
+
+    prompt: str
+    filename: str
+    input_images: list[str] = field(default_factory=list)
+    resolution: str | None = None
+    aspect_ratio: str | None = None
+    downscale: bool = False
+
+
+def parse_job(
+    raw: dict,
+    default_resolution: str | None = None,
+    default_aspect_ratio: str | None = None,
+    default_downscale: bool = False,
+) -> Job:
+    """Validate one decoded --batch line and turn it into a Job."""
+    if not isinstance(raw, dict):
+        raise ValueError("expected a JSON object")
+    prompt = raw.get("prompt")
+    filename = raw.get("filename")
+    if not isinstance(prompt, str) or not prompt.strip():
+        raise ValueError("missing 'prompt'")
+    if not isinstance(filename, str) or not filename.strip():
+        raise ValueError("missing 'filename'")
+
+    input_images = raw.get("input_images") or []
+    if isinstance(input_images, str):
+        input_images = [input_images]
+    if not isinstance(input_images, list) or not all(isinstance(p, str) for p in input_images):
+        raise ValueError("'input_images' must be a list of paths")
+    if len(input_images) > MAX_INPUT_IMAGES:
+        raise ValueError(f"too many input images ({len(input_images)}). Maximum is {MAX_INPUT_IMAGES}.")
+
+    resolution = raw.get("resolution", default_resolution)
+    if resolution is not None and resolution not in SUPPORTED_RESOLUTIONS:
+        raise ValueError(f"invalid resolution {resolution!r}")
+    aspect_ratio = raw.get("aspect_ratio", default_aspect_ratio)
+    if aspect_ratio is not None and aspect_ratio not in SUPPORTED_ASPECT_RATIOS:
+        raise ValueError(f"invalid aspect_ratio {aspect_ratio!r}")
+
+    downscale = raw.get("downscale", default_downscale)
+    if not isinstance(downscale, bool):
+        raise ValueError("'downscale' must be true or false")
+
+    return Job(prompt, filename, input_images, resolution, aspect_ratio, downscale)
+
+
+def load_batch_jobs(
+    path: str,
+    default_resolution: str | None = None,
+    default_aspect_ratio: str | None = None,
+    default_downscale: bool = False,
+) -> list[Job]:
+    """Read a JSON-lines job file; blank lines and lines starting with # are skipped."""
+    jobs = []
+    with open(path, encoding="utf-8") as fh:
+        for lineno, line in enumerate(fh, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                jobs.append(
+                    parse_job(json.loads(line), default_resolution, default_aspect_ratio, default_downscale)
+                )
+            except (json.JSONDecodeError, ValueError) as e:
+                raise ValueError(f"{path}:{lineno}: {e}") from e
+    return jobs
+
+
+class PhaseTimer:
+    """Wall time per phase and a few counters for --timings; safe to share across threads.
+
+    In --batch mode phases are summed over all jobs, so they can exceed wall time.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: dict[str, float] = {}
+        self.counters: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def timed(self, name: str, iterable):
+        """Yield from `iterable`, charging the time spent waiting for each item to `name`."""
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                item = next(iterator, _END)
+            if item is _END:
+                return
+            yield item
+
+    def summary(self) -> dict:
+        with self._lock:
+            data = {
+                "total_s": round(time.perf_counter() - self.started, 4),
+                "phases": {name: round(secs, 4) for name, secs in self.phases.items()},
+                **self.counters,
+            }
+        rss = peak_rss_mb()
+        if rss is not None:
+            # A --serve worker's peak covers every request it has run, not just this one.
+            data["worker_peak_rss_mb" if _IN_WORKER else "peak_rss_mb"] = round(rss, 1)
+        return data
+
+    def report(self, fmt: str = "text") -> str:
+        data = self.summary()
+        if fmt == "json":
+            return json.dumps(data)
+        phases = ", ".join(f"{name} {secs:.3f}s" for name, secs in data.pop("phases").items())
+        total = data.pop("total_s")
+        extra = ", ".join(f"{key} {value}" for key, value in data.items())
+        return f"timings: {phases or 'none'}; total {total:.3f}s" + (f"\nresources: {extra}" if extra else "")
+
+
+_END = object()
+TIMINGS_FORMATS = ("text", "json")
+
+
+def peak_rss_mb(rusage=None) -> float | None:
+    """Peak resident set size in MiB from `rusage` (default: this process), where the platform reports it."""
+    if rusage is None:
+        try:
+            import resource
+        except ImportError:
+            return None
+        rusage = resource.getrusage(resource.RUSAGE_SELF)
+    # Darwin counts ru_maxrss in bytes; Linux and the BSDs count kilobytes.
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return rusage.ru_maxrss / scale
+
+
+class LazyClient:
+    """The google-genai client and `types` module, created on first use.
+
+    Cache hits never call get(), so they skip the SDK import and client setup.
+    """
+
+    def __init__(self, api_key: str):
+        self._api_key = api_key
+        self._lock = threading.Lock()
+        self._loaded = None
+
+    def get(self, timer: PhaseTimer | None = None):
+        """Return (client, types), importing google-genai on the first call."""
+        timer = timer or PhaseTimer()
+        with self._lock:
+            if self._loaded is None:
+                with timer.phase("imports"):
+                    from google import genai
+                    from google.genai import types
+                with timer.phase("client"):
+                    self._loaded = (genai.Client(api_key=self._api_key), types)
+            return self._loaded
+
+
+_CLIENTS: dict[str, LazyClient] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+def shared_client(api_key: str) -> LazyClient:
+    """One LazyClient per API key for the life of the process (kept warm by --serve)."""
+    with _CLIENTS_LOCK:
+        if api_key not in _CLIENTS:
+            _CLIENTS[api_key] = LazyClient(api_key)
+        return _CLIENTS[api_key]
+
+
+BACKENDS = ("gemini", "stub")
+
+
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    """Length, tag, data and CRC-32 over tag + data, as every PNG chunk is laid out."""
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+
+def _stripe(y: int, alpha: bool = False) -> bytes:
+    """One pixel of row `y` of the synthetic images; partly transparent when `alpha`."""
+    rgb = bytes(((y * 7) % 256, (y * 3) % 256, 160))
+    return rgb + bytes((255 - y % 128,)) if alpha else rgb
+
+
+def synthetic_png(width: int, height: int, payload_bytes: int = 0, alpha: bool = False) -> bytes:
+    """A valid 8-bit RGB (or RGBA) PNG of horizontal stripes, padded to about `payload_bytes`."""
+    rows = b"".join(b"\x00" + _stripe(y, alpha) * width for y in range(height))
+    color_type = _PNG_COLOR_TYPE_RGBA if alpha else _PNG_COLOR_TYPE_RGB
+    png = (
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0))
+        + _png_chunk(b"IDAT", zlib.compress(rows, 1))
+    )
+    # Every chunk costs 12 bytes beyond its data; reserve them for the filler
+    # chunk and the closing IEND so the result lands on payload_bytes.
+    padding = payload_bytes - len(png) - 12 - 12
+    if padding > 0:
+        png += _png_chunk(b"stUb", bytes(padding))
+    return png + _png_chunk(b"IEND", b"")
+
+
+def synthetic_jpeg(width: int, height: int, payload_bytes: int = 0) -> bytes:
+    """The synthetic_png() stripes as a JPEG, padded with comment segments to about `payload_bytes`."""
+    from PIL import Image
+
+    rows = b"".join(_stripe(y) * width for y in range(height))
+    out = io.BytesIO()
+    Image.frombytes("RGB", (width, height), rows).save(out, "JPEG", quality=90)
+    jpeg = out.getvalue()
+    # A COM segment holds at most 65533 bytes after its 4-byte marker and length.
+    padding = b""
+    missing = payload_bytes - len(jpeg)
+    while missing > 4:
+        size = min(missing - 4, 65533)
+        padding += b"\xff\xfe" + struct.pack(">H", size + 2) + bytes(size)
+        missing -= size + 4
+    return jpeg[:2] + padding + jpeg[2:]
+
+
+# --backend stub output formats: an RGB PNG is saved as-is, the others take
+# the decode-and-convert path in save_output_image().
+STUB_FORMATS = {"png": "image/png", "rgba": "image/png", "jpeg": "image/jpeg"}
+
+
+def synthetic_image(fmt: str, width: int, height: int, payload_bytes: int = 0) -> bytes:
+    """A synthetic stub output image in one of STUB_FORMATS."""
+    if fmt == "jpeg":
+        return synthetic_jpeg(width, height, payload_bytes)
+    return synthetic_png(width, height, payload_bytes, alpha=fmt == "rgba")
+
+
+def stub_image_size(image_config: dict) -> tuple[int, int]:
+    """Output dimensions for an image_config: the resolution's long edge at its aspect ratio."""
+    edge = RESOLUTION_MAX_EDGE.get(image_config.get("image_size") or "1K", 1024)
+    w, _, h = (image_config.get("aspect_ratio") or "1:1").partition(":")
+    w, h = int(w), int(h)
+    if w >= h:
+        return edge, max(1, round(edge * h / w))
+    return max(1, round(edge * w / h)), edge
+
+
+class StubAPIError(Exception):
+    """Injected failure; carries `code` like google.genai.errors.APIError."""
+
+    def __init__(self, code: int, message: str = "stub injected error"):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class StubTypes:
+    """The small part of google.genai.types that the request code uses."""
+
+    class Part:
+        @staticmethod
+        def from_bytes(data: bytes, mime_type: str):
+            return SimpleNamespace(text=None, inline_data=SimpleNamespace(data=data, mime_type=mime_type))
+
+        @staticmethod
+        def from_uri(file_uri: str, mime_type: str | None = None):
+            return SimpleNamespace(text=None, file_data=SimpleNamespace(file_uri=file_uri, mime_type=mime_type))
+
+    @staticmethod
+    def UploadFileConfig(**kwargs):
+        return SimpleNamespace(**kwargs)
+
+    @staticmethod
+    def GenerateContentConfig(**kwargs):
+        return SimpleNamespace(**kwargs)
+
+    @staticmethod
+    def ImageConfig(**kwargs):
+        return dict(kwargs)
+
+    @staticmethod
+    def HttpOptions(**kwargs):
+        return dict(kwargs)
+
+
+class StubBackend:
+    """Deterministic offline stand-in for Gemini with the same get() interface as LazyClient.
+
+    Each call sleeps `latency` seconds, fails with probability `error_rate`
+    (HTTP `error_code`, so retries behave as with the real API) and otherwise
+    returns a text part plus a synthetic image in `image_format` (see
+    STUB_FORMATS) sized from the request's image_config, padded to
+    `payload_bytes`. prepare() builds an image ahead of time, so its cost is
+    not charged to the "api" phase.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        payload_bytes: int = 0,
+        error_rate: float = 0.0,
+        error_code: int = 503,
+        seed: int = 0,
+        image_format: str = "png",
+    ):
+        if image_format not in STUB_FORMATS:
+            raise ValueError(f"unknown stub image format {image_format!r} (choose from {', '.join(STUB_FORMATS)})")
+        self.latency = latency
+        self.image_format = image_format
+        self.payload_bytes = payload_bytes
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._images: dict[tuple[int, int], bytes] = {}
+        self.calls = 0
+        self.uploads = 0
+        self._deleted: set[str] = set()
+        self._imported = False
+
+    @classmethod
+    def from_env(cls) -> "StubBackend":
+        """Configure from NANO_BANANA_STUB_{LATENCY,BYTES,ERROR_RATE,ERROR_CODE,SEED,FORMAT}."""
+        env = os.environ
+        return cls(
+            latency=float(env.get("NANO_BANANA_STUB_LATENCY") or 0),
+            payload_bytes=int(env.get("NANO_BANANA_STUB_BYTES") or 0),
+            error_rate=float(env.get("NANO_BANANA_STUB_ERROR_RATE") or 0),
+            error_code=int(env.get("NANO_BANANA_STUB_ERROR_CODE") or 503),
+            seed=int(env.get("NANO_BANANA_STUB_SEED") or 0),
+            image_format=env.get("NANO_BANANA_STUB_FORMAT") or "png",
+        )
+
+    def get(self, timer: PhaseTimer | None = None):
+        """Return (self, StubTypes), importing google-genai once if installed, as LazyClient would."""
+        timer = timer or PhaseTimer()
+        with self._lock:
+            if not self._imported:
+                self._imported = True
+                with timer.phase("imports"), contextlib.suppress(ImportError):
+                    from google.genai import types  # noqa: F401
+        return self, StubTypes
+
+    def prepare(self, image_config: dict) -> bytes:
+        """Build (once) and return the image a request with `image_config` gets back."""
+        size = stub_image_size(image_config)
+        with self._lock:
+            image = self._images.get(size)
+        if image is None:
+            image = synthetic_image(self.image_format, *size, self.payload_bytes)
+            with self._lock:
+                image = self._images.setdefault(size, image)
+        return image
+
+    @property
+    def models(self):
+        return self
+
+    @property
+    def chats(self):
+        return self
+
+    @property
+    def files(self):
+        return self
+
+    def upload(self, file, config=None):
+        """Files API stand-in: reads the data and returns a handle with a stub:// URI."""
+        size = len(file.read())
+        with self._lock:
+            self.uploads += 1
+            n = self.uploads
+        return SimpleNamespace(
+            name=f"files/stub-{n}",
+            uri=f"stub://files/stub-{n}",
+            mime_type=getattr(config, "mime_type", None),
+            size_bytes=size,
+            expiration_time=None,
+        )
+
+    def delete(self, name: str):
+        """Files API stand-in: later requests referencing the file fail with 403."""
+        with self._lock:
+            self._deleted.add(f"stub://{name}")
+
+    def _respond(self, contents, config):
+        with self._lock:
+            self.calls += 1
+            failed = self._rng.random() < self.error_rate
+            rejected = not isinstance(contents, str) and any(
+                getattr(getattr(c, "file_data", None), "file_uri", None) in self._deleted for c in contents
+            )
+        if self.latency:
+            time.sleep(self.latency)
+        if failed:
+            raise StubAPIError(self.error_code)
+        if rejected:
+            raise StubAPIError(403, "You do not have permission to access the File or it may not exist.")
+        image = self.prepare(getattr(config, "image_config", None) or {})
+        prompt = contents if isinstance(contents, str) else next(
+            (c for c in reversed(contents) if isinstance(c, str)), ""
+        )
+        return [
+            SimpleNamespace(text=f"stub: {prompt[:60]}", inline_data=None),
+            SimpleNamespace(text=None, inline_data=SimpleNamespace(data=image, mime_type=STUB_FORMATS[self.image_format])),
+        ]
+
+    def generate_content(self, model: str, contents, config=None):
+        return SimpleNamespace(parts=self._respond(contents, config))
+
+    def generate_content_stream(self, model: str, contents, config=None):
+        for part in self._respond(contents, config):
+            yield SimpleNamespace(parts=[part])
+
+    def create(self, model: str):
+        backend = self
+
+        class Chat:
+            def send_message(self, message, config=None):
+                return backend.generate_content(model, message, config)
+
+        return Chat()
+
+
+# HTTP statuses worth retrying: timeouts, rate limits and transient server errors.
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_CALL_TIMEOUT = 300.0
+
+
+def backoff_delay(attempt: int, base: float = 2.0, cap: float = 60.0) -> float:
+    """Return a jittered exponential backoff delay for the given retry attempt."""
+    return min(cap, base * (2**attempt)) * (0.5 + random.random() / 2)
+
+
+def is_retryable_error(err: Exception) -> bool:
+    """True for rate limits, transient server errors and network failures."""
+    # google.genai.errors.APIError and its subclasses carry the HTTP status as `code`.
+    code = getattr(err, "code", None)
+    if isinstance(code, int):
+        return code in RETRYABLE_STATUS_CODES
+    if isinstance(err, (TimeoutError, ConnectionError)):
+        return True
+    # httpx timeouts and connection resets, matched without importing httpx.
+    return any(cls.__name__ in ("TransportError", "TimeoutException") for cls in type(err).__mro__)
+
+
+class RateLimiter:
+    """Spaces API calls at most `rpm` per minute across every thread that shares it.
+
+    Without `rpm` calls are not spaced, but pause() still holds back every
+    sharer, so one rate-limit response slows the whole run down.
+    """
+
+    def __init__(self, rpm: float | None = None):
+        self.interval = 60.0 / rpm if rpm else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def pause(self, seconds: float) -> None:
+        """Start no call for `seconds` from now."""
+        with self._lock:
+            self._next = max(self._next, time.monotonic() + seconds)
+
+    def acquire(self, deadline: float | None = None) -> float:
+        """Block until this caller's slot; returns the time waited in seconds."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            if deadline is not None and slot >= deadline:
+                raise GenerationError("Error: Deadline exceeded while waiting for the rate limiter.")
+            self._next = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+@dataclass
+class RetryPolicy:
+    """How API calls are retried and bounded; one instance is shared by a whole run.
+
+    `timeout` applies to each call, `deadline` is a time.monotonic() value after
+    which no call or retry is started.
+    """
+
+    max_retries: int = DEFAULT_MAX_RETRIES
+    timeout: float | None = DEFAULT_CALL_TIMEOUT
+    deadline: float | None = None
+    limiter: RateLimiter | None = field(default_factory=RateLimiter)
+
+
+def call_with_retries(call, policy: RetryPolicy, log=print):
+    """Run `call(timeout_seconds)`, retrying retryable errors with jittered backoff.
+
+    Fatal errors, an exhausted retry budget or a backoff that would overrun the
+    deadline re-raise the last error. A 429 pauses the policy's shared limiter
+    instead of only this caller, so concurrent jobs back off together.
+    """
+    attempt = 0
+    while True:
+        if policy.limiter is not None:
+            policy.limiter.acquire(policy.deadline)
+        timeout = policy.timeout
+        if policy.deadline is not None:
+            remaining = policy.deadline - time.monotonic()
+            if remaining <= 0:
+                raise GenerationError("Error: Deadline exceeded before the image was generated.")
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        try:
+            return call(timeout)
+        except Exception as e:
+            if attempt >= policy.max_retries or not is_retryable_error(e):
+                raise
+            delay = backoff_delay(attempt)
+            if policy.deadline is not None and time.monotonic() + delay >= policy.deadline:
+                raise
+            attempt += 1
+            log(f"Retryable error: {e}; retry {attempt}/{policy.max_retries} in {delay:.1f}s")
+            if getattr(e, "code", None) == 429 and policy.limiter is not None:
+                policy.limiter.pause(delay)  # acquire() waits it out at the top of the loop
+            else:
+                time.sleep(delay)
+
+
+DEFAULT_RESULT_CACHE_MAX_MB = 1024
+
+
+def place_file(src: Path, dest: Path) -> None:
+    """Hard-link `src` to `dest`, copying when linking is not possible.
+
+    The link or copy is made under a temporary name and renamed over `dest`,
+    so an existing `dest` survives if `src` has just been evicted.
+    """
+    tmp = dest.with_name(f".{dest.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dest)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+class ResultCache:
+    """Generated PNGs stored by a hash of everything that went into the request.
+
+    Entries live flat under `root` as `<key>.png`. A hit refreshes the entry's
+    mtime, and eviction removes the least recently used entries until the total
+    size fits in `max_bytes`.
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(prompt: str, input_images: list[InputImage], image_config: dict, downscale: bool = False) -> str:
+        material = {
+            "model": MODEL_ID,
+            "prompt": prompt,
+            "inputs": [hashlib.sha256(img.data).hexdigest() for img in input_images],
+            "image_config": image_config,
+            "downscale": downscale,
+        }
+        return hashlib.sha256(json.dumps(material, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def entry(self, key: str) -> Path:
+        return self.root / f"{key}.png"
+
+    def fetch(self, key: str, dest: Path) -> bool:
+        """Place a cached result at `dest`; False on a miss."""
+        entry = self.entry(key)
+        try:
+            os.utime(entry)
+            place_file(entry, dest)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def store(self, key: str, src: Path) -> None:
+        """Copy a freshly generated result into the cache, then evict."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.root / f".{key}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, self.entry(key))
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        with os.scandir(self.root) as it:
+            for entry in it:
+                if entry.name.endswith(".png") and entry.is_file():
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+# The Files API keeps uploads for 48 hours; stop reusing them an hour early.
+UPLOAD_TTL_SECONDS = 47 * 3600
+
+
+class UploadCache:
+    """Files API handles for input images, keyed by content hash and persisted as JSON.
+
+    Jobs in a batch or session (and later runs within the expiry window) that
+    send the same image reference one upload instead of re-sending its bytes.
+    Handles are scoped to `account` because uploads belong to one API key.
+    With index_path=None the handles only live for this process.
+    """
+
+    def __init__(self, index_path: Path | None, account: str, ttl: float = UPLOAD_TTL_SECONDS):
+        self.index_path = Path(index_path) if index_path is not None else None
+        self.account = account
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._key_locks: dict[str, threading.Lock] = {}
+        try:
+            self._index = json.loads(self.index_path.read_text(encoding="utf-8")) if self.index_path else {}
+        except (OSError, ValueError):
+            self._index = {}
+        if not isinstance(self._index, dict):
+            self._index = {}
+
+    def _lookup(self, key: str) -> dict | None:
+        with self._lock:
+            entry = self._index.get(key)
+        if isinstance(entry, dict) and entry.get("expires", 0) > time.time():
+            return entry
+        return None
+
+    def forget(self, images: list[InputImage]) -> None:
+        """Drop the handles for `images`, e.g. after the server rejected them."""
+        with self._lock:
+            for img in images:
+                self._index.pop(self._key(img), None)
+        self._save()
+
+    def _key(self, img: InputImage) -> str:
+        return f"{self.account}:{hashlib.sha256(img.data).hexdigest()}"
+
+    def _save(self) -> None:
+        with self._lock:
+            now = time.time()
+            live = {k: v for k, v in self._index.items() if isinstance(v, dict) and v.get("expires", 0) > now}
+            self._index = live
+            data = json.dumps(live, indent=1, sort_keys=True)
+        if self.index_path is None:
+            return
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.index_path.with_name(f".{self.index_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(data, encoding="utf-8")
+        os.replace(tmp, self.index_path)
+
+    def part_for(self, genai_client, types, img: InputImage, log=print, retry: RetryPolicy | None = None):
+        """A Part referencing `img` by file URI, uploading it first (with retries) if needed."""
+        key = self._key(img)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        # Concurrent jobs sharing an image wait for one upload instead of racing.
+        with key_lock:
+            entry = self._lookup(key)
+            if entry is None:
+                def upload(timeout: float | None):
+                    return genai_client.files.upload(
+                        file=io.BytesIO(img.data),
+                        config=types.UploadFileConfig(
+                            mime_type=img.mime_type,
+                            display_name=Path(img.path).name,
+                            http_options=types.HttpOptions(timeout=int(timeout * 1000)) if timeout else None,
+                        ),
+                    )
+
+                uploaded = call_with_retries(upload, retry or RetryPolicy(), log)
+                expires = time.time() + self.ttl
+                if getattr(uploaded, "expiration_time", None) is not None:
+                    expires = min(expires, uploaded.expiration_time.timestamp() - 3600)
+                entry = {"uri": uploaded.uri, "mime_type": img.mime_type, "expires": expires}
+                with self._lock:
+                    self._index[key] = entry
+                self._save()
+                log(f"Uploaded input image: {img.path}")
+            else:
+                log(f"Reusing uploaded input image: {img.path}")
+        return types.Part.from_uri(file_uri=entry["uri"], mime_type=entry["mime_type"])
+
+
+def image_parts(
+    genai_client,
+    types,
+    input_images: list[InputImage],
+    uploads: UploadCache | None,
+    log=print,
+    retry: RetryPolicy | None = None,
+):
+    """Request parts for the input images: inline bytes, or file handles with `uploads`."""
+    if uploads is None:
+        # Original encoded bytes go straight into inline parts; no re-encode.
+        return [types.Part.from_bytes(data=img.data, mime_type=img.mime_type) for img in input_images]
+    return [uploads.part_for(genai_client, types, img, log, retry) for img in input_images]
+
+
+def is_rejected_file_error(err: Exception) -> bool:
+    """True when the API refused a request's file handles (deleted, expired or another project's).
+
+    Only errors that name a file count, so e.g. a 403 for a bad API key is
+    reported as it is instead of being retried inline.
+    """
+    return getattr(err, "code", None) in (400, 403, 404) and "file" in str(err).lower()
+
+
+def with_upload_fallback(request, contents, inline_contents, uploads, input_images, log=print):
+    """Return request(contents), falling back once to inline image bytes.
+
+    If the API rejects the upload handles in `contents`, they are dropped from
+    `uploads` (so later runs upload again) and request(inline_contents()) is
+    tried instead.
+    """
+    try:
+        return request(contents)
+    except Exception as e:
+        if uploads is None or not input_images or not is_rejected_file_error(e):
+            raise
+        uploads.forget(input_images)
+        log(f"Uploaded input images were rejected ({e}); retrying once with inline image bytes")
+        return request(inline_contents())
+
+
+def generation_config(types, image_config: dict, timeout: float | None):
+    """GenerateContentConfig asking for text and image parts with the given image_config."""
+    return types.GenerateContentConfig(
+        response_modalities=["TEXT", "IMAGE"],
+        image_config=types.ImageConfig(**image_config),
+        # HttpOptions.timeout is in milliseconds.
+        http_options=types.HttpOptions(timeout=int(timeout * 1000)) if timeout else None,
+    )
+
+
+def iter_response_parts(responses, timer: PhaseTimer):
+    """Yield (text, None) or (None, image_bytes) for each part of each response."""
+    for response in responses:
+        for part in response.parts or []:
+            if part.text is not None:
+                yield part.text, None
+            elif part.inline_data is not None:
+                # inline_data.data is already bytes, not base64
+                image_data = part.inline_data.data
+                if isinstance(image_data, str):
+                    # If it's a string, it might be base64
+                    import base64
+                    with timer.phase("decode"):
+                        image_data = base64.b64decode(image_data)
+                yield None, image_data
+
+
+def run_job(
+    client: LazyClient | StubBackend,
+    PILImage,
+    job: Job,
+    log=print,
+    cache: ResultCache | None = None,
+    retry: RetryPolicy | None = None,
+    stream: bool = False,
+    timer: PhaseTimer | None = None,
+    derivatives: list[DerivativeSpec] | None = None,
+    uploads: UploadCache | None = None,
+    text_out=None,
+    derivative_pool: ProcessPoolExecutor | None = None,
+) -> Path:
+    """Generate one image and save it as PNG; returns the resolved output path.
+
+    Progress goes through `log` so batch mode can buffer each job's output.
+    With a `cache`, identical requests are served from disk without touching
+    the API. With `stream`, text fragments are written to `text_out` (default
+    stdout) on one "Model response:" line as they arrive, and each image is
+    saved and announced as soon as it arrives. Each of `derivatives` is rendered from the result
+    (in `derivative_pool` if given) and announced after it. With `uploads`, input images are sent as Files
+    API handles. Phase times and byte counts go to `timer`.
+    Raises GenerationError on failure.
+    """
+    retry = retry or RetryPolicy()
+    timer = timer or PhaseTimer()
+    # Set up output path
+    output_path = Path(job.filename)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Load input images if provided (up to 14 supported by Nano Banana Pro)
+    input_images = []
+    max_input_dim = 0
+    if job.input_images:
+        if len(job.input_images) > MAX_INPUT_IMAGES:
+            raise GenerationError(
+                f"Error: Too many input images ({len(job.input_images)}). Maximum is {MAX_INPUT_IMAGES}."
+            )
+
+        with timer.phase("load_inputs"):
+            input_images = load_input_images(job.input_images, PILImage, log)
+        timer.count("input_images", len(input_images))
+        timer.count("input_bytes", sum(len(img.data) for img in input_images))
+        # Track largest dimension for auto-resolution
+        max_input_dim = max(max(img.width, img.height) for img in input_images)
+
+    output_resolution, auto_detected = choose_output_resolution(
+        requested_resolution=job.resolution,
+        max_input_dim=max_input_dim,
+        has_input_images=bool(input_images),
+    )
+    if auto_detected:
+        log(
+            f"Auto-detected resolution: {output_resolution} "
+            f"(from max input dimension {max_input_dim})"
+        )
+
+    # Build image config with optional aspect ratio
+    image_cfg_kwargs = {"image_size": output_resolution}
+    if job.aspect_ratio:
+        image_cfg_kwargs["aspect_ratio"] = job.aspect_ratio
+
+    cache_key = None
+    if cache is not None:
+        with timer.phase("cache"):
+            cache_key = ResultCache.key(job.prompt, input_images, image_cfg_kwargs, job.downscale)
+            hit = cache.fetch(cache_key, output_path)
+        if hit:
+            log(f"Cache hit: {cache_key[:12]}")
+            full_path = announce_output(output_path, log)
+            announce_derivatives(output_path, derivatives, log, timer, derivative_pool)
+            return full_path
+
+    if job.downscale and input_images:
+        try:
+            with timer.phase("downscale"):
+                input_images = downscale_inputs(input_images, output_resolution, default_cache_dir(), log)
+        except Exception as e:
+            raise GenerationError(f"Error downscaling input images: {e}") from e
+
+    text_line = None
+    try:
+        genai_client, types = client.get(timer)
+
+        def build_contents(upload_cache: UploadCache | None):
+            return [*image_parts(genai_client, types, input_images, upload_cache, log, retry), job.prompt]
+
+        # Build contents (images first if editing, prompt only if generating)
+        if input_images:
+            with timer.phase("upload" if uploads is not None else "build_request"):
+                contents = build_contents(uploads)
+            img_count = len(input_images)
+            log(f"Processing {img_count} image{'s' if img_count > 1 else ''} with resolution {output_resolution}...")
+        else:
+            contents = job.prompt
+            log(f"Generating image with resolution {output_resolution}...")
+
+        def make_config(timeout: float | None):
+            return generation_config(types, image_cfg_kwargs, timeout)
+
+        def request(contents):
+            if stream:
+                def open_stream(timeout: float | None):
+                    # The request is only sent when the first chunk is pulled, so
+                    # retries cover connecting; errors after that are not retried.
+                    chunks = iter(
+                        genai_client.models.generate_content_stream(
+                            model=MODEL_ID, contents=contents, config=make_config(timeout)
+                        )
+                    )
+                    first = next(chunks, None)
+                    return chunks if first is None else itertools.chain([first], chunks)
+
+                return timer.timed("api", call_with_retries(open_stream, retry, log))
+
+            def generate(timeout: float | None):
+                return genai_client.models.generate_content(
+                    model=MODEL_ID, contents=contents, config=make_config(timeout)
+                )
+
+            return [call_with_retries(generate, retry, log)]
+
+        with timer.phase("api"):
+            responses = with_upload_fallback(
+                request, contents, partial(build_contents, None), uploads, input_images, log
+            )
+
+        # Process response and convert to PNG
+        saved: list[Path] = []
+        text_line = StreamedLine(text_out or sys.stdout, "Model response: ") if stream else None
+        for text, image_data in iter_response_parts(responses, timer):
+            if text is not None:
+                if text_line is not None:
+                    text_line.write(text)
+                else:
+                    log(f"Model response: {text}")
+                continue
+            if text_line is not None:
+                text_line.end()
+            # Streamed images each get their own file and MEDIA: line;
+            # otherwise the last image wins, as before.
+            path = numbered_output_path(output_path, len(saved) + 1) if stream else output_path
+            if path not in saved:
+                # Never write through an existing file: it may be hard-linked into the cache.
+                path.unlink(missing_ok=True)
+                saved.append(path)
+            with timer.phase("save"):
+                save_output_image(image_data, path, PILImage)
+            timer.count("output_bytes", path.stat().st_size)
+            if stream:
+                announce_output(path, log)
+        if text_line is not None:
+            text_line.end()
+    except GenerationError:
+        raise
+    except Exception as e:
+        if text_line is not None:
+            text_line.end()
+        raise GenerationError(f"Error generating image: {e}") from e
+
+    if not saved:
+        raise GenerationError("Error: No image was generated in the response.")
+
+    if cache_key is not None:
+        try:
+            cache.store(cache_key, output_path)
+        except OSError as e:
+            log(f"Warning: could not cache result: {e}")
+
+    full_path = output_path.resolve() if stream else announce_output(output_path, log)
+    announce_derivatives(output_path, derivatives, log, timer, derivative_pool)
+    return full_path
+
+
+def announce_derivatives(
+    output_path: Path,
+    derivatives: list[DerivativeSpec] | None,
+    log=print,
+    timer: PhaseTimer | None = None,
+    pool: ProcessPoolExecutor | None = None,
+) -> None:
+    """Write the requested derivatives of `output_path` and log a MEDIA: line for each."""
+    if not derivatives:
+        return
+    timer = timer or PhaseTimer()
+    try:
+        with timer.phase("derivatives"):
+            written, skipped = write_derivatives(output_path, derivatives, pool)
+    except Exception as e:
+        raise GenerationError(f"Error writing derivatives: {e}") from e
+    for spec in skipped:
+        log(f"Skipped derivative {spec.label}:{spec.fmt}: not smaller than the generated image")
+    for path, width, height in written:
+        timer.count("output_bytes", path.stat().st_size)
+        full_path = path.resolve()
+        log(f"Derivative saved: {full_path} ({width}x{height})")
+        log(f"MEDIA:{full_path}")
+
+
+def numbered_output_path(output_path: Path, n: int) -> Path:
+    """`out.png` for the first image of a response, then `out-2.png`, `out-3.png`, ..."""
+    if n == 1:
+        return output_path
+    return output_path.with_name(f"{output_path.stem}-{n}{output_path.suffix}")
+
+
+class StreamedLine:
+    """One output line assembled from streamed fragments, flushed as each arrives.
+
+    The prefix is written before the first fragment; end() closes the line
+    (if one is open) so the next log line starts on its own.
+    """
+
+    def __init__(self, out, prefix: str):
+        self._out = out
+        self._prefix = prefix
+        self._open = False
+
+    def write(self, text: str) -> None:
+        if not text:
+            return
+        if not self._open:
+            self._out.write(self._prefix)
+            self._open = True
+        self._out.write(text)
+        self._out.flush()
+
+    def end(self) -> None:
+        if self._open:
+            self._out.write("\n")
+            self._out.flush()
+            self._open = False
+
+
+def announce_output(output_path: Path, log=print) -> Path:
+    """Log the saved path and the MEDIA: line; returns the resolved path."""
+    full_path = output_path.resolve()
+    log(f"\nImage saved: {full_path}")
+    # OpenClaw parses MEDIA: tokens and will attach the file on
+    # supported chat providers. Emit the canonical MEDIA:<path> form.
+    log(f"MEDIA:{full_path}")
+    return full_path
+
+
+def run_batch(
+    client: LazyClient | StubBackend,
+    PILImage,
+    jobs: list[Job],
+    concurrency: int,
+    cache: ResultCache | None = None,
+    retry: RetryPolicy | None = None,
+    timer: PhaseTimer | None = None,
+    derivatives: list[DerivativeSpec] | None = None,
+    uploads: UploadCache | None = None,
+) -> int:
+    """Run jobs through one shared client; returns the number of failed jobs.
+
+    Each job's output is buffered and printed as a block (ending in its
+    MEDIA: line) as soon as that job finishes, in completion order. All jobs
+    share `retry`, so its rate limiter and deadline apply to the batch as a whole.
+    Derivatives of every job render in one process pool, so the batch runs at
+    most one worker per CPU however many jobs and sizes are in flight.
+    """
+    total = len(jobs)
+    failures = 0
+    with contextlib.ExitStack() as stack:
+        derivative_pool = None
+        if derivatives and len(derivatives) > 1:
+            derivative_pool = stack.enter_context(
+                ProcessPoolExecutor(max_workers=min(len(derivatives) * max(1, concurrency), os.cpu_count() or 1))
+            )
+
+        def run_buffered(job: Job) -> tuple[list[str], str | None]:
+            lines: list[str] = []
+            try:
+                run_job(
+                    client, PILImage, job, log=lines.append, cache=cache, retry=retry, timer=timer,
+                    derivatives=derivatives, uploads=uploads, derivative_pool=derivative_pool,
+                )
+            except GenerationError as e:
+                return lines, str(e)
+            return lines, None
+
+        # Entered last, so it is shut down (every job finished) before the derivative pool.
+        pool = stack.enter_context(ThreadPoolExecutor(max_workers=max(1, concurrency)))
+        futures = {pool.submit(run_buffered, job): idx for idx, job in enumerate(jobs, start=1)}
+        for future in as_completed(futures):
+            idx = futures[future]
+            lines, error = future.result()
+            print(f"[{idx}/{total}] {jobs[idx - 1].filename}")
+            for line in lines:
+                print(line)
+            if error:
+                failures += 1
+                print(f"[{idx}/{total}] {error}", file=sys.stderr)
+            sys.stdout.flush()
+
+    print(f"\nBatch finished: {total - failures}/{total} images generated.")
+    return failures
+
+
+SESSION_QUIT_COMMANDS = {"/quit", "/exit"}
+
+
+def iter_session_steps(lines, first: Job | None = None):
+    """Yield a Job (or a ValueError for a bad line) per session step.
+
+    A line is a plain-text edit instruction or a JSON object with "prompt" and
+    optional "input_images", "resolution" and "aspect_ratio". Blank lines and
+    # comments are skipped; /quit or /exit ends the session.
+    """
+    if first is not None:
+        yield first
+    for lineno, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line in SESSION_QUIT_COMMANDS:
+            return
+        if not line.startswith("{"):
+            yield Job(prompt=line, filename="-")
+            continue
+        try:
+            yield parse_job({**json.loads(line), "filename": "-"})
+        except (json.JSONDecodeError, ValueError) as e:
+            yield ValueError(f"line {lineno}: {e}")
+
+
+def run_session(
+    client: LazyClient | StubBackend,
+    PILImage,
+    base: Job,
+    lines,
+    log=print,
+    retry: RetryPolicy | None = None,
+    timer: PhaseTimer | None = None,
+    uploads: UploadCache | None = None,
+) -> int:
+    """Iterative editing in one chat; returns the number of failed steps.
+
+    The chat history keeps every earlier prompt and output image, so later
+    instructions edit the last result without re-reading or re-uploading it.
+    `base.prompt` (if set) is the first step and carries `base.input_images`.
+    Step N is saved as <stem>-NN<suffix> next to `base.filename` and announced
+    with a MEDIA: line as soon as it is written.
+    """
+    retry = retry or RetryPolicy()
+    timer = timer or PhaseTimer()
+    output_path = Path(base.filename)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    first = base if base.prompt else None
+    if first is None and base.input_images:
+        # Input images given without a first prompt ride along with the first instruction.
+        first_inputs = base.input_images
+    else:
+        first_inputs = []
+
+    image_config = {"image_size": base.resolution} if base.resolution else {}
+    if base.aspect_ratio:
+        image_config["aspect_ratio"] = base.aspect_ratio
+    chat = None
+    step = 0
+    failures = 0
+
+    for job in iter_session_steps(lines, first):
+        step += 1
+        step_path = output_path.with_name(f"{output_path.stem}-{step:02d}{output_path.suffix}")
+        try:
+            if isinstance(job, ValueError):
+                raise GenerationError(f"Error: Invalid session command ({job})")
+            paths = job.input_images or first_inputs
+            first_inputs = []
+            input_images = []
+            if paths:
+                if len(paths) > MAX_INPUT_IMAGES:
+                    raise GenerationError(
+                        f"Error: Too many input images ({len(paths)}). Maximum is {MAX_INPUT_IMAGES}."
+                    )
+                with timer.phase("load_inputs"):
+                    input_images = load_input_images(paths, PILImage, log)
+                timer.count("input_images", len(input_images))
+                timer.count("input_bytes", sum(len(img.data) for img in input_images))
+            if job.resolution:
+                image_config["image_size"] = job.resolution
+            elif "image_size" not in image_config:
+                max_input_dim = max((max(img.width, img.height) for img in input_images), default=0)
+                image_config["image_size"], _ = choose_output_resolution(None, max_input_dim, bool(input_images))
+            if job.aspect_ratio:
+                image_config["aspect_ratio"] = job.aspect_ratio
+
+            log(f"[step {step}] Editing with resolution {image_config['image_size']}...")
+            try:
+                genai_client, types = client.get(timer)
+                if chat is None:
+                    chat = genai_client.chats.create(model=MODEL_ID)
+                def build_message(upload_cache: UploadCache | None):
+                    return [*image_parts(genai_client, types, input_images, upload_cache, log, retry), job.prompt]
+
+                with timer.phase("upload" if uploads is not None else "build_request"):
+                    message = build_message(uploads)
+                config = dict(image_config)
+
+                def request(message):
+                    def send(timeout: float | None):
+                        return chat.send_message(message, config=generation_config(types, config, timeout))
+
+                    return call_with_retries(send, retry, log)
+
+                with timer.phase("api"):
+                    response = with_upload_fallback(
+                        request, message, partial(build_message, None), uploads, input_images, log
+                    )
+
+                image_saved = False
+                for text, image_data in iter_response_parts([response], timer):
+                    if text is not None:
+                        log(f"Model response: {text}")
+                        continue
+                    if not image_saved:
+                        step_path.unlink(missing_ok=True)
+                    with timer.phase("save"):
+                        save_output_image(image_data, step_path, PILImage)
+                    timer.count("output_bytes", step_path.stat().st_size)
+                    image_saved = True
+            except GenerationError:
+                raise
+            except Exception as e:
+                raise GenerationError(f"Error generating image: {e}") from e
+            if not image_saved:
+                raise GenerationError("Error: No image was generated in the response.")
+        except GenerationError as e:
+            failures += 1
+            print(f"[step {step}] {e}", file=sys.stderr, flush=True)
+            continue
+        announce_output(step_path, log)
+
+    return failures
+
+
+# Environment the thin client passes to the worker with each request.
+FORWARDED_ENV_PREFIXES = ("GEMINI_API_KEY", "NANO_BANANA_", "XDG_CACHE_HOME")
+
+# Set in the --serve process so requests it runs are never forwarded again.
+_IN_WORKER = False
+# Held while the worker runs a request. Requests swap the process-wide cwd,
+# environment and stdout, so only one can run at a time; others are told the
+# worker is busy and run in their own process instead of queueing.
+_WORKER_BUSY = threading.Lock()
+
+
+def default_socket_path() -> Path:
+    """Worker socket: $NANO_BANANA_SOCKET, else worker.sock in the cache dir."""
+    override = os.environ.get("NANO_BANANA_SOCKET")
+    if override:
+        return Path(override).expanduser()
+    return default_cache_dir() / "worker.sock"
+
+
+def forwarded_env() -> dict[str, str]:
+    return {k: v for k, v in os.environ.items() if k.startswith(FORWARDED_ENV_PREFIXES)}
+
+
+class _FrameWriter(io.TextIOBase):
+    """Text stream that sends each write to the client as one JSON-lines frame."""
+
+    def __init__(self, wfile, stream: str, lock: threading.Lock):
+        self._wfile = wfile
+        self._stream = stream
+        self._lock = lock
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: str) -> int:
+        if data:
+            frame = json.dumps({"stream": self._stream, "data": data}).encode("utf-8") + b"\n"
+            with self._lock:
+                self._wfile.write(frame)
+                self._wfile.flush()
+        return len(data)
+
+
+@contextlib.contextmanager
+def _request_context(cwd: str, env: dict[str, str]):
+    """Run one forwarded request in the client's cwd and forwarded environment."""
+    saved_cwd = os.getcwd()
+    saved_env = dict(os.environ)
+    for key in list(os.environ):
+        if key.startswith(FORWARDED_ENV_PREFIXES):
+            del os.environ[key]
+    os.environ.update(env)
+    os.chdir(cwd)
+    try:
+        yield
+    finally:
+        os.chdir(saved_cwd)
+        os.environ.clear()
+        os.environ.update(saved_env)
+
+
+class WorkerHandler(socketserver.StreamRequestHandler):
+    """Runs one forwarded command line with stdout/stderr relayed as frames.
+
+    Replies {"busy": true} without running anything when another request is
+    in progress.
+    """
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            argv, cwd, env = request["argv"], request["cwd"], request.get("env", {})
+        except (ValueError, KeyError, TypeError):
+            return
+        if not _WORKER_BUSY.acquire(blocking=False):
+            try:
+                self.wfile.write(b'{"busy": true}\n')
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            return
+        try:
+            code = self._run(argv, cwd, env)
+        finally:
+            _WORKER_BUSY.release()
+        # Sent after releasing the worker, so a caller that starts its next
+        # command as soon as this one exits is not turned away as busy.
+        try:
+            self.wfile.write(json.dumps({"exit": code}).encode("utf-8") + b"\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _run(self, argv: list[str], cwd: str, env: dict[str, str]) -> int:
+        """Run `argv` with its output relayed as frames; returns the exit code."""
+        lock = threading.Lock()
+        stdout = _FrameWriter(self.wfile, "stdout", lock)
+        stderr = _FrameWriter(self.wfile, "stderr", lock)
+        code = 0
+        try:
+            with _request_context(cwd, env), contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                try:
+                    main(argv)
+                except SystemExit as e:
+                    if isinstance(e.code, int) or e.code is None:
+                        code = e.code or 0
+                    else:
+                        print(e.code, file=sys.stderr)
+                        code = 1
+                except Exception:
+                    traceback.print_exc()
+                    code = 1
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Client went away; the next request starts clean.
+        return code
+
+
+def serve(socket_path: Path, api_key: str | None = None) -> int:
+    """Serve forwarded requests on a Unix socket until interrupted.
+
+    Connections are accepted on their own threads so a busy worker can turn
+    callers away at once; see WorkerHandler.
+    """
+    global _IN_WORKER
+    if not hasattr(socket, "AF_UNIX"):
+        print("Error: --serve needs Unix domain sockets, which this platform lacks.", file=sys.stderr)
+        return 1
+    _IN_WORKER = True
+
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    if socket_path.exists():
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(str(socket_path))
+        except OSError:
+            socket_path.unlink()  # Stale socket from a worker that exited uncleanly.
+        else:
+            print(f"Error: A worker is already listening on {socket_path}", file=sys.stderr)
+            return 1
+        finally:
+            probe.close()
+
+    # Pay the slow imports and client setup once, up front.
+    from google.genai import types  # noqa: F401
+    from PIL import Image  # noqa: F401
+    if api_key:
+        shared_client(api_key).get()
+
+    old_umask = os.umask(0o077)  # The socket carries API keys: owner only.
+    try:
+        server = socketserver.ThreadingUnixStreamServer(str(socket_path), WorkerHandler)
+        server.daemon_threads = True
+    finally:
+        os.umask(old_umask)
+    print(f"nano-banana-pro worker listening on {socket_path} (Ctrl-C to stop)", file=sys.stderr)
+
+    def stop(_signum, _frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        socket_path.unlink(missing_ok=True)
+    return 0
+
+
+def forward_to_worker(argv: list[str], socket_path: Path, stdout=None, stderr=None) -> int | None:
+    """Run `argv` in a warm worker and relay its output.
+
+    Returns None when no worker is listening or it is busy with another
+    request, so the caller runs the command itself.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(socket_path))
+    except OSError:
+        sock.close()
+        return None
+
+    with sock, sock.makefile("rwb") as conn:
+        request = {"argv": argv, "cwd": os.getcwd(), "env": forwarded_env()}
+        conn.write(json.dumps(request).encode("utf-8") + b"\n")
+        conn.flush()
+        for line in conn:
+            frame = json.loads(line)
+            if frame.get("busy"):
+                return None
+            if "exit" in frame:
+                return frame["exit"]
+            out = stdout if frame.get("stream") == "stdout" else stderr
+            out.write(frame.get("data", ""))
+            out.flush()
+    # The request may already have reached the API, so it is not re-run locally.
+    print("Error: Worker closed the connection before the request finished.", file=stderr)
+    return 1
+
+
+def main(argv: list[str] | None = None):
+    timer = PhaseTimer()
     parser = argparse.ArgumentParser(
         description="Generate images using Nano Banana Pro (Gemini 3 Pro Image)"
     )
     parser.add_argument(
         "--prompt", "-p",
-        required=True,
         help="Image description/prompt"
     )
     parser.add_argument(
         "--filename", "-f",
-        required=True,
         help="Output filename (e.g., sunset-mountains.png)"
     )
     parser.add_argument(
@@ -92,7 +1993,7 @@ def main():
     )
     parser.add_argument(
         "--resolution", "-r",
-        choices=["1K", "2K", "4K"],
+        choices=SUPPORTED_RESOLUTIONS,
         default=None,
         help="Output resolution: 1K, 2K, or 4K. If omitted with input images, auto-detect from largest image dimension."
     )
@@ -106,129 +2007,254 @@ def main():
         "--api-key", "-k",
         help="Gemini API key (overrides GEMINI_API_KEY env var)"
     )
+    parser.add_argument(
+        "--downscale-inputs",
+        action="store_true",
+        help="Shrink input images larger than the output resolution before upload (cached by content hash)."
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="JOBS_JSONL",
+        help="Run many jobs from a JSON-lines file (prompt, filename, input_images, resolution, aspect_ratio per line) with one client."
+    )
+    parser.add_argument(
+        "--batch-concurrency",
+        type=int,
+        default=4,
+        help="Jobs in flight at once in --batch mode (default: 4)."
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        default=os.environ.get("NANO_BANANA_RESULT_CACHE", "") not in ("", "0"),
+        help="Reuse results of identical earlier requests from the local cache (or set NANO_BANANA_RESULT_CACHE=1)."
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=int,
+        default=DEFAULT_RESULT_CACHE_MAX_MB,
+        help=f"Result cache size limit; least recently used entries are evicted (default: {DEFAULT_RESULT_CACHE_MAX_MB})."
+    )
+
+    parser.add_argument(
+        "--session",
+        action="store_true",
+        help="Iterative editing: read further instructions (text or JSON lines) from stdin in one chat; step N is saved as <filename stem>-NN.png."
+    )
+    parser.add_argument(
+        "--reuse-uploads",
+        action="store_true",
+        help="Upload each distinct input image once via the Files API and reference it by handle (cached by content hash for ~47h)."
+    )
+    parser.add_argument(
+        "--derivatives",
+        metavar="SPECS",
+        help="Also write resized/re-encoded copies next to --filename, e.g. 2K,1K,512:webp (sizes 1K/2K/4K or pixels; png, webp or jpeg)."
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream the response: print text and save each image (with its MEDIA: line) as soon as it arrives."
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=DEFAULT_MAX_RETRIES,
+        help=f"Retries for rate limits, 5xx and network errors, with jittered backoff (default: {DEFAULT_MAX_RETRIES})."
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=DEFAULT_CALL_TIMEOUT,
+        help=f"Seconds allowed for each API call (default: {DEFAULT_CALL_TIMEOUT:g})."
+    )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        default=None,
+        help="Overall seconds for the whole run, retries included; no call starts after it."
+    )
+    parser.add_argument(
+        "--rpm",
+        type=float,
+        default=None,
+        help="Maximum API calls per minute, shared by all --batch jobs."
+    )
+
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default=os.environ.get("NANO_BANANA_BACKEND") or "gemini",
+        help="gemini (default) or stub: an offline synthetic backend for tests and benchmarks, tuned with NANO_BANANA_STUB_* (or set NANO_BANANA_BACKEND)."
+    )
+    parser.add_argument(
+        "--timings",
+        nargs="?",
+        const="text",
+        choices=TIMINGS_FORMATS,
+        default=os.environ.get("NANO_BANANA_TIMINGS") or None,
+        help="Print per-phase wall times, peak RSS and byte counts to stderr as text or json (or set NANO_BANANA_TIMINGS)."
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Run a warm worker on a local socket ($NANO_BANANA_SOCKET or worker.sock in the cache dir)."
+    )
+    parser.add_argument(
+        "--no-worker",
+        action="store_true",
+        help="Always run in this process, even if a --serve worker is listening (or set NANO_BANANA_NO_WORKER=1)."
+    )
+
+    if argv is None:
+        argv = sys.argv[1:]
+    args = parser.parse_args(argv)
+    started = time.monotonic()
+    if args.timings == "0":
+        args.timings = None
+    elif args.timings not in (None, *TIMINGS_FORMATS):
+        # Any other NANO_BANANA_TIMINGS value (e.g. "1") means text.
+        args.timings = "text"
+
+    if args.serve:
+        if _IN_WORKER:
+            parser.error("--serve cannot be forwarded to a running worker")
+        sys.exit(serve(default_socket_path(), get_api_key(args.api_key)))
+    jobs = None
+    if args.batch:
+        if args.prompt or args.filename or args.input_images:
+            parser.error("--batch cannot be combined with --prompt, --filename or --input-image")
+        if args.stream:
+            parser.error("--stream cannot be combined with --batch (batch output is printed per finished job)")
+        if args.session:
+            parser.error("--session cannot be combined with --batch")
+        try:
+            jobs = load_batch_jobs(args.batch, args.resolution, args.aspect_ratio, args.downscale_inputs)
+        except (OSError, ValueError) as e:
+            print(f"Error reading batch file: {e}", file=sys.stderr)
+            sys.exit(1)
+        if not jobs:
+            print("Error: Batch file contains no jobs.", file=sys.stderr)
+            sys.exit(1)
+    elif args.session:
+        if not args.filename:
+            parser.error("--session requires --filename (steps are saved as <stem>-01.png, <stem>-02.png, ...)")
+        if args.stream or args.cache or args.downscale_inputs:
+            parser.error("--session cannot be combined with --stream, --cache or --downscale-inputs")
+    elif not args.prompt or not args.filename:
+        parser.error("--prompt and --filename are required (unless --batch is used)")
+    if args.max_retries < 0:
+        parser.error("--max-retries must be >= 0")
+    for name in ("timeout", "deadline", "rpm"):
+        value = getattr(args, name)
+        if value is not None and value <= 0:
+            parser.error(f"--{name} must be positive")
+
+    if args.derivatives:
+        if args.session:
+            parser.error("--derivatives cannot be combined with --session")
+        try:
+            args.derivatives = parse_derivatives(args.derivatives)
+        except ValueError as e:
+            parser.error(f"--derivatives: {e}")
+    if args.backend not in BACKENDS:
+        parser.error(f"unknown backend {args.backend!r} (choose from {', '.join(BACKENDS)})")
+    stub_format = os.environ.get("NANO_BANANA_STUB_FORMAT")
+    if args.backend == "stub" and stub_format and stub_format not in STUB_FORMATS:
+        parser.error(f"NANO_BANANA_STUB_FORMAT={stub_format!r} (choose from {', '.join(STUB_FORMATS)})")
 
-    args = parser.parse_args()
+    # Validated here first, so a bad command line fails fast without a round
+    # trip. Sessions read stdin, which the worker cannot see, so they always
+    # run here.
+    if not (_IN_WORKER or args.session or args.no_worker or os.environ.get("NANO_BANANA_NO_WORKER", "") not in ("", "0")):
+        code = forward_to_worker(argv, default_socket_path())
+        if code is not None:
+            sys.exit(code)
 
     # Get API key
     api_key = get_api_key(args.api_key)
-    if not api_key:
+    if not api_key and args.backend == "gemini":
         print("Error: No API key provided.", file=sys.stderr)
         print("Please either:", file=sys.stderr)
         print("  1. Provide --api-key argument", file=sys.stderr)
         print("  2. Set GEMINI_API_KEY environment variable", file=sys.stderr)
         sys.exit(1)
 
-    # Import here after checking API key to avoid slow import on error
-    from google import genai
-    from google.genai import types
-    from PIL import Image as PILImage
-
-    # Initialise client
-    client = genai.Client(api_key=api_key)
-
-    # Set up output path
-    output_path = Path(args.filename)
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-
-    # Load input images if provided (up to 14 supported by Nano Banana Pro)
-    input_images = []
-    max_input_dim = 0
-    if args.input_images:
-        if len(args.input_images) > 14:
-            print(f"Error: Too many input images ({len(args.input_images)}). Maximum is 14.", file=sys.stderr)
-            sys.exit(1)
+    try:
+        code = run_cli(args, jobs, api_key, started, timer)
+    finally:
+        if args.timings:
+            print(timer.report(args.timings), file=sys.stderr)
+    sys.exit(code)
 
-        for img_path in args.input_images:
-            try:
-                with PILImage.open(img_path) as img:
-                    copied = img.copy()
-                    width, height = copied.size
-                input_images.append(copied)
-                print(f"Loaded input image: {img_path}")
-
-                # Track largest dimension for auto-resolution
-                max_input_dim = max(max_input_dim, width, height)
-            except Exception as e:
-                print(f"Error loading input image '{img_path}': {e}", file=sys.stderr)
-                sys.exit(1)
 
-    output_resolution, auto_detected = choose_output_resolution(
-        requested_resolution=args.resolution,
-        max_input_dim=max_input_dim,
-        has_input_images=bool(input_images),
+def run_cli(args, jobs: list[Job] | None, api_key: str | None, started: float, timer: PhaseTimer) -> int:
+    """Run the parsed command line; returns the process exit code."""
+    # google-genai and Pillow are imported on first use, so cache hits stay fast.
+    # The client is shared by every job in --batch mode.
+    if args.backend == "stub":
+        client = StubBackend.from_env()
+        # Build the synthetic outputs for known resolutions now, so the "api"
+        # phase only holds the simulated latency.
+        with timer.phase("stub"):
+            planned = jobs or [
+                Job(prompt=args.prompt, filename=args.filename, resolution=args.resolution, aspect_ratio=args.aspect_ratio)
+            ]
+            for planned_job in planned:
+                if planned_job.resolution:
+                    config = {"image_size": planned_job.resolution}
+                    if planned_job.aspect_ratio:
+                        config["aspect_ratio"] = planned_job.aspect_ratio
+                    client.prepare(config)
+    else:
+        client = shared_client(api_key)
+    cache = None
+    if args.cache:
+        cache = ResultCache(default_cache_dir() / "results", args.cache_max_mb * 1024 * 1024)
+    uploads = None
+    if args.reuse_uploads:
+        if args.backend == "stub":
+            # Stub handles mean nothing to the real API; keep them out of uploads.json.
+            uploads = UploadCache(None, "stub")
+        else:
+            account = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+            uploads = UploadCache(default_cache_dir() / "uploads.json", account)
+    retry = RetryPolicy(
+        max_retries=args.max_retries,
+        timeout=args.timeout,
+        deadline=started + args.deadline if args.deadline else None,
+        limiter=RateLimiter(args.rpm),
     )
-    if auto_detected:
-        print(
-            f"Auto-detected resolution: {output_resolution} "
-            f"(from max input dimension {max_input_dim})"
-        )
 
-    # Build contents (images first if editing, prompt only if generating)
-    if input_images:
-        contents = [*input_images, args.prompt]
-        img_count = len(input_images)
-        print(f"Processing {img_count} image{'s' if img_count > 1 else ''} with resolution {output_resolution}...")
-    else:
-        contents = args.prompt
-        print(f"Generating image with resolution {output_resolution}...")
+    if jobs is not None:
+        failures = run_batch(
+            client, None, jobs, args.batch_concurrency, cache, retry, timer, args.derivatives, uploads
+        )
+        return 1 if failures else 0
 
+    job = Job(
+        prompt=args.prompt,
+        filename=args.filename,
+        input_images=args.input_images or [],
+        resolution=args.resolution,
+        aspect_ratio=args.aspect_ratio,
+        downscale=args.downscale_inputs,
+    )
+    if args.session:
+        log = partial(print, flush=True)
+        failures = run_session(client, None, job, sys.stdin, log=log, retry=retry, timer=timer, uploads=uploads)
+        return 1 if failures else 0
     try:
-        # Build image config with optional aspect ratio
-        image_cfg_kwargs = {"image_size": output_resolution}
-        if args.aspect_ratio:
-            image_cfg_kwargs["aspect_ratio"] = args.aspect_ratio
-
-        response = client.models.generate_content(
-            model="gemini-3-pro-image-preview",
-            contents=contents,
-            config=types.GenerateContentConfig(
-                response_modalities=["TEXT", "IMAGE"],
-                image_config=types.ImageConfig(**image_cfg_kwargs)
-            )
+        # Flush each line so streamed text and MEDIA: lines reach the gateway immediately.
+        log = partial(print, flush=True) if args.stream else print
+        run_job(
+            client, None, job, log=log, cache=cache, retry=retry, stream=args.stream, timer=timer,
+            derivatives=args.derivatives, uploads=uploads,
         )
-
-        # Process response and convert to PNG
-        image_saved = False
-        for part in response.parts:
-            if part.text is not None:
-                print(f"Model response: {part.text}")
-            elif part.inline_data is not None:
-                # Convert inline data to PIL Image and save as PNG
-                from io import BytesIO
-
-                # inline_data.data is already bytes, not base64
-                image_data = part.inline_data.data
-                if isinstance(image_data, str):
-                    # If it's a string, it might be base64
-                    import base64
-                    image_data = base64.b64decode(image_data)
-
-                image = PILImage.open(BytesIO(image_data))
-
-                # Ensure RGB mode for PNG (convert RGBA to RGB with white background if needed)
-                if image.mode == 'RGBA':
-                    rgb_image = PILImage.new('RGB', image.size, (255, 255, 255))
-                    rgb_image.paste(image, mask=image.split()[3])
-                    rgb_image.save(str(output_path), 'PNG')
-                elif image.mode == 'RGB':
-                    image.save(str(output_path), 'PNG')
-                else:
-                    image.convert('RGB').save(str(output_path), 'PNG')
-                image_saved = True
-
-        if image_saved:
-            full_path = output_path.resolve()
-            print(f"\nImage saved: {full_path}")
-            # OpenClaw parses MEDIA: tokens and will attach the file on
-            # supported chat providers. Emit the canonical MEDIA:<path> form.
-            print(f"MEDIA:{full_path}")
-        else:
-            print("Error: No image was generated in the response.", file=sys.stderr)
-            sys.exit(1)
-
-    except Exception as e:
-        print(f"Error generating image: {e}", file=sys.stderr)
-        sys.exit(1)
+    except GenerationError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    return 0
 
 
 if __name__ == "__main__":
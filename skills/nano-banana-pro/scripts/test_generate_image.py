@@ -1,5 +1,11 @@
 import importlib.util
+import io
+import json
+import os
+import sys
+import time
 from pathlib import Path
+from types import SimpleNamespace
 
 import pytest
 
@@ -7,6 +13,8 @@ MODULE_PATH = Path(__file__).with_name("generate_image.py")
 SPEC = importlib.util.spec_from_file_location("generate_image", MODULE_PATH)
 assert SPEC and SPEC.loader
 MODULE = importlib.util.module_from_spec(SPEC)
+# Registered so worker processes can unpickle module-level functions.
+sys.modules[SPEC.name] = MODULE
 SPEC.loader.exec_module(MODULE)
 
 
@@ -34,3 +42,791 @@ def test_choose_output_resolution_defaults_to_1k_without_inputs():
 
 def test_choose_output_resolution_respects_explicit_1k_with_large_input():
     assert MODULE.choose_output_resolution("1K", 3500, True) == ("1K", False)
+
+
+def test_parse_job_applies_defaults_and_normalizes_inputs():
+    job = MODULE.parse_job(
+        {"prompt": "a cat", "filename": "cat.png", "input_images": "in.png"},
+        default_resolution="2K",
+        default_aspect_ratio="16:9",
+    )
+    assert job == MODULE.Job("a cat", "cat.png", ["in.png"], "2K", "16:9")
+
+
+@pytest.mark.parametrize(
+    ("raw", "message"),
+    [
+        ({"filename": "x.png"}, "missing 'prompt'"),
+        ({"prompt": "x"}, "missing 'filename'"),
+        ({"prompt": "x", "filename": "x.png", "resolution": "8K"}, "invalid resolution"),
+        ({"prompt": "x", "filename": "x.png", "aspect_ratio": "7:3"}, "invalid aspect_ratio"),
+        ({"prompt": "x", "filename": "x.png", "input_images": ["a"] * 15}, "too many input images"),
+    ],
+)
+def test_parse_job_rejects_invalid_lines(raw, message):
+    with pytest.raises(ValueError, match=message):
+        MODULE.parse_job(raw)
+
+
+def test_load_batch_jobs_reports_line_numbers(tmp_path):
+    jobs_file = tmp_path / "jobs.jsonl"
+    jobs_file.write_text(
+        '# comment\n{"prompt": "a", "filename": "a.png"}\n\n{"prompt": "b"}\n', encoding="utf-8"
+    )
+    with pytest.raises(ValueError, match=r"jobs.jsonl:4: missing 'filename'"):
+        MODULE.load_batch_jobs(str(jobs_file))
+
+
+class RecordingStub(MODULE.StubBackend):
+    """StubBackend that records each request; the prompt "fail" raises a non-retryable error."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.requests = []
+        self.chats_created = 0
+
+    def _respond(self, contents, config):
+        self.requests.append((contents, config))
+        if contents == "fail":
+            raise RuntimeError("quota exceeded")
+        return super()._respond(contents, config)
+
+    def create(self, model):
+        self.chats_created += 1
+        return super().create(model)
+
+
+def test_run_batch_shares_one_client_and_reports_each_job(tmp_path, capsys):
+    image_mod = pytest.importorskip("PIL.Image")
+    stub = RecordingStub()
+    jobs = [
+        MODULE.Job("a", str(tmp_path / "a.png"), resolution="1K"),
+        MODULE.Job("fail", str(tmp_path / "b.png")),
+        MODULE.Job("c", str(tmp_path / "c.png"), aspect_ratio="16:9"),
+    ]
+
+    failures = MODULE.run_batch(stub, image_mod, jobs, concurrency=2)
+
+    assert failures == 1
+    out, err = capsys.readouterr()
+    assert f"MEDIA:{(tmp_path / 'a.png').resolve()}" in out
+    assert f"MEDIA:{(tmp_path / 'c.png').resolve()}" in out
+    assert "Error generating image: quota exceeded" in err
+    assert len(stub.requests) == 3
+    configs = dict(stub.requests)
+    assert configs["c"].image_config == {"image_size": "1K", "aspect_ratio": "16:9"}
+    assert configs["c"].http_options == {"timeout": 300_000}
+
+
+def encode_image(fmt, size=(40, 30), mode="RGB", **save_kwargs):
+    image_mod = pytest.importorskip("PIL.Image")
+    buf = io.BytesIO()
+    image_mod.new(mode, size).save(buf, fmt, **save_kwargs)
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize(
+    ("fmt", "save_kwargs", "mime"),
+    [
+        ("PNG", {}, "image/png"),
+        ("JPEG", {}, "image/jpeg"),
+        ("JPEG", {"progressive": True}, "image/jpeg"),
+        ("GIF", {}, "image/gif"),
+        ("WEBP", {"lossless": True}, "image/webp"),
+        ("WEBP", {"quality": 80}, "image/webp"),
+    ],
+)
+def test_probe_image_size_reads_headers(fmt, save_kwargs, mime):
+    data = encode_image(fmt, size=(123, 45), **save_kwargs)
+    assert MODULE.probe_image_size(data) == (mime, 123, 45)
+
+
+def test_probe_image_size_returns_none_for_unknown_data():
+    assert MODULE.probe_image_size(b"not an image at all") is None
+
+
+def test_load_input_image_keeps_original_bytes(tmp_path):
+    data = encode_image("JPEG", size=(64, 48))
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(data)
+
+    class NoPIL:
+        @staticmethod
+        def open(*_args, **_kwargs):
+            raise AssertionError("supported formats must not be decoded")
+
+    loaded = MODULE.load_input_image(str(path), NoPIL)
+
+    assert loaded.data == data
+    assert (loaded.mime_type, loaded.width, loaded.height) == ("image/jpeg", 64, 48)
+
+
+def test_load_input_image_transcodes_unsupported_formats(tmp_path):
+    image_mod = pytest.importorskip("PIL.Image")
+    path = tmp_path / "scan.bmp"
+    path.write_bytes(encode_image("BMP", size=(20, 10)))
+
+    loaded = MODULE.load_input_image(str(path), image_mod)
+
+    assert loaded.mime_type == "image/png"
+    assert MODULE.probe_image_size(loaded.data) == ("image/png", 20, 10)
+
+
+def test_run_job_sends_inputs_as_inline_bytes(tmp_path):
+    image_mod = pytest.importorskip("PIL.Image")
+    data = encode_image("PNG", size=(1600, 900))
+    src = tmp_path / "in.png"
+    src.write_bytes(data)
+    stub = RecordingStub()
+    job = MODULE.Job("edit it", str(tmp_path / "out.png"), [str(src)])
+
+    MODULE.run_job(stub, image_mod, job, log=lambda _line: None)
+
+    (part, prompt), config = stub.requests[0]
+    assert (part.inline_data.data, part.inline_data.mime_type, prompt) == (data, "image/png", "edit it")
+    assert config.image_config == {"image_size": "2K"}
+
+
+def test_downscale_inputs_resizes_and_reuses_cached_derivatives(tmp_path, monkeypatch):
+    pytest.importorskip("PIL.Image")
+    big = encode_image("JPEG", size=(3000, 1500))
+    alpha = encode_image("PNG", size=(2400, 2400), mode="RGBA")
+    small = encode_image("PNG", size=(800, 600))
+    images = [
+        MODULE.InputImage("big.jpg", big, "image/jpeg", 3000, 1500),
+        MODULE.InputImage("alpha.png", alpha, "image/png", 2400, 2400),
+        MODULE.InputImage("small.png", small, "image/png", 800, 600),
+    ]
+
+    first = MODULE.downscale_inputs(images, "1K", tmp_path, log=lambda _line: None)
+
+    assert [(img.mime_type, img.width, img.height) for img in first] == [
+        ("image/jpeg", 1024, 512),
+        ("image/webp", 1024, 1024),
+        ("image/png", 800, 600),
+    ]
+    assert first[2] is images[2]
+    assert len(list((tmp_path / "derivatives").iterdir())) == 2
+
+    def fail(*_args):
+        raise AssertionError("cached derivatives must not be resized again")
+
+    monkeypatch.setattr(MODULE, "make_derivative", fail)
+    logged = []
+    second = MODULE.downscale_inputs(images, "1K", tmp_path, log=logged.append)
+
+    assert [img.data for img in second] == [img.data for img in first]
+    assert all("cached" in line for line in logged)
+
+
+def test_batch_jobs_sharing_an_input_downscale_it_once(tmp_path, monkeypatch, capsys):
+    image_mod = pytest.importorskip("PIL.Image")
+    monkeypatch.setenv("NANO_BANANA_CACHE_DIR", str(tmp_path / "cache"))
+    src = tmp_path / "big.jpg"
+    src.write_bytes(encode_image("JPEG", size=(3000, 2000)))
+    resized = []
+    real_make = MODULE.make_derivative
+
+    def slow_make(*args):
+        resized.append(args[2])
+        time.sleep(0.05)
+        return real_make(*args)
+
+    monkeypatch.setattr(MODULE, "make_derivative", slow_make)
+    stub = RecordingStub()
+    jobs = [
+        MODULE.Job(f"job {i}", str(tmp_path / f"out{i}.png"), [str(src)], resolution="1K", downscale=True)
+        for i in range(6)
+    ]
+
+    failures = MODULE.run_batch(stub, image_mod, jobs, concurrency=6)
+
+    assert failures == 0, capsys.readouterr().err
+    assert len(resized) == 1
+    assert len(stub.requests) == 6
+    sent = {contents[0].inline_data.data for contents, _ in stub.requests}
+    assert len(sent) == 1
+    assert MODULE.probe_image_size(sent.pop())[1:] == (1024, 683)
+    assert not list((tmp_path / "cache" / "derivatives").glob("*.tmp"))
+    # Per-key locks are released with their last user, so a long-lived worker does not collect them.
+    assert MODULE._DERIVATIVE_LOCKS == {}
+
+
+def test_load_input_images_keeps_order_and_reports_every_failure(tmp_path):
+    paths = []
+    for idx, size in enumerate([(10, 10), (30, 20), (5, 40)]):
+        path = tmp_path / f"in-{idx}.png"
+        path.write_bytes(encode_image("PNG", size=size))
+        paths.append(str(path))
+
+    logged = []
+    images = MODULE.load_input_images(paths, log=logged.append)
+    assert [(img.path, img.width, img.height) for img in images] == [
+        (paths[0], 10, 10),
+        (paths[1], 30, 20),
+        (paths[2], 5, 40),
+    ]
+    assert logged == [f"Loaded input image: {path}" for path in paths]
+
+    missing = [str(tmp_path / "missing-a.png"), paths[0], str(tmp_path / "missing-b.png")]
+    with pytest.raises(MODULE.GenerationError) as excinfo:
+        MODULE.load_input_images(missing, log=lambda _line: None)
+    lines = str(excinfo.value).splitlines()
+    assert len(lines) == 2
+    assert "missing-a.png" in lines[0] and "missing-b.png" in lines[1]
+
+
+def test_save_output_image_writes_rgb_png_bytes_verbatim(tmp_path):
+    data = encode_image("PNG", size=(16, 16))
+    out = tmp_path / "out.png"
+
+    class NoPIL:
+        @staticmethod
+        def open(*_args, **_kwargs):
+            raise AssertionError("RGB PNG output must not be decoded")
+
+    MODULE.save_output_image(data, out, NoPIL)
+
+    assert out.read_bytes() == data
+
+
+@pytest.mark.parametrize("mode", ["RGBA", "LA"])
+def test_save_output_image_flattens_alpha_onto_white(tmp_path, mode):
+    image_mod = pytest.importorskip("PIL.Image")
+    buf = io.BytesIO()
+    color = (0, 0, 0, 0) if mode == "RGBA" else (0, 0)
+    image_mod.new(mode, (4, 4), color).save(buf, "PNG")
+    out = tmp_path / "out.png"
+
+    MODULE.save_output_image(buf.getvalue(), out, image_mod)
+
+    with image_mod.open(out) as saved:
+        assert saved.mode == "RGB"
+        assert saved.getpixel((0, 0)) == (255, 255, 255)
+
+
+def test_save_output_image_converts_jpeg_to_png(tmp_path):
+    image_mod = pytest.importorskip("PIL.Image")
+    out = tmp_path / "out.png"
+
+    MODULE.save_output_image(encode_image("JPEG", size=(8, 6)), out, image_mod)
+
+    assert MODULE.is_rgb_png(out.read_bytes())
+
+
+def test_result_cache_serves_identical_requests_without_the_api(tmp_path):
+    image_mod = pytest.importorskip("PIL.Image")
+    src = tmp_path / "in.png"
+    src.write_bytes(encode_image("PNG", size=(64, 64)))
+    stub = RecordingStub()
+    cache = MODULE.ResultCache(tmp_path / "cache", max_bytes=10**6)
+    first = MODULE.Job("edit it", str(tmp_path / "a.png"), [str(src)])
+    second = MODULE.Job("edit it", str(tmp_path / "b.png"), [str(src)])
+
+    MODULE.run_job(stub, image_mod, first, log=lambda _line: None, cache=cache)
+    lines = []
+    path = MODULE.run_job(SimpleNamespace(get=None), image_mod, second, log=lines.append, cache=cache)
+
+    assert len(stub.requests) == 1
+    assert path.read_bytes() == (tmp_path / "a.png").read_bytes()
+    assert lines[-1] == f"MEDIA:{path}"
+    assert any(line.startswith("Cache hit:") for line in lines)
+
+    # Any change to the inputs or image config is a different entry.
+    src.write_bytes(encode_image("PNG", size=(64, 65)))
+    MODULE.run_job(stub, image_mod, second, log=lambda _line: None, cache=cache)
+    changed = MODULE.Job("edit it", str(tmp_path / "b.png"), [str(src)], aspect_ratio="1:1")
+    MODULE.run_job(stub, image_mod, changed, log=lambda _line: None, cache=cache)
+    assert len(stub.requests) == 3
+
+
+def test_place_file_keeps_the_destination_when_the_source_is_gone(tmp_path):
+    dest = tmp_path / "out.png"
+    dest.write_bytes(b"\x89PNG earlier")
+
+    # The cache entry was evicted between the lookup and the link.
+    with pytest.raises(FileNotFoundError):
+        MODULE.place_file(tmp_path / "evicted.png", dest)
+
+    assert dest.read_bytes() == b"\x89PNG earlier"
+    assert [p.name for p in tmp_path.iterdir()] == ["out.png"]
+
+    src = tmp_path / "entry.png"
+    src.write_bytes(b"\x89PNG cached")
+    MODULE.place_file(src, dest)
+    assert dest.read_bytes() == b"\x89PNG cached"
+
+
+def test_result_cache_evicts_least_recently_used_entries(tmp_path):
+    cache = MODULE.ResultCache(tmp_path / "cache", max_bytes=10**6)
+    for i, key in enumerate(["old", "used", "new"]):
+        src = tmp_path / f"{key}.png"
+        src.write_bytes(b"x" * 100)
+        cache.store(key, src)
+        os.utime(cache.entry(key), (1000 + i, 1000 + i))
+
+    assert cache.fetch("old", tmp_path / "out.png")
+    cache.max_bytes = 250
+    cache.evict()
+
+    assert sorted(p.stem for p in cache.root.glob("*.png")) == ["new", "old"]
+
+
+def test_call_with_retries_retries_transient_errors_only(monkeypatch):
+    monkeypatch.setattr(MODULE, "backoff_delay", lambda attempt: 0.0)
+    outcomes = [MODULE.StubAPIError(503), TimeoutError("read timed out"), "ok"]
+    timeouts = []
+
+    def call(timeout):
+        timeouts.append(timeout)
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    lines = []
+    policy = MODULE.RetryPolicy(max_retries=3, timeout=30)
+    assert MODULE.call_with_retries(call, policy, lines.append) == "ok"
+    assert timeouts == [30, 30, 30]
+    assert len(lines) == 2
+
+    def fatal(_timeout):
+        timeouts.append("fatal")
+        raise MODULE.StubAPIError(400)
+
+    timeouts.clear()
+    with pytest.raises(MODULE.StubAPIError):
+        MODULE.call_with_retries(fatal, policy, lines.append)
+    assert timeouts == ["fatal"]
+
+
+def test_call_with_retries_respects_budget_and_deadline(monkeypatch):
+    monkeypatch.setattr(MODULE, "backoff_delay", lambda attempt: 0.0)
+    calls = []
+
+    def overloaded(timeout):
+        calls.append(timeout)
+        raise MODULE.StubAPIError(429)
+
+    with pytest.raises(MODULE.StubAPIError):
+        MODULE.call_with_retries(overloaded, MODULE.RetryPolicy(max_retries=2), lambda _line: None)
+    assert len(calls) == 3
+
+    calls.clear()
+    policy = MODULE.RetryPolicy(timeout=300, deadline=MODULE.time.monotonic() + 5)
+    with pytest.raises(MODULE.StubAPIError):
+        MODULE.call_with_retries(overloaded, policy, lambda _line: None)
+    # Per-call timeouts are capped by the time left before the deadline.
+    assert all(timeout <= 5 for timeout in calls)
+
+    expired = MODULE.RetryPolicy(deadline=MODULE.time.monotonic() - 1)
+    with pytest.raises(MODULE.GenerationError, match="Deadline exceeded"):
+        MODULE.call_with_retries(overloaded, expired, lambda _line: None)
+
+
+def test_rate_limiter_spaces_calls_across_threads():
+    limiter = MODULE.RateLimiter(rpm=60 * 20)  # one slot every 50 ms
+    started = MODULE.time.monotonic()
+    with MODULE.ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(lambda _: limiter.acquire(), range(4)))
+    assert MODULE.time.monotonic() - started >= 0.15
+
+    with pytest.raises(MODULE.GenerationError, match="Deadline exceeded"):
+        limiter.acquire(deadline=MODULE.time.monotonic())
+
+
+def test_rate_limit_response_pauses_every_job_sharing_the_policy(monkeypatch):
+    monkeypatch.setattr(MODULE, "backoff_delay", lambda attempt: 0.2)
+    policy = MODULE.RetryPolicy(max_retries=1)  # no --rpm: calls are not spaced otherwise
+    limited = MODULE.threading.Event()
+    started = {}
+
+    def first(timeout):
+        if not limited.is_set():
+            started["limited"] = MODULE.time.monotonic()
+            limited.set()
+            raise MODULE.StubAPIError(429)
+        return "first"
+
+    def second(timeout):
+        started["second"] = MODULE.time.monotonic()
+        return "second"
+
+    def other_job():
+        limited.wait()
+        return MODULE.call_with_retries(second, policy, lambda _line: None)
+
+    with MODULE.ThreadPoolExecutor(max_workers=2) as pool:
+        results = [pool.submit(MODULE.call_with_retries, first, policy, lambda _line: None), pool.submit(other_job)]
+        assert [f.result() for f in results] == ["first", "second"]
+    assert started["second"] - started["limited"] >= 0.15
+
+
+def test_run_job_stream_saves_and_announces_each_image_on_arrival(tmp_path):
+    image_mod = pytest.importorskip("PIL.Image")
+    events = []
+
+    class TwoImageStub(RecordingStub):
+        def generate_content_stream(self, model, contents, config=None):
+            png = self.prepare(config.image_config)
+            yield SimpleNamespace(parts=[SimpleNamespace(text="Here you go", inline_data=None)])
+            yield SimpleNamespace(parts=None)
+            for text in ("first", "second"):
+                events.append(f"yield {text}")
+                yield SimpleNamespace(
+                    parts=[
+                        SimpleNamespace(text=None, inline_data=SimpleNamespace(data=png)),
+                        SimpleNamespace(text=f"{text} done", inline_data=None),
+                    ]
+                )
+
+    job = MODULE.Job("two cats", str(tmp_path / "cats.png"))
+    text_out = SimpleNamespace(write=events.append, flush=lambda: events.append("flush"))
+
+    path = MODULE.run_job(TwoImageStub(), image_mod, job, log=events.append, stream=True, text_out=text_out)
+
+    first, second = (tmp_path / "cats.png").resolve(), (tmp_path / "cats-2.png").resolve()
+    assert path == first
+    assert second.exists()
+    assert events.index(f"MEDIA:{first}") < events.index("yield second") < events.index(f"MEDIA:{second}")
+    assert events.index("Here you go") < events.index("yield first")
+    assert events[-5:] == ["Model response: ", "second done", "flush", "\n", "flush"]
+
+
+def test_run_job_stream_writes_text_fragments_on_one_line(tmp_path, capsys):
+    image_mod = pytest.importorskip("PIL.Image")
+
+    class FragmentStub(RecordingStub):
+        def generate_content_stream(self, model, contents, config=None):
+            for text in ("A red ", "square", " on white."):
+                yield SimpleNamespace(parts=[SimpleNamespace(text=text, inline_data=None)])
+            png = self.prepare(config.image_config)
+            yield SimpleNamespace(parts=[SimpleNamespace(text=None, inline_data=SimpleNamespace(data=png))])
+            yield SimpleNamespace(parts=[SimpleNamespace(text="Done.", inline_data=None)])
+
+    job = MODULE.Job("square", str(tmp_path / "sq.png"))
+
+    MODULE.run_job(FragmentStub(), image_mod, job, log=print, stream=True)
+
+    lines = capsys.readouterr().out.splitlines()
+    media = f"MEDIA:{(tmp_path / 'sq.png').resolve()}"
+    assert lines.count("Model response: A red square on white.") == 1
+    assert lines.index("Model response: A red square on white.") < lines.index(media)
+    assert lines[-1] == "Model response: Done."
+
+
+@pytest.fixture
+def worker_socket(tmp_path, monkeypatch):
+    socketserver = pytest.importorskip("socketserver")
+    if not hasattr(socketserver, "ThreadingUnixStreamServer"):
+        pytest.skip("Unix sockets not available")
+    monkeypatch.setattr(MODULE, "_IN_WORKER", True)
+    path = tmp_path / "w.sock"
+    server = socketserver.ThreadingUnixStreamServer(str(path), MODULE.WorkerHandler)
+    server.daemon_threads = True
+    thread = MODULE.threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05})
+    thread.start()
+    yield path
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_forward_to_worker_relays_output_and_exit_code(tmp_path, monkeypatch, worker_socket):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("NANO_BANANA_CACHE_DIR", str(tmp_path / "cache"))
+    src = tmp_path / "cached.png"
+    src.write_bytes(b"\x89PNG cached")
+    key = MODULE.ResultCache.key("hi", [], {"image_size": "1K"})
+    MODULE.ResultCache(tmp_path / "cache" / "results", 10**6).store(key, src)
+
+    out, err = io.StringIO(), io.StringIO()
+    argv = ["--prompt", "hi", "--filename", "out.png", "--cache", "--api-key", "k"]
+    assert MODULE.forward_to_worker(argv, worker_socket, out, err) == 0
+    # Relative paths resolve against the client's working directory.
+    assert f"MEDIA:{(tmp_path / 'out.png').resolve()}" in out.getvalue()
+    assert (tmp_path / "out.png").read_bytes() == b"\x89PNG cached"
+
+    out, err = io.StringIO(), io.StringIO()
+    assert MODULE.forward_to_worker(["--prompt", "hi"], worker_socket, out, err) == 2
+    assert "--prompt and --filename are required" in err.getvalue()
+
+
+def test_busy_worker_turns_requests_away_without_running_them(tmp_path, monkeypatch, worker_socket):
+    monkeypatch.chdir(tmp_path)
+    out, err = io.StringIO(), io.StringIO()
+    argv = ["--backend", "stub", "--prompt", "hi", "--filename", "out.png"]
+
+    with MODULE._WORKER_BUSY:
+        assert MODULE.forward_to_worker(argv, worker_socket, out, err) is None
+
+    assert out.getvalue() == err.getvalue() == ""
+    assert not (tmp_path / "out.png").exists()
+
+
+def test_invalid_arguments_fail_before_reaching_the_worker(monkeypatch, capsys):
+    monkeypatch.delenv("NANO_BANANA_NO_WORKER", raising=False)
+
+    def forward(*_args):
+        raise AssertionError("an invalid command must not be forwarded")
+
+    monkeypatch.setattr(MODULE, "forward_to_worker", forward)
+    with pytest.raises(SystemExit) as exit_info:
+        MODULE.main(["--prompt", "hi", "--filename", "out.png", "--timeout", "0"])
+
+    assert exit_info.value.code == 2
+    assert "--timeout must be positive" in capsys.readouterr().err
+
+
+def test_served_runs_label_peak_rss_as_the_workers(monkeypatch):
+    if MODULE.peak_rss_mb() is None:
+        pytest.skip("peak RSS is not reported on this platform")
+    assert "peak_rss_mb" in MODULE.PhaseTimer().summary()
+    monkeypatch.setattr(MODULE, "_IN_WORKER", True)
+    summary = MODULE.PhaseTimer().summary()
+    assert "worker_peak_rss_mb" in summary
+    assert "peak_rss_mb" not in summary
+
+
+def test_serve_fails_cleanly_without_unix_sockets(tmp_path, monkeypatch, capsys):
+    monkeypatch.delattr(MODULE.socket, "AF_UNIX", raising=False)
+
+    assert MODULE.serve(tmp_path / "w.sock") == 1
+    assert "Unix domain sockets" in capsys.readouterr().err
+    assert not MODULE._IN_WORKER
+
+
+def test_forward_to_worker_returns_none_without_a_worker(tmp_path):
+    assert MODULE.forward_to_worker(["--prompt", "x"], tmp_path / "missing.sock") is None
+
+
+def test_phase_timer_reports_phases_and_counters_for_a_job(tmp_path):
+    image_mod = pytest.importorskip("PIL.Image")
+    src = tmp_path / "in.png"
+    src.write_bytes(encode_image("PNG", size=(32, 32)))
+    stub = RecordingStub()
+    timer = MODULE.PhaseTimer()
+    job = MODULE.Job("edit it", str(tmp_path / "out.png"), [str(src)])
+
+    MODULE.run_job(stub, image_mod, job, log=lambda _line: None, timer=timer)
+
+    data = MODULE.json.loads(timer.report("json"))
+    assert {"load_inputs", "build_request", "api", "save"} <= set(data["phases"])
+    assert data["input_images"] == 1
+    assert data["input_bytes"] == src.stat().st_size
+    assert data["output_bytes"] == len(stub.prepare({"image_size": "1K"}))
+    assert timer.report("text").startswith("timings: load_inputs ")
+
+
+def test_run_session_reuses_one_chat_and_saves_every_step(tmp_path, capsys):
+    image_mod = pytest.importorskip("PIL.Image")
+    src = tmp_path / "in.png"
+    src.write_bytes(encode_image("PNG", size=(32, 32)))
+    stub = RecordingStub()
+    base = MODULE.Job("start", str(tmp_path / "edit.png"), [str(src)])
+    lines = ["brighter", "", '{"prompt": "crop", "aspect_ratio": "1:1"}', "{bad", "/quit", "never"]
+
+    logged = []
+    failures = MODULE.run_session(stub, image_mod, base, lines, log=logged.append)
+
+    assert failures == 1
+    assert stub.chats_created == 1
+    assert [message[-1] for message, _ in stub.requests] == ["start", "brighter", "crop"]
+    # Only the first step uploads the input image; later steps edit the chat's last result.
+    assert len(stub.requests[0][0]) == 2
+    assert len(stub.requests[1][0]) == 1
+    assert stub.requests[2][1].image_config == {"image_size": "1K", "aspect_ratio": "1:1"}
+    for n in (1, 2, 3):
+        assert f"MEDIA:{(tmp_path / f'edit-0{n}.png').resolve()}" in logged
+    assert "[step 4] Error: Invalid session command (line 4:" in capsys.readouterr().err
+
+
+def test_stub_backend_runs_a_job_offline_with_sized_output(tmp_path):
+    backend = MODULE.StubBackend(payload_bytes=50_000)
+    job = MODULE.Job("a cat", str(tmp_path / "cat.png"), resolution="2K", aspect_ratio="16:9")
+    lines = []
+
+    path = MODULE.run_job(backend, None, job, log=lines.append)
+
+    data = path.read_bytes()
+    assert MODULE.probe_image_size(data) == ("image/png", 2048, 1152)
+    assert len(data) == 50_000
+    assert "Model response: stub: a cat" in lines
+
+
+@pytest.mark.parametrize("image_format", ["rgba", "jpeg"])
+def test_stub_backend_formats_take_the_convert_path_on_save(tmp_path, image_format):
+    image_mod = pytest.importorskip("PIL.Image")
+    backend = MODULE.StubBackend(payload_bytes=200_000, image_format=image_format)
+    returned = backend.prepare({"image_size": "1K", "aspect_ratio": "4:3"})
+    assert not MODULE.is_rgb_png(returned)
+    assert len(returned) == 200_000
+    job = MODULE.Job("a cat", str(tmp_path / "cat.png"), resolution="1K", aspect_ratio="4:3")
+
+    path = MODULE.run_job(backend, image_mod, job, log=lambda _line: None)
+
+    assert MODULE.is_rgb_png(path.read_bytes())
+    with image_mod.open(path) as img:
+        assert (img.mode, img.size) == ("RGB", (1024, 768))
+
+
+def test_stub_backend_injected_errors_are_retried_then_reported(tmp_path, monkeypatch):
+    monkeypatch.setattr(MODULE, "backoff_delay", lambda attempt: 0.0)
+    backend = MODULE.StubBackend(error_rate=1.0, error_code=429)
+    job = MODULE.Job("a cat", str(tmp_path / "cat.png"))
+
+    with pytest.raises(MODULE.GenerationError, match="429 stub injected error"):
+        MODULE.run_job(backend, None, job, log=lambda _line: None, retry=MODULE.RetryPolicy(max_retries=2))
+    assert backend.calls == 3
+
+    fatal = MODULE.StubBackend(error_rate=1.0, error_code=400)
+    with pytest.raises(MODULE.GenerationError):
+        MODULE.run_job(fatal, None, job, log=lambda _line: None)
+    assert fatal.calls == 1
+
+
+def test_parse_derivatives_reads_sizes_and_formats():
+    specs = MODULE.parse_derivatives("2K, 1k,512:webp,512:WEBP,300:jpeg")
+    assert specs == [
+        MODULE.DerivativeSpec("2K", 2048),
+        MODULE.DerivativeSpec("1K", 1024),
+        MODULE.DerivativeSpec("512", 512, "webp"),
+        MODULE.DerivativeSpec("300", 300, "jpeg"),
+    ]
+    for bad in ("8K", "512:gif", "-5", ","):
+        with pytest.raises(ValueError):
+            MODULE.parse_derivatives(bad)
+
+
+def test_run_job_writes_derivatives_and_skips_those_needing_upscaling(tmp_path):
+    pytest.importorskip("PIL.Image")
+    job = MODULE.Job("hero", str(tmp_path / "hero.png"), resolution="1K", aspect_ratio="16:9")
+    specs = MODULE.parse_derivatives("2K,512:webp,256:jpeg")
+    lines = []
+
+    MODULE.run_job(MODULE.StubBackend(), None, job, log=lines.append, derivatives=specs)
+
+    expected = {"hero-512.webp": (512, 288), "hero-256.jpg": (256, 144)}
+    for name, size in expected.items():
+        path = (tmp_path / name).resolve()
+        assert f"MEDIA:{path}" in lines
+        assert MODULE.probe_image_size(path.read_bytes())[1:] == size
+    assert lines.index(f"MEDIA:{(tmp_path / 'hero.png').resolve()}") < lines.index(
+        f"MEDIA:{(tmp_path / 'hero-512.webp').resolve()}"
+    )
+    # A 2K copy of a 1K image would only be a mislabelled copy.
+    assert "Skipped derivative 2K:png: not smaller than the generated image" in lines
+    assert not (tmp_path / "hero-2K.png").exists()
+    assert not any("hero-2K" in line for line in lines if line.startswith("MEDIA:"))
+
+
+def test_batch_renders_every_jobs_derivatives_in_one_process_pool(tmp_path, monkeypatch, capsys):
+    pytest.importorskip("PIL.Image")
+    pools = []
+
+    class CountingPool(MODULE.ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            pools.append(self)
+
+    monkeypatch.setattr(MODULE, "ProcessPoolExecutor", CountingPool)
+    jobs = [MODULE.Job(f"hero {i}", str(tmp_path / f"hero{i}.png"), resolution="1K") for i in range(3)]
+
+    failures = MODULE.run_batch(
+        MODULE.StubBackend(), None, jobs, concurrency=3, derivatives=MODULE.parse_derivatives("512,256:webp")
+    )
+
+    assert failures == 0, capsys.readouterr().err
+    assert len(pools) == 1
+    for i in range(3):
+        assert MODULE.probe_image_size((tmp_path / f"hero{i}-256.webp").read_bytes())[1:] == (256, 256)
+        assert (tmp_path / f"hero{i}-512.png").exists()
+
+
+def test_upload_cache_uploads_shared_inputs_once_across_jobs_and_runs(tmp_path):
+    src = tmp_path / "brand.png"
+    src.write_bytes(encode_image("PNG", size=(40, 40)))
+    backend = MODULE.StubBackend()
+    index = tmp_path / "uploads.json"
+    uploads = MODULE.UploadCache(index, "acct")
+    jobs = [MODULE.Job(f"ad {i}", str(tmp_path / f"ad{i}.png"), [str(src)]) for i in range(3)]
+
+    failures = MODULE.run_batch(backend, None, jobs, concurrency=3, uploads=uploads)
+
+    assert failures == 0
+    assert backend.uploads == 1
+    # A later run reads the persisted handle; another account or an expired entry uploads again.
+    lines = []
+    MODULE.run_job(backend, None, jobs[0], log=lines.append, uploads=MODULE.UploadCache(index, "acct"))
+    assert backend.uploads == 1
+    assert f"Reusing uploaded input image: {src}" in lines
+    MODULE.run_job(backend, None, jobs[0], log=lines.append, uploads=MODULE.UploadCache(index, "other"))
+    assert backend.uploads == 2
+    expired = MODULE.UploadCache(index, "fresh", ttl=0)
+    MODULE.run_job(backend, None, jobs[0], log=lines.append, uploads=expired)
+    MODULE.run_job(backend, None, jobs[0], log=lines.append, uploads=expired)
+    assert backend.uploads == 4
+
+
+def test_rejected_upload_handle_is_dropped_and_job_retried_inline(tmp_path):
+    src = tmp_path / "brand.png"
+    data = encode_image("PNG", size=(40, 40))
+    src.write_bytes(data)
+    backend = MODULE.StubBackend()
+    index = tmp_path / "uploads.json"
+    job = MODULE.Job("ad", str(tmp_path / "ad.png"), [str(src)])
+    MODULE.run_job(backend, None, job, log=lambda _line: None, uploads=MODULE.UploadCache(index, "acct"))
+    backend.delete(name="files/stub-1")
+
+    lines = []
+    MODULE.run_job(backend, None, job, log=lines.append, uploads=MODULE.UploadCache(index, "acct"))
+
+    assert any(line.startswith("Uploaded input images were rejected (403") for line in lines)
+    assert backend.uploads == 1
+    assert json.loads(index.read_text()) == {}
+    # The next run uploads a fresh handle instead of reusing the rejected one.
+    lines = []
+    MODULE.run_job(backend, None, job, log=lines.append, uploads=MODULE.UploadCache(index, "acct"))
+    assert backend.uploads == 2
+    assert f"Uploaded input image: {src}" in lines
+    assert not any(line.startswith("Uploaded input images were rejected") for line in lines)
+
+
+@pytest.mark.parametrize(
+    ("err", "rejected"),
+    [
+        (MODULE.StubAPIError(403, "You do not have permission to access the File abc"), True),
+        (MODULE.StubAPIError(404, "File files/abc is not found."), True),
+        (MODULE.StubAPIError(400, "Unsupported file uri"), True),
+        (MODULE.StubAPIError(403, "Method doesn't allow unregistered callers."), False),
+        (MODULE.StubAPIError(400, "API key not valid. Please pass a valid API key."), False),
+        (MODULE.StubAPIError(500, "Internal error reading file"), False),
+    ],
+)
+def test_is_rejected_file_error_needs_a_file_error(err, rejected):
+    assert MODULE.is_rejected_file_error(err) is rejected
+
+
+def test_stub_backend_uploads_stay_out_of_the_persistent_index(tmp_path, monkeypatch):
+    monkeypatch.setenv("NANO_BANANA_CACHE_DIR", str(tmp_path / "cache"))
+    src = tmp_path / "brand.png"
+    src.write_bytes(encode_image("PNG", size=(40, 40)))
+    argv = ["--backend", "stub", "--no-worker", "--reuse-uploads", "--prompt", "ad", "-i", str(src)]
+
+    with pytest.raises(SystemExit) as exit_info:
+        MODULE.main([*argv, "--filename", str(tmp_path / "ad.png")])
+
+    assert exit_info.value.code == 0
+    assert (tmp_path / "ad.png").exists()
+    assert not (tmp_path / "cache" / "uploads.json").exists()
+
+
+def test_image_parts_references_uploads_by_uri(tmp_path):
+    img = MODULE.InputImage("in.png", b"png-bytes", "image/png", 1, 1)
+    backend = MODULE.StubBackend()
+    uploads = MODULE.UploadCache(tmp_path / "uploads.json", "acct")
+
+    (part,) = MODULE.image_parts(backend, MODULE.StubTypes, [img], uploads, log=lambda _line: None)
+
+    assert part.file_data.file_uri == "stub://files/stub-1"
+    assert part.file_data.mime_type == "image/png"
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Offline throughput benchmark for gen.py against the local mock Images API.
+
+Usage:
+    python3 bench_gen.py --counts 8,32 --concurrency 1,4,8 --latency uniform:0.2,0.8
+    python3 bench_gen.py --response url --payload-bytes 2000000 --download-latency fixed:0.3
+
+Each (count, concurrency) pair runs gen.py in a fresh subprocess and reports
+images/s, p50/p95 request latency (as seen by the mock server) and the peak
+RSS of the gen.py process.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from gen import percentile
+from mock_images_api import MockConfig, parse_latency, start_server
+
+GEN_PATH = Path(__file__).with_name("gen.py")
+
+
+def peak_rss_mb(rusage) -> float:
+    # ru_maxrss is KiB on Linux but bytes on macOS.
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return rusage.ru_maxrss / scale
+
+
+def run_gen(base_url: str, count: int, concurrency: int, extra_args: list[str]) -> tuple[float, int, float]:
+    """Run gen.py once; return (wall seconds, exit code, peak RSS in MiB)."""
+    env = {**os.environ, "OPENAI_API_KEY": "mock"}
+    with tempfile.TemporaryDirectory(prefix="bench-gen-") as out_dir:
+        cmd = [
+            sys.executable,
+            str(GEN_PATH),
+            "--base-url",
+            base_url,
+            "--count",
+            str(count),
+            "--concurrency",
+            str(concurrency),
+            "--out-dir",
+            out_dir,
+            *extra_args,
+        ]
+        started = time.perf_counter()
+        proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL)
+        _, status, rusage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - started
+        # Already reaped by wait4; record it so Popen does not wait again.
+        proc.returncode = os.waitstatus_to_exitcode(status)
+    return elapsed, proc.returncode, peak_rss_mb(rusage)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Benchmark gen.py against the local mock Images API.")
+    ap.add_argument("--counts", default="8,32", help="Comma-separated --count values.")
+    ap.add_argument("--concurrency", default="1,4,8", help="Comma-separated --concurrency values.")
+    ap.add_argument("--latency", default="uniform:0.2,0.8", help="Mock generation latency spec.")
+    ap.add_argument("--download-latency", default="fixed:0", help="Mock download latency spec.")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="Mock 429/5xx injection rate.")
+    ap.add_argument("--response", choices=["b64", "url"], default="b64")
+    ap.add_argument("--payload-bytes", type=int, default=256 * 1024)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("gen_args", nargs=argparse.REMAINDER, help="Extra gen.py args after `--`.")
+    args = ap.parse_args()
+
+    try:
+        counts = [int(v) for v in args.counts.split(",") if v.strip()]
+        levels = [int(v) for v in args.concurrency.split(",") if v.strip()]
+        parse_latency(args.latency)
+        parse_latency(args.download_latency)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+    extra_args = [a for a in args.gen_args if a != "--"]
+    if args.response == "url":
+        # gen.py only asks dall-e models for URL results.
+        extra_args = ["--model", "dall-e-2", *extra_args]
+
+    config = MockConfig(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        response=args.response,
+        payload_bytes=args.payload_bytes,
+        download_latency=args.download_latency,
+        seed=args.seed,
+    )
+    server, stats = start_server(config)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    print(f"{'count':>6} {'conc':>5} {'wall_s':>8} {'img/s':>7} {'p50_s':>7} {'p95_s':>7} {'rss_mb':>7} {'errors':>6}")
+    failed = False
+    try:
+        for count in counts:
+            for concurrency in levels:
+                with stats.lock:
+                    stats.latencies.clear()
+                    stats.errors = 0
+                elapsed, code, rss = run_gen(base_url, count, concurrency, extra_args)
+                with stats.lock:
+                    latencies = list(stats.latencies)
+                    errors = stats.errors
+                rate = count / elapsed if elapsed > 0 and code == 0 else 0.0
+                print(
+                    f"{count:>6} {concurrency:>5} {elapsed:>8.2f} {rate:>7.2f} "
+                    f"{percentile(latencies, 50):>7.3f} {percentile(latencies, 95):>7.3f} "
+                    f"{rss:>7.1f} {errors:>6}"
+                    + ("" if code == 0 else f"  (gen.py exited {code})")
+                )
+                failed = failed or code != 0
+    finally:
+        server.shutdown()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
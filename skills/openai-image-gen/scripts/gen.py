@@ -2,14 +2,21 @@
 import argparse
 import base64
 import datetime as dt
+import hashlib
+import importlib.util
 import json
+import mimetypes
 import os
 import random
 import re
 import sys
+import threading
+import time
 import urllib.error
 import urllib.request
-from collections.abc import Callable
+import uuid
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from html import escape as html_escape
 from pathlib import Path
 
@@ -29,41 +36,104 @@ def default_out_dir() -> Path:
     return base / f"openai-image-gen-{now}"
 
 
-def pick_prompts(count: int) -> list[str]:
-    subjects = [
-        "a lobster astronaut",
-        "a brutalist lighthouse",
-        "a cozy reading nook",
-        "a cyberpunk noodle shop",
-        "a Vienna street at dusk",
-        "a minimalist product photo",
-        "a surreal underwater library",
-    ]
-    styles = [
-        "ultra-detailed studio photo",
-        "35mm film still",
-        "isometric illustration",
-        "editorial photography",
-        "soft watercolor",
-        "architectural render",
-        "high-contrast monochrome",
-    ]
-    lighting = [
-        "golden hour",
-        "overcast soft light",
-        "neon lighting",
-        "dramatic rim light",
-        "candlelight",
-        "foggy atmosphere",
-    ]
+PROMPT_SUBJECTS = [
+    "a lobster astronaut",
+    "a brutalist lighthouse",
+    "a cozy reading nook",
+    "a cyberpunk noodle shop",
+    "a Vienna street at dusk",
+    "a minimalist product photo",
+    "a surreal underwater library",
+]
+PROMPT_STYLES = [
+    "ultra-detailed studio photo",
+    "35mm film still",
+    "isometric illustration",
+    "editorial photography",
+    "soft watercolor",
+    "architectural render",
+    "high-contrast monochrome",
+]
+PROMPT_LIGHTING = [
+    "golden hour",
+    "overcast soft light",
+    "neon lighting",
+    "dramatic rim light",
+    "candlelight",
+    "foggy atmosphere",
+]
+
+
+def format_prompt(style: str, subject: str, lighting: str) -> str:
+    return f"{style} of {subject}, {lighting}"
+
+
+def pick_prompts(count: int, seed: int | None = None) -> list[str]:
+    rng = random.Random(seed)
     prompts: list[str] = []
     for _ in range(count):
         prompts.append(
-            f"{random.choice(styles)} of {random.choice(subjects)}, {random.choice(lighting)}"
+            format_prompt(
+                rng.choice(PROMPT_STYLES), rng.choice(PROMPT_SUBJECTS), rng.choice(PROMPT_LIGHTING)
+            )
         )
     return prompts
 
 
+def iter_prompt_matrix(
+    subjects: list[str] = PROMPT_SUBJECTS,
+    styles: list[str] = PROMPT_STYLES,
+    lighting: list[str] = PROMPT_LIGHTING,
+    *,
+    limit: int | None = None,
+    seed: int | None = None,
+) -> Iterator[str]:
+    """Lazily yield unique prompts from the style x subject x lighting product.
+
+    Without a seed the product is walked in order; with one, `limit` positions
+    are drawn without replacement, so the same seed always yields the same
+    sequence. Positions are decoded on the fly rather than materialized.
+    """
+    styles = list(dict.fromkeys(styles))
+    subjects = list(dict.fromkeys(subjects))
+    lighting = list(dict.fromkeys(lighting))
+    total = len(styles) * len(subjects) * len(lighting)
+    limit = total if limit is None else max(0, min(limit, total))
+    positions = range(limit) if seed is None else random.Random(seed).sample(range(total), limit)
+
+    seen: set[str] = set()
+    for position in positions:
+        rest, light_idx = divmod(position, len(lighting))
+        style_idx, subject_idx = divmod(rest, len(subjects))
+        prompt = format_prompt(styles[style_idx], subjects[subject_idx], lighting[light_idx])
+        if prompt not in seen:
+            seen.add(prompt)
+            yield prompt
+
+
+def parse_shard(value: str) -> tuple[int, int]:
+    """Parse `--shard i/n` (1-based) into a zero-based (index, count) pair."""
+    match = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", value)
+    if not match:
+        raise ValueError(f"Invalid --shard '{value}'. Expected i/n, e.g. 1/4.")
+    index, count = int(match.group(1)), int(match.group(2))
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f"Invalid --shard '{value}'. Need 1 <= i <= n.")
+    return index - 1, count
+
+
+def shard_prompts(prompts: Iterable[str], shard: tuple[int, int] = (0, 1)) -> Iterator[tuple[int, str]]:
+    """Yield (1-based run position, prompt) for every prompt in this shard.
+
+    Shards take prompts round-robin, so hosts given the same inputs and seed
+    get disjoint slices whose positions (and file names) never collide.
+    """
+    index, count = shard
+    for position, prompt in enumerate(prompts, start=1):
+        if (position - 1) % count == index:
+            yield position, prompt
+
+
 def get_model_defaults(model: str) -> tuple[str, str]:
     """Return (default_size, default_quality) for the given model."""
     if model == "dall-e-2":
@@ -154,6 +224,42 @@ def normalize_output_format(model: str, output_format: str) -> str:
     )
 
 
+def normalize_variation_model(model: str) -> str:
+    """Return the model for --variations, which /images/variations only serves with dall-e-2."""
+    if model != "dall-e-2":
+        print(f"Warning: --variations is only supported for dall-e-2; using it instead of '{model}'.", file=sys.stderr)
+    return "dall-e-2"
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 8.0) -> float:
+    """Return a jittered exponential backoff delay for the given retry attempt."""
+    return min(cap, base * (2**attempt)) * (0.5 + random.random() / 2)
+
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+
+
+class ImagesAPIError(RuntimeError):
+    """Non-2xx response from the Images API."""
+
+    def __init__(self, status: int, payload: str, retry_after: float | None = None) -> None:
+        super().__init__(f"OpenAI Images API failed ({status}): {payload}")
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.status == 429 or self.status >= 500
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Parse a delta-seconds Retry-After header; HTTP-date values are ignored."""
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
+
+
 def request_images(
     api_key: str,
     prompt: str,
@@ -163,8 +269,13 @@ def request_images(
     background: str = "",
     output_format: str = "",
     style: str = "",
+    *,
+    base_url: str = DEFAULT_BASE_URL,
+    retries: int = 0,
+    timings: dict | None = None,
 ) -> dict:
-    url = "https://api.openai.com/v1/images/generations"
+    """POST a generation request and return the decoded JSON response."""
+    url = f"{base_url.rstrip('/')}/images/generations"
     args = {
         "model": model,
         "prompt": prompt,
@@ -189,36 +300,473 @@ def request_images(
         args["style"] = style
 
     body = json.dumps(args).encode("utf-8")
-    req = urllib.request.Request(
+    return post_images_request(
         url,
-        method="POST",
-        headers={
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-        },
-        data=body,
+        api_key,
+        body,
+        content_type="application/json",
+        retries=retries,
+        timings=timings,
     )
-    try:
-        with urllib.request.urlopen(req, timeout=300) as resp:
-            return json.loads(resp.read().decode("utf-8"))
-    except urllib.error.HTTPError as e:
-        payload = e.read().decode("utf-8", errors="replace")
-        raise RuntimeError(f"OpenAI Images API failed ({e.code}): {payload}") from e
 
 
-def write_gallery(out_dir: Path, items: list[dict]) -> None:
-    thumbs = "\n".join(
+def request_image_edit(
+    api_key: str,
+    image: Path,
+    prompt: str,
+    model: str,
+    size: str,
+    quality: str,
+    mask: Path | None = None,
+    background: str = "",
+    output_format: str = "",
+    *,
+    base_url: str = DEFAULT_BASE_URL,
+    retries: int = 0,
+    timings: dict | None = None,
+) -> dict:
+    """POST an /images/edits request, streaming `image` (and `mask`) from disk."""
+    fields = {"model": model, "prompt": prompt, "size": size, "n": "1"}
+    if model != "dall-e-2":
+        fields["quality"] = quality
+    if model.startswith("gpt-image"):
+        if background:
+            fields["background"] = background
+        if output_format:
+            fields["output_format"] = output_format
+    files = [("image", image)]
+    if mask is not None:
+        files.append(("mask", mask))
+    body = MultipartBody(fields, files)
+    return post_images_request(
+        f"{base_url.rstrip('/')}/images/edits",
+        api_key,
+        body,
+        content_type=body.content_type,
+        content_length=body.content_length,
+        retries=retries,
+        timings=timings,
+    )
+
+
+def request_image_variation(
+    api_key: str,
+    image: Path,
+    model: str,
+    size: str,
+    *,
+    base_url: str = DEFAULT_BASE_URL,
+    retries: int = 0,
+    timings: dict | None = None,
+) -> dict:
+    """POST an /images/variations request, streaming `image` from disk."""
+    body = MultipartBody({"model": model, "size": size, "n": "1"}, [("image", image)])
+    return post_images_request(
+        f"{base_url.rstrip('/')}/images/variations",
+        api_key,
+        body,
+        content_type=body.content_type,
+        content_length=body.content_length,
+        retries=retries,
+        timings=timings,
+    )
+
+
+MULTIPART_CHUNK_SIZE = 64 * 1024
+
+
+class MultipartBody:
+    """multipart/form-data body streamed from disk with a known Content-Length.
+
+    Iterating yields the encoded fields followed by each file in fixed-size
+    chunks, so inputs are never fully buffered. Every iteration reopens the
+    files, which lets a retry send the same body again.
+    """
+
+    def __init__(self, fields: dict[str, str], files: list[tuple[str, Path]]) -> None:
+        self.boundary = f"openclaw-{uuid.uuid4().hex}"
+        self._fields = fields
+        self._files = [(name, Path(path)) for name, path in files]
+        self.content_length = sum(len(part) for part in self._field_parts())
+        for name, path in self._files:
+            self.content_length += len(self._file_header(name, path)) + path.stat().st_size + 2
+        self.content_length += len(self._trailer())
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def _field_parts(self) -> list[bytes]:
+        return [
+            (
+                f"--{self.boundary}\r\n"
+                f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+                f"{value}\r\n"
+            ).encode("utf-8")
+            for name, value in self._fields.items()
+        ]
+
+    def _file_header(self, name: str, path: Path) -> bytes:
+        mime = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        filename = path.name.replace('"', "%22")
+        return (
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f"Content-Type: {mime}\r\n\r\n"
+        ).encode("utf-8")
+
+    def _trailer(self) -> bytes:
+        return f"--{self.boundary}--\r\n".encode("utf-8")
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield from self._field_parts()
+        for name, path in self._files:
+            yield self._file_header(name, path)
+            with path.open("rb") as fh:
+                while chunk := fh.read(MULTIPART_CHUNK_SIZE):
+                    yield chunk
+            yield b"\r\n"
+        yield self._trailer()
+
+
+def post_images_request(
+    url: str,
+    api_key: str,
+    body: bytes | Iterable[bytes],
+    *,
+    content_type: str,
+    content_length: int | None = None,
+    retries: int = 0,
+    timings: dict | None = None,
+) -> dict:
+    """Send an Images API request with retries on 429/5xx and network errors.
+
+    When `timings` is given it is filled with the final attempt's
+    `headers_s` / `transfer_s`, plus `response_bytes`, `retries` and `status`.
+    """
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": content_type,
+    }
+    if content_length is not None:
+        headers["Content-Length"] = str(content_length)
+    req = urllib.request.Request(url, method="POST", headers=headers, data=body)
+    if timings is None:
+        timings = {}
+    attempt = 0
+    while True:
+        timings["retries"] = attempt
+        started = time.perf_counter()
+        try:
+            # urlopen returns once the status line and headers are in.
+            with urllib.request.urlopen(req, timeout=300) as resp:
+                headers_done = time.perf_counter()
+                raw = resp.read()
+                timings["headers_s"] = headers_done - started
+                timings["transfer_s"] = time.perf_counter() - headers_done
+                timings["response_bytes"] = len(raw)
+                timings["status"] = resp.status
+                return json.loads(raw.decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            timings["status"] = e.code
+            payload = e.read().decode("utf-8", errors="replace")
+            err = ImagesAPIError(e.code, payload, parse_retry_after(e.headers.get("Retry-After")))
+            if attempt >= retries or not err.retryable:
+                raise err from e
+            delay = err.retry_after if err.retry_after is not None else backoff_delay(attempt)
+            reason = f"HTTP {e.code}"
+        except (urllib.error.URLError, TimeoutError) as e:
+            timings["status"] = None
+            if attempt >= retries:
+                raise
+            delay = backoff_delay(attempt)
+            reason = str(e)
+        print(f"Images API request failed ({reason}); retrying in {delay:.1f}s", file=sys.stderr)
+        time.sleep(delay)
+        attempt += 1
+
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def is_retryable_download_error(err: Exception) -> bool:
+    """Retry network failures and 429/5xx responses, but not other HTTP errors."""
+    if isinstance(err, urllib.error.HTTPError):
+        return err.code == 429 or err.code >= 500
+    return isinstance(err, (urllib.error.URLError, OSError))
+
+
+def download_image(
+    url: str,
+    dest: Path,
+    *,
+    retries: int = 3,
+    timeout: float = 120,
+    stats: dict | None = None,
+) -> tuple[int, str]:
+    """Stream `url` to `dest` and return (bytes written, sha256 hex digest).
+
+    The body is written to a sibling `.part` file and renamed into place once
+    complete, so a failed attempt never leaves a truncated image behind. The
+    number of retries used is kept in `stats["retries"]`, if given.
+    """
+    tmp = dest.with_name(dest.name + ".part")
+    attempt = 0
+    while True:
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as resp, tmp.open("wb") as fh:
+                while chunk := resp.read(DOWNLOAD_CHUNK_SIZE):
+                    fh.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+            os.replace(tmp, dest)
+            return size, digest.hexdigest()
+        except Exception as e:
+            tmp.unlink(missing_ok=True)
+            if attempt >= retries or not is_retryable_download_error(e):
+                raise RuntimeError(f"Failed to download image from {url}: {e}") from e
+            delay = backoff_delay(attempt)
+            print(
+                f"Download of {dest.name} failed ({e}); retrying in {delay:.1f}s",
+                file=sys.stderr,
+            )
+            time.sleep(delay)
+            attempt += 1
+            if stats is not None:
+                stats["retries"] = attempt
+
+
+class DownloadPool:
+    """Bounded worker pool that downloads URL results while generation continues."""
+
+    def __init__(self, workers: int, retries: int = 3) -> None:
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, workers), thread_name_prefix="download"
+        )
+        self._retries = retries
+        self._futures: list[Future] = []
+        self._log_lock = threading.Lock()
+
+    def submit(
+        self,
+        url: str,
+        dest: Path,
+        on_done: Callable[[Path, dict], None] | None = None,
+        on_error: Callable[[Exception, dict], None] | None = None,
+    ) -> Future:
+        """Queue a download.
+
+        `on_done(dest, stats)` runs on the worker once the file is on disk;
+        `on_error(exc, stats)`, if given, handles a failed download instead of
+        it being re-raised by wait(). `stats` holds the retry count.
+        """
+        fut = self._executor.submit(self._run, url, dest, on_done, on_error)
+        self._futures.append(fut)
+        return fut
+
+    def _run(
+        self,
+        url: str,
+        dest: Path,
+        on_done: Callable[[Path, dict], None] | None,
+        on_error: Callable[[Exception, dict], None] | None,
+    ) -> tuple[int, str] | None:
+        stats = {"retries": 0}
+        try:
+            size, sha256 = download_image(url, dest, retries=self._retries, stats=stats)
+        except Exception as e:
+            if on_error is None:
+                raise
+            on_error(e, stats)
+            return None
+        with self._log_lock:
+            print(f"  downloaded {dest.name} ({size} bytes, sha256 {sha256[:16]})")
+        if on_done is not None:
+            on_done(dest, stats)
+        return size, sha256
+
+    def wait(self) -> None:
+        """Block until every queued download finishes, re-raising the first unhandled failure."""
+        try:
+            for fut in self._futures:
+                fut.result()
+        finally:
+            self._executor.shutdown(wait=True)
+
+
+THUMB_FORMATS = {"webp": ("WEBP", "webp"), "jpeg": ("JPEG", "jpg")}
+
+
+def thumbnails_available() -> bool:
+    """Thumbnails need Pillow, which is optional for this script."""
+    return importlib.util.find_spec("PIL") is not None
+
+
+def make_thumbnail(src: Path, dest: Path, max_dim: int, fmt: str) -> tuple[int, int]:
+    """Write a thumbnail of `src` that fits in max_dim x max_dim; return its (width, height).
+
+    ThumbnailPool calls this in its worker processes with paths, not images.
+    """
+    from PIL import Image
+
+    pil_format, _ = THUMB_FORMATS[fmt]
+    with Image.open(src) as img:
+        # dall-e results can arrive as JPEG; a thumbnail only needs a 1/2-1/8 scale decode.
+        img.draft("RGB", (max_dim, max_dim))
+        img.thumbnail((max_dim, max_dim))
+        if pil_format == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.save(dest, pil_format, quality=80)
+        return img.size
+
+
+class ThumbnailPool:
+    """Process pool that renders gallery thumbnails while generation is still running."""
+
+    def __init__(
+        self,
+        out_dir: Path,
+        max_dim: int,
+        fmt: str,
+        workers: int | None = None,
+        on_ready: Callable[[dict], None] | None = None,
+    ) -> None:
+        self._out_dir = out_dir
+        self._thumb_dir = out_dir / "thumbs"
+        self._thumb_dir.mkdir(parents=True, exist_ok=True)
+        self._max_dim = max_dim
+        self._fmt = fmt
+        self._executor = ProcessPoolExecutor(max_workers=workers)
+        self._on_ready = on_ready
+
+    def submit(self, item: dict, src: Path) -> None:
+        """Queue a thumbnail for `src`; `item` gains thumb/width/height when it completes."""
+        dest = self._thumb_dir / f"{src.stem}.{THUMB_FORMATS[self._fmt][1]}"
+        fut = self._executor.submit(make_thumbnail, src, dest, self._max_dim, self._fmt)
+        fut.add_done_callback(lambda f: self._finish(item, dest, f))
+
+    def _finish(self, item: dict, dest: Path, fut: Future) -> None:
+        # Failures fall back to the full-size image in the gallery.
+        try:
+            width, height = fut.result()
+        except Exception as e:
+            print(f"Warning: thumbnail for {item['file']} failed: {e}", file=sys.stderr)
+        else:
+            item["thumb"] = dest.relative_to(self._out_dir).as_posix()
+            item["width"] = width
+            item["height"] = height
+        if self._on_ready is not None:
+            self._on_ready(item)
+
+    def wait(self) -> None:
+        """Block until every queued thumbnail (and its `on_ready` callback) has finished."""
+        self._executor.shutdown(wait=True)
+
+
+def gallery_img_tag(item: dict) -> str:
+    """Render the <img> for a gallery item, preferring its thumbnail when one exists."""
+    src = item.get("thumb") or item["file"]
+    attrs = f'src="{html_escape(src, quote=True)}"'
+    if item.get("thumb") and item.get("width") and item.get("height"):
+        attrs += f' width="{int(item["width"])}" height="{int(item["height"])}"'
+    return f'<img {attrs} loading="lazy" />'
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Nearest-rank percentile; returns 0.0 for an empty list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, round(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def round_timings(timings: dict) -> dict:
+    return {k: round(v, 4) if isinstance(v, float) else v for k, v in timings.items()}
+
+
+class MetricsLog:
+    """Per-image telemetry, optionally streamed as JSON lines, plus a run summary."""
+
+    def __init__(self, path: str = "") -> None:
+        self._started = time.perf_counter()
+        self._latencies: list[float] = []
+        self._failures = 0
+        self._lock = threading.Lock()
+        if path == "-":
+            self._fh = sys.stderr
+        elif path:
+            self._fh = open(path, "a", encoding="utf-8")
+        else:
+            self._fh = None
+
+    def record(self, event: dict) -> None:
+        with self._lock:
+            if event.get("error"):
+                self._failures += 1
+            elif "total_s" in event:
+                self._latencies.append(event["total_s"])
+            if self._fh is not None:
+                self._fh.write(json.dumps({"type": "image", **event}) + "\n")
+                self._fh.flush()
+
+    def summary(self) -> dict:
+        with self._lock:
+            latencies = list(self._latencies)
+            failures = self._failures
+        elapsed = time.perf_counter() - self._started
+        return {
+            "images": len(latencies),
+            "failures": failures,
+            "elapsed_s": round(elapsed, 3),
+            "images_per_min": round(len(latencies) / elapsed * 60, 2) if elapsed > 0 else 0.0,
+            "p50_s": round(percentile(latencies, 50), 3),
+            "p95_s": round(percentile(latencies, 95), 3),
+            "p99_s": round(percentile(latencies, 99), 3),
+        }
+
+    def close(self) -> dict:
+        """Write the summary line (if streaming), close the stream, and return the summary."""
+        summary = self.summary()
+        with self._lock:
+            if self._fh is not None:
+                self._fh.write(json.dumps({"type": "summary", **summary}) + "\n")
+                if self._fh is not sys.stderr:
+                    self._fh.close()
+                self._fh = None
+        return summary
+
+
+GALLERY_PAGE_SIZE = 100
+
+
+def gallery_page_name(page: int) -> str:
+    """File name for a 1-based gallery page; page 1 is always index.html."""
+    return "index.html" if page == 1 else f"page-{page}.html"
+
+
+def render_gallery_page(out_dir: Path, items: list[dict], page: int, pages: int) -> str:
+    figures = "\n".join(
         [
             f"""
 <figure>
-  <a href="{html_escape(it["file"], quote=True)}"><img src="{html_escape(it["file"], quote=True)}" loading="lazy" /></a>
+  <a href="{html_escape(it["file"], quote=True)}">{gallery_img_tag(it)}</a>
   <figcaption>{html_escape(it["prompt"])}</figcaption>
 </figure>
 """.strip()
             for it in items
         ]
     )
-    html = f"""<!doctype html>
+    nav = ""
+    if pages > 1:
+        links = " ".join(
+            f"<strong>{n}</strong>" if n == page else f'<a href="{gallery_page_name(n)}">{n}</a>'
+            for n in range(1, pages + 1)
+        )
+        nav = f'<nav class="pages">Page {page} of {pages}: {links}</nav>'
+    return f"""<!doctype html>
 <meta charset="utf-8" />
 <title>openai-image-gen</title>
 <style>
@@ -230,20 +778,70 @@ def write_gallery(out_dir: Path, items: list[dict]) -> None:
   img {{ width: 100%; height: auto; border-radius: 10px; display: block; }}
   figcaption {{ margin-top: 10px; color: #b7c2cc; }}
   code {{ color: #9cd1ff; }}
+  .pages {{ margin: 0 0 16px; color: #b7c2cc; }}
+  .pages a {{ color: #9cd1ff; }}
 </style>
 <h1>openai-image-gen</h1>
 <p>Output: <code>{html_escape(out_dir.as_posix())}</code></p>
+{nav}
 <div class="grid">
-{thumbs}
+{figures}
 </div>
 """
-    (out_dir / "index.html").write_text(html, encoding="utf-8")
+
+
+class GalleryWriter:
+    """Incrementally written, paginated gallery.
+
+    Items are placed by their position in the run, so each page holds a fixed
+    slice of `page_size` slots. Filling a slot re-renders only that page, which
+    keeps the cost of each update bounded regardless of how large the run is.
+    """
+
+    def __init__(self, out_dir: Path, total: int, page_size: int = GALLERY_PAGE_SIZE) -> None:
+        self.out_dir = out_dir
+        self.page_size = max(1, page_size)
+        self.pages = max(1, -(-total // self.page_size))
+        self._slots: list[dict | None] = [None] * total
+        self._lock = threading.Lock()
+
+    def set(self, index: int, item: dict, write: bool = True) -> None:
+        """Place `item` at 0-based `index` and, by default, rewrite its page."""
+        with self._lock:
+            self._slots[index] = item
+            if write:
+                self._write_page(index // self.page_size + 1)
+
+    def write_all(self) -> None:
+        with self._lock:
+            for page in range(1, self.pages + 1):
+                self._write_page(page)
+
+    def _write_page(self, page: int) -> None:
+        start = (page - 1) * self.page_size
+        items = [it for it in self._slots[start : start + self.page_size] if it is not None]
+        html = render_gallery_page(self.out_dir, items, page, self.pages)
+        (self.out_dir / gallery_page_name(page)).write_text(html, encoding="utf-8")
+
+
+def write_gallery(out_dir: Path, items: list[dict], page_size: int = GALLERY_PAGE_SIZE) -> None:
+    gallery = GalleryWriter(out_dir, len(items), page_size)
+    for index, item in enumerate(items):
+        gallery.set(index, item, write=False)
+    gallery.write_all()
 
 
 def main() -> int:
     ap = argparse.ArgumentParser(description="Generate images via OpenAI Images API.")
     ap.add_argument("--prompt", help="Single prompt. If omitted, random prompts are generated.")
-    ap.add_argument("--count", type=int, default=8, help="How many images to generate.")
+    ap.add_argument("--count", type=int, default=None, help="How many images to generate (default: 8, or the whole matrix with --matrix).")
+    ap.add_argument("--matrix", action="store_true", help="Enumerate unique style x subject x lighting prompts instead of random picks.")
+    ap.add_argument("--seed", type=int, default=None, help="Seed for prompt sampling, for reproducible runs.")
+    ap.add_argument("--shard", default="1/1", help="Only run slice i of n (e.g. 2/4) so several hosts can split one sweep.")
+    mode = ap.add_mutually_exclusive_group()
+    mode.add_argument("--edit", metavar="IMAGE", help="Edit IMAGE with the prompt(s) via /images/edits instead of generating.")
+    mode.add_argument("--variations", metavar="IMAGE", help="Create variations of IMAGE via /images/variations (dall-e-2).")
+    ap.add_argument("--mask", metavar="MASK", help="Optional PNG mask for --edit; transparent areas are edited.")
     ap.add_argument("--model", default="gpt-image-1", help="Image model id.")
     ap.add_argument("--size", default="", help="Image size (e.g. 1024x1024, 1536x1024). Defaults based on model if not specified.")
     ap.add_argument("--quality", default="", help="Image quality (e.g. high, standard). Defaults based on model if not specified.")
@@ -251,35 +849,77 @@ def main() -> int:
     ap.add_argument("--output-format", default="", help="Output format (GPT models only): png, jpeg, or webp.")
     ap.add_argument("--style", default="", help="Image style (dall-e-3 only): vivid or natural.")
     ap.add_argument("--out-dir", default="", help="Output directory (default: ./tmp/openai-image-gen-<ts>).")
+    ap.add_argument("--base-url", default=os.environ.get("OPENAI_BASE_URL") or DEFAULT_BASE_URL, help="Images API base URL (default: $OPENAI_BASE_URL or the public OpenAI API).")
+    ap.add_argument("--concurrency", type=int, default=1, help="Generation requests in flight at once.")
+    ap.add_argument("--retries", type=int, default=3, help="Retries per generation request on 429/5xx and network errors.")
+    ap.add_argument("--download-workers", type=int, default=4, help="Parallel downloads for URL responses (dall-e models).")
+    ap.add_argument("--download-retries", type=int, default=3, help="Retries per failed image download.")
+    ap.add_argument("--thumb-size", type=int, default=384, help="Max gallery thumbnail edge in px (0 disables thumbnails; needs Pillow).")
+    ap.add_argument("--thumb-format", choices=sorted(THUMB_FORMATS), default="webp", help="Gallery thumbnail format.")
+    ap.add_argument("--page-size", type=int, default=GALLERY_PAGE_SIZE, help="Gallery items per HTML page.")
+    ap.add_argument("--metrics", default="", help="Append per-image timing records as JSON lines to this file ('-' for stderr).")
     args = ap.parse_args()
+    if args.matrix and (args.prompt or args.variations):
+        ap.error("--matrix cannot be combined with --prompt or --variations")
 
     api_key = (os.environ.get("OPENAI_API_KEY") or "").strip()
     if not api_key:
         print("Missing OPENAI_API_KEY", file=sys.stderr)
         return 2
 
+    if args.variations:
+        args.model = normalize_variation_model(args.model)
+
     # Apply model-specific defaults if not specified
     default_size, default_quality = get_model_defaults(args.model)
     size = args.size or default_size
     quality = args.quality or default_quality
 
+    # None means "the whole matrix" in --matrix mode.
     count = args.count
-    if args.model == "dall-e-3" and count > 1:
-        print(f"Warning: dall-e-3 only supports generating 1 image at a time. Reducing count from {count} to 1.", file=sys.stderr)
+    if count is None and not args.matrix:
+        count = 8
+    if args.model == "dall-e-3" and (count is None or count > 1):
+        print(f"Warning: dall-e-3 only supports generating 1 image at a time. Reducing count from {count or 'the full matrix'} to 1.", file=sys.stderr)
         count = 1
 
-    out_dir = Path(args.out_dir).expanduser() if args.out_dir else default_out_dir()
-    out_dir.mkdir(parents=True, exist_ok=True)
-
-    prompts = [args.prompt] * count if args.prompt else pick_prompts(count)
+    edit_image = Path(args.edit).expanduser() if args.edit else None
+    variation_image = Path(args.variations).expanduser() if args.variations else None
+    mask = Path(args.mask).expanduser() if args.mask else None
+    if mask and not edit_image:
+        print("--mask requires --edit", file=sys.stderr)
+        return 2
+    for path in (edit_image, variation_image, mask):
+        if path and not path.is_file():
+            print(f"Input image not found: {path}", file=sys.stderr)
+            return 2
 
     try:
+        shard = parse_shard(args.shard)
         normalized_background = normalize_background(args.model, args.background)
         normalized_style = normalize_style(args.model, args.style)
         normalized_output_format = normalize_output_format(args.model, args.output_format)
     except ValueError as e:
         print(str(e), file=sys.stderr)
         return 2
+    if shard[1] > 1 and args.seed is None and not (args.prompt or args.matrix or variation_image):
+        # Unseeded random picks differ per host, so the shards would not add up to one sweep.
+        print("--shard across several hosts needs --seed (or --matrix/--prompt) so each draws the same prompts", file=sys.stderr)
+        return 2
+
+    if variation_image:
+        # Variations take no prompt; the label only names files and captions.
+        prompts: Iterable[str] = [f"variation of {variation_image.name}"] * count
+    elif args.prompt:
+        prompts = [args.prompt] * count
+    elif args.matrix:
+        prompts = iter_prompt_matrix(limit=count, seed=args.seed)
+    else:
+        prompts = pick_prompts(count, seed=args.seed)
+    jobs = list(shard_prompts(prompts, shard))
+
+    out_dir = Path(args.out_dir).expanduser() if args.out_dir else default_out_dir()
+    out_dir.mkdir(parents=True, exist_ok=True)
 
     # Determine file extension based on output format
     if args.model.startswith("gpt-image") and normalized_output_format:
@@ -287,41 +927,147 @@ def main() -> int:
     else:
         file_ext = "png"
 
-    items: list[dict] = []
-    for idx, prompt in enumerate(prompts, start=1):
-        print(f"[{idx}/{len(prompts)}] {prompt}")
-        res = request_images(
-            api_key,
-            prompt,
-            args.model,
-            size,
-            quality,
-            normalized_background,
-            normalized_output_format,
-            normalized_style,
-        )
-        data = res.get("data", [{}])[0]
-        image_b64 = data.get("b64_json")
-        image_url = data.get("url")
-        if not image_b64 and not image_url:
-            raise RuntimeError(f"Unexpected response: {json.dumps(res)[:400]}")
+    # URL responses are fetched in the background so the next generation
+    # request does not wait on the previous download.
+    downloads = DownloadPool(args.download_workers, retries=args.download_retries)
+
+    # The gallery is written page by page as items land, not rebuilt at the end.
+    gallery = GalleryWriter(out_dir, len(jobs), args.page_size)
+    gallery.write_all()
+
+    def publish(item: dict) -> None:
+        gallery.set(item["index"], item)
+
+    thumbs: ThumbnailPool | None = None
+    if args.thumb_size > 0:
+        if thumbnails_available():
+            thumbs = ThumbnailPool(out_dir, args.thumb_size, args.thumb_format, on_ready=publish)
+        else:
+            print("Note: Pillow not installed; gallery will use full-size images.", file=sys.stderr)
+
+    metrics = MetricsLog(args.metrics)
 
-        filename = f"{idx:03d}-{slugify(prompt)[:40]}.{file_ext}"
+    def generate(slot: int, position: int, prompt: str, queued_at: float) -> dict:
+        started = time.perf_counter()
+        print(f"[{slot + 1}/{len(jobs)}] {prompt}")
+        event = {
+            "position": position,
+            "model": args.model,
+            "size": size,
+            "quality": quality,
+            "queue_wait_s": round(started - queued_at, 4),
+        }
+        timings: dict = {}
+        request_opts = {"base_url": args.base_url, "retries": args.retries, "timings": timings}
+        try:
+            if edit_image:
+                res = request_image_edit(
+                    api_key,
+                    edit_image,
+                    prompt,
+                    args.model,
+                    size,
+                    quality,
+                    mask,
+                    normalized_background,
+                    normalized_output_format,
+                    **request_opts,
+                )
+            elif variation_image:
+                res = request_image_variation(
+                    api_key, variation_image, args.model, size, **request_opts
+                )
+            else:
+                res = request_images(
+                    api_key,
+                    prompt,
+                    args.model,
+                    size,
+                    quality,
+                    normalized_background,
+                    normalized_output_format,
+                    normalized_style,
+                    **request_opts,
+                )
+            data = res.get("data", [{}])[0]
+            image_b64 = data.get("b64_json")
+            image_url = data.get("url")
+            if not image_b64 and not image_url:
+                raise RuntimeError(f"Unexpected response: {json.dumps(res)[:400]}")
+        except Exception as e:
+            print(f"[{slot + 1}/{len(jobs)}] failed: {e}", file=sys.stderr)
+            metrics.record({**event, **round_timings(timings), "error": str(e)[:200]})
+            return {"index": slot, "prompt": prompt, "file": None, "error": str(e)[:200]}
+        event.update(round_timings(timings))
+
+        filename = f"{position:03d}-{slugify(prompt)[:40]}.{file_ext}"
         filepath = out_dir / filename
+        item = {"index": slot, "prompt": prompt, "file": filename}
+        written_from = time.perf_counter()
+
+        def on_download_failed(e: Exception, stats: dict) -> None:
+            print(f"[{slot + 1}/{len(jobs)}] {e}", file=sys.stderr)
+            item["error"] = str(e)[:200]
+            metrics.record(
+                {
+                    **event,
+                    "download_s": round(time.perf_counter() - written_from, 4),
+                    "download_retries": stats["retries"],
+                    "error": item["error"],
+                }
+            )
+
+        def on_saved(path: Path, stats: dict | None = None) -> None:
+            done = time.perf_counter()
+            key = "decode_write_s" if image_b64 else "download_s"
+            event[key] = round(done - written_from, 4)
+            if stats is not None:
+                event["download_retries"] = stats["retries"]
+            event["file_bytes"] = path.stat().st_size
+            event["total_s"] = round(done - started, 4)
+            metrics.record(event)
+            if thumbs:
+                thumbs.submit(item, path)
+            else:
+                publish(item)
+
         if image_b64:
             filepath.write_bytes(base64.b64decode(image_b64))
+            on_saved(filepath)
         else:
-            try:
-                urllib.request.urlretrieve(image_url, filepath)
-            except urllib.error.URLError as e:
-                raise RuntimeError(f"Failed to download image from {image_url}: {e}") from e
-
-        items.append({"prompt": prompt, "file": filename})
+            downloads.submit(image_url, filepath, on_done=on_saved, on_error=on_download_failed)
+        return item
 
-    (out_dir / "prompts.json").write_text(json.dumps(items, indent=2), encoding="utf-8")
-    write_gallery(out_dir, items)
-    print(f"\nWrote: {(out_dir / 'index.html').as_posix()}")
-    return 0
+    generators = ThreadPoolExecutor(
+        max_workers=max(1, args.concurrency), thread_name_prefix="generate"
+    )
+    items: list[dict] = []
+    # Failed images are recorded per job; the summary and prompts.json are
+    # written even if something unexpected escapes.
+    try:
+        try:
+            futures = [
+                generators.submit(generate, slot, position, prompt, time.perf_counter())
+                for slot, (position, prompt) in enumerate(jobs)
+            ]
+            items = [fut.result() for fut in futures]
+        finally:
+            generators.shutdown(wait=True, cancel_futures=True)
+            downloads.wait()
+            if thumbs:
+                thumbs.wait()
+    finally:
+        summary = metrics.close()
+        (out_dir / "prompts.json").write_text(json.dumps(items, indent=2), encoding="utf-8")
+    print(
+        f"\n{summary['images']} images in {summary['elapsed_s']:.1f}s "
+        f"({summary['images_per_min']:.1f}/min); latency "
+        f"p50 {summary['p50_s']:.2f}s, p95 {summary['p95_s']:.2f}s, p99 {summary['p99_s']:.2f}s"
+    )
+    if summary["failures"]:
+        print(f"{summary['failures']} of {len(jobs)} images failed.", file=sys.stderr)
+    print(f"Wrote: {(out_dir / 'index.html').as_posix()}")
+    return 1 if summary["failures"] else 0
 
 
 if __name__ == "__main__":
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI Images API, for load-testing gen.py offline.
+
+Usage:
+    python3 mock_images_api.py --port 8089 --latency lognormal:0.0,0.5 --error-rate 0.05
+    OPENAI_API_KEY=mock python3 gen.py --base-url http://127.0.0.1:8089/v1 --count 32
+
+Serves POST /v1/images/{generations,edits,variations} with either `b64_json` or `url` results
+(URLs point back at GET /files/<name>.png on the same server). Every image is
+a valid PNG padded to the configured payload size, so thumbnails still work.
+"""
+
+import argparse
+import base64
+import itertools
+import json
+import random
+import struct
+import sys
+import threading
+import time
+import zlib
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENDPOINTS = {"generations", "edits", "variations"}
+
+
+@dataclass
+class MockConfig:
+    latency: str = "fixed:0"
+    error_rate: float = 0.0
+    error_codes: tuple[int, ...] = (429, 500, 503)
+    response: str = "b64"
+    payload_bytes: int = 256 * 1024
+    download_latency: str = "fixed:0"
+    seed: int | None = None
+
+
+@dataclass
+class MockStats:
+    """Per-request service times recorded by the server, in seconds."""
+
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+    bytes_received: int = 0
+    endpoints: list[str] = field(default_factory=list)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def record(self, seconds: float, failed: bool, endpoint: str = "", received: int = 0) -> None:
+        with self.lock:
+            self.latencies.append(seconds)
+            self.bytes_received += received
+            self.endpoints.append(endpoint)
+            if failed:
+                self.errors += 1
+
+
+def parse_latency(spec: str) -> tuple[str, tuple[float, ...]]:
+    """Parse `fixed:S`, `uniform:LO,HI` or `lognormal:MU,SIGMA` (seconds)."""
+    kind, _, raw = spec.partition(":")
+    try:
+        params = tuple(float(v) for v in raw.split(",")) if raw else ()
+    except ValueError:
+        raise ValueError(f"Invalid latency spec '{spec}'") from None
+    expected = {"fixed": 1, "uniform": 2, "lognormal": 2}
+    if kind not in expected or len(params) != expected[kind]:
+        raise ValueError(
+            f"Invalid latency spec '{spec}'. Use fixed:S, uniform:LO,HI or lognormal:MU,SIGMA."
+        )
+    return kind, params
+
+
+def sample_latency(spec: tuple[str, tuple[float, ...]], rng: random.Random) -> float:
+    kind, params = spec
+    if kind == "fixed":
+        return params[0]
+    if kind == "uniform":
+        return rng.uniform(*params)
+    return rng.lognormvariate(*params)
+
+
+def _png_chunk(tag: bytes, data: bytes) -> bytes:
+    return (
+        struct.pack(">I", len(data))
+        + tag
+        + data
+        + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+    )
+
+
+def synthetic_png(payload_bytes: int, width: int = 64, height: int = 64) -> bytes:
+    """Return a valid RGB PNG padded with an ancillary chunk to about `payload_bytes`."""
+    rows = []
+    for y in range(height):
+        row = bytearray(b"\x00")
+        for x in range(width):
+            row += bytes((x * 4 % 256, y * 4 % 256, 160))
+        rows.append(bytes(row))
+    raw = b"".join(rows)
+    png = (
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + _png_chunk(b"IDAT", zlib.compress(raw))
+    )
+    # Room left after the padding chunk's own 12 bytes of framing and IEND.
+    padding = payload_bytes - len(png) - 12 - 12
+    if padding > 0:
+        png += _png_chunk(b"mcKp", bytes(padding))
+    return png + _png_chunk(b"IEND", b"")
+
+
+def make_handler(config: MockConfig, stats: MockStats) -> type[BaseHTTPRequestHandler]:
+    rng = random.Random(config.seed)
+    rng_lock = threading.Lock()
+    latency = parse_latency(config.latency)
+    download_latency = parse_latency(config.download_latency)
+    payload = synthetic_png(config.payload_bytes)
+    payload_b64 = base64.b64encode(payload).decode("ascii")
+    file_ids = itertools.count(1)
+
+    def draw(spec: tuple[str, tuple[float, ...]]) -> tuple[float, bool, int]:
+        with rng_lock:
+            delay = sample_latency(spec, rng)
+            failed = rng.random() < config.error_rate
+            code = rng.choice(config.error_codes) if failed else 200
+        return max(0.0, delay), failed, code
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):  # noqa: A002
+            pass
+
+        def _send(self, status: int, body: bytes, content_type: str, extra: dict | None = None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (extra or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_error(self, code: int) -> None:
+            body = json.dumps({"error": {"message": f"mock injected {code}", "code": code}})
+            extra = {"Retry-After": "0"} if code == 429 else None
+            self._send(code, body.encode("utf-8"), "application/json", extra)
+
+        def do_POST(self):  # noqa: N802
+            started = time.perf_counter()
+            # Drain the body in chunks; multipart uploads can be large.
+            remaining = int(self.headers.get("Content-Length") or 0)
+            received = 0
+            while remaining > 0:
+                chunk = self.rfile.read(min(remaining, 64 * 1024))
+                if not chunk:
+                    break
+                received += len(chunk)
+                remaining -= len(chunk)
+            endpoint = self.path.rstrip("/").rsplit("/", 1)[-1]
+            if endpoint not in ENDPOINTS:
+                self._send(404, b'{"error": {"message": "not found"}}', "application/json")
+                return
+            delay, failed, code = draw(latency)
+            time.sleep(delay)
+            # Record before replying so callers see the stats as soon as they get a response.
+            stats.record(time.perf_counter() - started, failed, endpoint, received)
+            if failed:
+                self._send_error(code)
+                return
+            if config.response == "url":
+                host = self.headers.get("Host") or "127.0.0.1"
+                data = {"url": f"http://{host}/files/{next(file_ids)}.png"}
+            else:
+                data = {"b64_json": payload_b64}
+            body = json.dumps({"created": int(time.time()), "data": [data]})
+            self._send(200, body.encode("utf-8"), "application/json")
+
+        def do_GET(self):  # noqa: N802
+            if not self.path.startswith("/files/"):
+                self._send(404, b"not found", "text/plain")
+                return
+            delay, _, _ = draw(download_latency)
+            time.sleep(delay)
+            self._send(200, payload, "image/png")
+
+    return Handler
+
+
+def start_server(
+    config: MockConfig, host: str = "127.0.0.1", port: int = 0
+) -> tuple[ThreadingHTTPServer, MockStats]:
+    """Start the mock in a daemon thread; the bound port is `server.server_address[1]`."""
+    stats = MockStats()
+    server = ThreadingHTTPServer((host, port), make_handler(config, stats))
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever,
+        kwargs={"poll_interval": 0.05},
+        name="mock-images-api",
+        daemon=True,
+    ).start()
+    return server, stats
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Local mock of the OpenAI Images API.")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--latency", default="fixed:0", help="Generation latency: fixed:S, uniform:LO,HI or lognormal:MU,SIGMA.")
+    ap.add_argument("--download-latency", default="fixed:0", help="Latency for GET /files/* in the same format.")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="Fraction of generation requests that fail.")
+    ap.add_argument("--error-codes", default="429,500,503", help="Comma-separated HTTP codes to inject.")
+    ap.add_argument("--response", choices=["b64", "url"], default="b64", help="Return b64_json or url results.")
+    ap.add_argument("--payload-bytes", type=int, default=256 * 1024, help="Size of each returned image.")
+    ap.add_argument("--seed", type=int, default=None, help="Seed for latency and error sampling.")
+    args = ap.parse_args()
+
+    try:
+        config = MockConfig(
+            latency=args.latency,
+            error_rate=args.error_rate,
+            error_codes=tuple(int(c) for c in args.error_codes.split(",") if c.strip()),
+            response=args.response,
+            payload_bytes=args.payload_bytes,
+            download_latency=args.download_latency,
+            seed=args.seed,
+        )
+        parse_latency(config.latency)
+        parse_latency(config.download_latency)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+
+    server, stats = start_server(config, args.host, args.port)
+    print(f"Mock Images API on http://{args.host}:{server.server_address[1]}/v1 (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        print(f"\nServed {len(stats.latencies)} generation requests ({stats.errors} injected errors)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
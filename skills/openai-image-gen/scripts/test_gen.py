@@ -1,15 +1,41 @@
 """Tests for openai-image-gen helpers."""
 
+import base64
+import hashlib
+import json
 import tempfile
+import urllib.error
 from pathlib import Path
+from unittest.mock import patch
 
+import gen
 import pytest
 from gen import (
+    PROMPT_LIGHTING,
+    PROMPT_STYLES,
+    PROMPT_SUBJECTS,
+    DownloadPool,
+    GalleryWriter,
+    ImagesAPIError,
+    MetricsLog,
+    MultipartBody,
+    ThumbnailPool,
+    download_image,
+    iter_prompt_matrix,
     normalize_background,
     normalize_output_format,
     normalize_style,
+    normalize_variation_model,
+    parse_shard,
+    percentile,
+    pick_prompts,
+    request_image_edit,
+    request_image_variation,
+    request_images,
+    shard_prompts,
     write_gallery,
 )
+from mock_images_api import MockConfig, start_server, synthetic_png
 
 
 def test_normalize_background_allows_empty_for_non_gpt_models():
@@ -97,6 +123,54 @@ def test_normalize_output_format_rejects_invalid_values():
         normalize_output_format("gpt-image-1", "svg")
 
 
+def test_normalize_variation_model_switches_to_dall_e_2(capsys):
+    assert normalize_variation_model("dall-e-2") == "dall-e-2"
+    assert capsys.readouterr().err == ""
+    assert normalize_variation_model("gpt-image-1") == "dall-e-2"
+    assert "--variations is only supported for dall-e-2" in capsys.readouterr().err
+
+
+def test_pick_prompts_is_reproducible_with_seed():
+    assert pick_prompts(5, seed=7) == pick_prompts(5, seed=7)
+
+
+def test_iter_prompt_matrix_enumerates_unique_product():
+    prompts = list(iter_prompt_matrix())
+    assert len(prompts) == len(PROMPT_SUBJECTS) * len(PROMPT_STYLES) * len(PROMPT_LIGHTING)
+    assert len(set(prompts)) == len(prompts)
+
+
+def test_iter_prompt_matrix_dedupes_axis_values():
+    prompts = list(iter_prompt_matrix(["cat", "cat"], ["photo"], ["dusk", "dusk", "dawn"]))
+    assert prompts == ["photo of cat, dusk", "photo of cat, dawn"]
+
+
+def test_iter_prompt_matrix_seeded_sample_is_reproducible():
+    first = list(iter_prompt_matrix(limit=10, seed=42))
+    assert first == list(iter_prompt_matrix(limit=10, seed=42))
+    assert len(set(first)) == 10
+    assert first != list(iter_prompt_matrix(limit=10))
+
+
+def test_parse_shard_accepts_one_based_slices():
+    assert parse_shard("1/4") == (0, 4)
+    assert parse_shard(" 4 / 4 ") == (3, 4)
+
+
+@pytest.mark.parametrize("value", ["0/4", "5/4", "1/0", "a/b", "3"])
+def test_parse_shard_rejects_invalid_values(value):
+    with pytest.raises(ValueError, match="Invalid --shard"):
+        parse_shard(value)
+
+
+def test_shard_prompts_split_disjoint_and_complete():
+    prompts = list(iter_prompt_matrix(limit=20, seed=3))
+    shards = [list(shard_prompts(iter_prompt_matrix(limit=20, seed=3), (i, 3))) for i in range(3)]
+    positions = [pos for shard in shards for pos, _ in shard]
+    assert sorted(positions) == list(range(1, 21))
+    assert sorted(p for shard in shards for _, p in shard) == sorted(prompts)
+
+
 def test_write_gallery_escapes_prompt_xss():
     with tempfile.TemporaryDirectory() as tmpdir:
         out = Path(tmpdir)
@@ -138,3 +212,348 @@ def test_write_gallery_normal_output():
         assert "a lobster astronaut, golden hour" in html
         assert 'src="001-lobster.png"' in html
         assert "002-nook.png" in html
+
+
+def test_write_gallery_links_thumbnail_to_original(tmp_path):
+    items = [
+        {
+            "prompt": "a brutalist lighthouse",
+            "file": "001-lighthouse.png",
+            "thumb": "thumbs/001-lighthouse.webp",
+            "width": 384,
+            "height": 256,
+        }
+    ]
+    write_gallery(tmp_path, items)
+    html = (tmp_path / "index.html").read_text()
+    assert 'href="001-lighthouse.png"' in html
+    assert 'src="thumbs/001-lighthouse.webp" width="384" height="256"' in html
+    assert 'src="001-lighthouse.png"' not in html
+
+
+def test_download_image_streams_to_disk_with_checksum(tmp_path):
+    payload = b"\x89PNG" + bytes(range(256)) * 600
+    src = tmp_path / "remote.png"
+    src.write_bytes(payload)
+    dest = tmp_path / "001-out.png"
+
+    size, sha256 = download_image(src.as_uri(), dest, retries=0)
+
+    assert size == len(payload)
+    assert sha256 == hashlib.sha256(payload).hexdigest()
+    assert dest.read_bytes() == payload
+    assert not (tmp_path / "001-out.png.part").exists()
+
+
+def test_download_image_retries_transient_errors(tmp_path):
+    src = tmp_path / "remote.png"
+    src.write_bytes(b"image-bytes")
+    real_urlopen = gen.urllib.request.urlopen
+    calls = []
+
+    def flaky_urlopen(url, timeout):
+        calls.append(url)
+        if len(calls) == 1:
+            raise urllib.error.URLError("connection reset")
+        return real_urlopen(url, timeout=timeout)
+
+    with patch.object(gen.urllib.request, "urlopen", flaky_urlopen), patch.object(
+        gen.time, "sleep"
+    ):
+        size, _ = download_image(src.as_uri(), tmp_path / "out.png", retries=2)
+
+    assert size == len(b"image-bytes")
+    assert len(calls) == 2
+
+
+def test_download_image_does_not_retry_client_errors(tmp_path):
+    calls = []
+
+    def forbidden(url, timeout):
+        calls.append(url)
+        raise urllib.error.HTTPError(url, 403, "Forbidden", {}, None)
+
+    with patch.object(gen.urllib.request, "urlopen", forbidden), patch.object(gen.time, "sleep"):
+        with pytest.raises(RuntimeError, match="Failed to download image"):
+            download_image("https://example.invalid/x.png", tmp_path / "out.png", retries=3)
+
+    assert len(calls) == 1
+
+
+def test_download_pool_downloads_all_urls(tmp_path):
+    sources = []
+    for i in range(5):
+        src = tmp_path / f"src-{i}.png"
+        src.write_bytes(f"image-{i}".encode())
+        sources.append(src)
+
+    pool = DownloadPool(workers=3, retries=0)
+    for i, src in enumerate(sources):
+        pool.submit(src.as_uri(), tmp_path / f"out-{i}.png")
+    pool.wait()
+
+    for i in range(5):
+        assert (tmp_path / f"out-{i}.png").read_bytes() == f"image-{i}".encode()
+
+
+def test_write_gallery_splits_large_runs_into_pages(tmp_path):
+    items = [{"prompt": f"prompt {i}", "file": f"{i:03d}.png"} for i in range(1, 6)]
+    write_gallery(tmp_path, items, page_size=2)
+
+    first = (tmp_path / "index.html").read_text()
+    third = (tmp_path / "page-3.html").read_text()
+    assert "001.png" in first and "002.png" in first and "003.png" not in first
+    assert "005.png" in third
+    assert 'href="page-2.html"' in first
+    assert "Page 3 of 3" in third
+    assert not (tmp_path / "page-4.html").exists()
+
+
+def test_gallery_writer_rewrites_only_the_affected_page(tmp_path):
+    gallery = GalleryWriter(tmp_path, total=4, page_size=2)
+    gallery.write_all()
+    assert "001.png" not in (tmp_path / "index.html").read_text()
+
+    (tmp_path / "page-2.html").write_text("sentinel")
+    gallery.set(0, {"prompt": "first", "file": "001.png"})
+
+    assert "001.png" in (tmp_path / "index.html").read_text()
+    assert (tmp_path / "page-2.html").read_text() == "sentinel"
+
+    gallery.set(3, {"prompt": "last", "file": "004.png"})
+    assert "004.png" in (tmp_path / "page-2.html").read_text()
+
+
+def test_thumbnail_pool_renders_bounded_thumbnails(tmp_path):
+    image_mod = pytest.importorskip("PIL.Image")
+    src = tmp_path / "001-big.png"
+    image_mod.new("RGBA", (1200, 600), (10, 20, 30, 255)).save(src)
+    item = {"prompt": "big", "file": src.name}
+
+    ready = []
+    pool = ThumbnailPool(tmp_path, 300, "webp", workers=1, on_ready=ready.append)
+    pool.submit(item, src)
+    pool.wait()
+
+    assert ready == [item]
+    assert item["thumb"] == "thumbs/001-big.webp"
+    assert (item["width"], item["height"]) == (300, 150)
+    assert (tmp_path / item["thumb"]).exists()
+
+
+@pytest.fixture
+def mock_api():
+    servers = []
+
+    def start(**overrides):
+        server, stats = start_server(MockConfig(**overrides))
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}/v1", stats
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_synthetic_png_matches_requested_size():
+    png = synthetic_png(50_000)
+    assert png.startswith(b"\x89PNG")
+    assert len(png) == 50_000
+
+
+def test_request_images_honors_base_url(mock_api):
+    base_url, stats = mock_api(payload_bytes=4096)
+    res = request_images("key", "a prompt", "gpt-image-1", "1024x1024", "high", base_url=base_url)
+    image = base64.b64decode(res["data"][0]["b64_json"])
+    assert image.startswith(b"\x89PNG")
+    assert len(stats.latencies) == 1
+
+
+def test_request_images_retries_injected_errors(mock_api, capsys):
+    # The mock sends Retry-After: 0 with 429s, so retries do not sleep.
+    base_url, stats = mock_api(error_rate=1.0, error_codes=(429,))
+    with pytest.raises(ImagesAPIError) as excinfo:
+        request_images("key", "p", "gpt-image-1", "1024x1024", "high", base_url=base_url, retries=2)
+    assert excinfo.value.status == 429
+    assert excinfo.value.retry_after == 0
+    assert stats.errors == 3
+    assert capsys.readouterr().err.count("retrying in 0.0s") == 2
+
+
+def test_request_images_does_not_retry_client_errors(mock_api):
+    base_url, stats = mock_api(error_rate=1.0, error_codes=(400,))
+    with pytest.raises(ImagesAPIError, match=r"failed \(400\)"):
+        request_images("key", "p", "gpt-image-1", "1024x1024", "high", base_url=base_url, retries=3)
+    assert stats.errors == 1
+
+
+def test_request_images_reports_timings(mock_api):
+    base_url, _ = mock_api(payload_bytes=2048, latency="fixed:0.02")
+    timings = {}
+    request_images(
+        "key", "p", "gpt-image-1", "1024x1024", "high", base_url=base_url, timings=timings
+    )
+    assert timings["status"] == 200
+    assert timings["retries"] == 0
+    assert timings["headers_s"] >= 0.02
+    assert timings["transfer_s"] >= 0
+    assert timings["response_bytes"] > 2048
+
+
+def test_percentile_uses_nearest_rank():
+    values = [float(v) for v in range(1, 101)]
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 95) == 95.0
+    assert percentile(values, 99) == 99.0
+    assert percentile([], 50) == 0.0
+
+
+def test_metrics_log_streams_json_lines_and_summary(tmp_path):
+    path = tmp_path / "metrics.jsonl"
+    metrics = MetricsLog(str(path))
+    metrics.record({"position": 1, "total_s": 1.0, "status": 200})
+    metrics.record({"position": 2, "total_s": 3.0, "status": 200})
+    metrics.record({"position": 3, "status": 500, "error": "boom"})
+    summary = metrics.close()
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [line["type"] for line in lines] == ["image", "image", "image", "summary"]
+    assert summary["images"] == 2
+    assert summary["failures"] == 1
+    assert summary["p50_s"] == 1.0
+    assert summary["p99_s"] == 3.0
+    assert lines[-1]["images_per_min"] == summary["images_per_min"]
+
+
+def test_multipart_body_streams_files_with_exact_length(tmp_path):
+    image = tmp_path / "in.png"
+    image.write_bytes(b"\x89PNG" + b"x" * 200_000)
+    body = MultipartBody({"prompt": "make it blue", "n": "1"}, [("image", image)])
+
+    chunks = list(body)
+
+    assert sum(len(c) for c in chunks) == body.content_length
+    assert max(len(c) for c in chunks) <= 64 * 1024
+    encoded = b"".join(chunks)
+    assert b'name="image"; filename="in.png"' in encoded
+    assert b"Content-Type: image/png" in encoded
+    assert encoded.endswith(f"--{body.boundary}--\r\n".encode())
+    # Re-iterating reopens the file so retries resend the full body.
+    assert b"".join(body) == encoded
+
+
+def test_request_image_edit_uploads_image_and_mask(mock_api, tmp_path):
+    base_url, stats = mock_api(payload_bytes=1024)
+    image = tmp_path / "in.png"
+    image.write_bytes(b"i" * 50_000)
+    mask = tmp_path / "mask.png"
+    mask.write_bytes(b"m" * 10_000)
+
+    res = request_image_edit(
+        "key", image, "add a hat", "gpt-image-1", "1024x1024", "high", mask, base_url=base_url
+    )
+
+    assert "b64_json" in res["data"][0]
+    assert stats.endpoints == ["edits"]
+    assert stats.bytes_received > 60_000
+
+
+def test_request_image_variation_retries_with_full_body(mock_api, tmp_path):
+    base_url, stats = mock_api(error_rate=1.0, error_codes=(429,))
+    image = tmp_path / "in.png"
+    image.write_bytes(b"v" * 30_000)
+
+    with pytest.raises(ImagesAPIError):
+        request_image_variation(
+            "key", image, "dall-e-2", "512x512", base_url=base_url, retries=1
+        )
+
+    assert stats.endpoints == ["variations", "variations"]
+    assert stats.bytes_received > 60_000
+
+
+@pytest.mark.parametrize("extra", [["--variations", "in.png"], ["--prompt", "a cat"]])
+def test_main_rejects_matrix_with_a_fixed_prompt_source(monkeypatch, capsys, extra):
+    monkeypatch.setenv("OPENAI_API_KEY", "key")
+    monkeypatch.setattr("sys.argv", ["gen.py", "--matrix", *extra])
+
+    with pytest.raises(SystemExit) as exc:
+        gen.main()
+
+    assert exc.value.code == 2
+    assert "--matrix cannot be combined with --prompt or --variations" in capsys.readouterr().err
+
+
+def test_main_sends_variations_with_dall_e_2_by_default(tmp_path, monkeypatch, capsys):
+    image = tmp_path / "in.png"
+    image.write_bytes(synthetic_png(1024))
+    models = []
+
+    def fake_variation(api_key, image, model, size, **kwargs):
+        models.append((model, size))
+        raise ImagesAPIError(400, "stop here")
+
+    monkeypatch.setattr(gen, "request_image_variation", fake_variation)
+    monkeypatch.setenv("OPENAI_API_KEY", "key")
+    monkeypatch.setattr(
+        "sys.argv",
+        ["gen.py", "--variations", str(image), "--count", "1", "--out-dir", str(tmp_path / "out"), "--thumb-size", "0"],
+    )
+
+    gen.main()
+
+    assert models == [("dall-e-2", "1024x1024")]
+    assert "--variations is only supported for dall-e-2" in capsys.readouterr().err
+
+
+def test_main_rejects_unseeded_random_prompts_across_shards(monkeypatch, capsys):
+    monkeypatch.setenv("OPENAI_API_KEY", "key")
+    monkeypatch.setattr("sys.argv", ["gen.py", "--shard", "2/4"])
+
+    assert gen.main() == 2
+    assert "needs --seed" in capsys.readouterr().err
+
+
+def test_download_pool_reports_failures_to_on_error(tmp_path):
+    errors = []
+    pool = DownloadPool(workers=2, retries=0)
+
+    pool.submit(
+        (tmp_path / "missing.png").as_uri(),
+        tmp_path / "out.png",
+        on_done=lambda *_: pytest.fail("download should fail"),
+        on_error=lambda e, stats: errors.append((str(e), stats)),
+    )
+    pool.wait()
+
+    assert len(errors) == 1
+    assert errors[0][0].startswith("Failed to download image")
+    assert errors[0][1] == {"retries": 0}
+
+
+def test_main_records_failed_images_and_still_writes_summary(mock_api, tmp_path, monkeypatch, capsys):
+    base_url, stats = mock_api(error_rate=0.5, error_codes=(500,), payload_bytes=2048, seed=3)
+    metrics = tmp_path / "metrics.jsonl"
+    out_dir = tmp_path / "out"
+    monkeypatch.setenv("OPENAI_API_KEY", "key")
+    monkeypatch.setattr(
+        "sys.argv",
+        [
+            "gen.py", "--prompt", "a cat", "--count", "6", "--retries", "0", "--thumb-size", "0",
+            "--base-url", base_url, "--out-dir", str(out_dir), "--metrics", str(metrics),
+        ],
+    )
+
+    code = gen.main()
+
+    records = [json.loads(line) for line in metrics.read_text().splitlines()]
+    summary = records[-1]
+    assert summary["type"] == "summary"
+    assert summary["failures"] == stats.errors > 0
+    assert summary["images"] == 6 - stats.errors
+    assert code == 1
+    items = json.loads((out_dir / "prompts.json").read_text())
+    assert len(items) == 6
+    assert sum(1 for item in items if item.get("error")) == stats.errors
+    assert f"{stats.errors} of 6 images failed." in capsys.readouterr().err
@@ -3,19 +3,61 @@
 Skill Packager - Creates a distributable .skill file of a skill folder
 
 Usage:
-    python utils/package_skill.py <path/to/skill-folder> [output-directory]
+    python utils/package_skill.py <path/to/skill-folder> [output-directory] [--level 0-9] [--jobs N] [--full]
 
 Example:
     python utils/package_skill.py skills/public/my-skill
     python utils/package_skill.py skills/public/my-skill ./dist
+    python utils/package_skill.py skills/public/my-skill ./dist --level 9 --jobs 8
 """
 
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import stat
+import struct
 import sys
+import tempfile
+import time
 import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import NamedTuple
 
 from quick_validate import validate_skill
 
+EXCLUDED_DIRS = {".git", ".svn", ".hg", "__pycache__", "node_modules"}
+SKILLIGNORE_FILE = ".skillignore"
+# Written next to the .skill file; records what each entry was built from.
+MANIFEST_SUFFIX = ".manifest.json"
+MANIFEST_VERSION = 1
+DEFAULT_COMPRESS_LEVEL = 6
+# Files smaller than this are compressed in the writer process; shipping them
+# to a worker costs more than deflating them.
+PARALLEL_MIN_BYTES = 256 * 1024
+READ_CHUNK = 1024 * 1024
+# Extensions whose contents are already compressed: stored without deflating.
+INCOMPRESSIBLE_SUFFIXES = {
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".avif", ".heic", ".heif",
+    ".mp3", ".m4a", ".aac", ".ogg", ".opus", ".flac", ".mp4", ".m4v", ".mov", ".webm", ".mkv",
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".7z", ".rar", ".jar", ".whl", ".skill",
+    ".woff", ".woff2", ".onnx", ".tflite", ".gguf",
+}
+# Text formats that always deflate well: compressed without probing.
+COMPRESSIBLE_SUFFIXES = {
+    ".md", ".txt", ".py", ".js", ".mjs", ".cjs", ".ts", ".tsx", ".jsx", ".json", ".jsonl",
+    ".yaml", ".yml", ".toml", ".ini", ".cfg", ".html", ".htm", ".css", ".xml", ".svg",
+    ".csv", ".tsv", ".sh", ".bash", ".rst", ".sql", ".go", ".rs", ".java", ".c", ".h", ".cpp",
+}
+# Unknown types: deflate a sample of this size first and store the file
+# unless the sample shrinks below PROBE_MAX_RATIO of its size.
+PROBE_SAMPLE_BYTES = 64 * 1024
+PROBE_MAX_RATIO = 0.9
+
 
 def _is_within(path: Path, root: Path) -> bool:
     try:
@@ -25,13 +67,385 @@ def _is_within(path: Path, root: Path) -> bool:
         return False
 
 
-def package_skill(skill_path, output_dir=None):
+def load_skillignore(skill_path: Path) -> list[str]:
+    """Read glob patterns from the skill's .skillignore (blank lines and # comments skipped)."""
+    try:
+        lines = (skill_path / SKILLIGNORE_FILE).read_text(encoding="utf-8").splitlines()
+    except FileNotFoundError:
+        return []
+    return [line.strip() for line in lines if line.strip() and not line.strip().startswith("#")]
+
+
+def is_ignored(rel_path: str, is_dir: bool, patterns: list[str]) -> bool:
+    """Match a skill-relative POSIX path against .skillignore patterns.
+
+    A pattern ending in "/" only matches directories. A pattern containing
+    another "/" is matched against the whole relative path, anything else
+    against the file or directory name alone.
+    """
+    name = rel_path.rsplit("/", 1)[-1]
+    for pattern in patterns:
+        if pattern.endswith("/"):
+            if not is_dir:
+                continue
+            pattern = pattern.rstrip("/")
+        if "/" in pattern:
+            if fnmatch.fnmatchcase(rel_path, pattern.lstrip("/")):
+                return True
+        elif fnmatch.fnmatchcase(name, pattern):
+            return True
+    return False
+
+
+def iter_skill_files(directory: Path, patterns: list[str], rel_prefix: str = ""):
+    """Yield (path, relative POSIX path, stat) for each file to package, in sorted order.
+
+    Excluded and ignored directories are pruned before they are opened, and
+    the stat result comes from the directory scan. Symlinks are never followed.
+    """
+    with os.scandir(directory) as it:
+        entries = sorted(it, key=lambda entry: entry.name)
+    for entry in entries:
+        rel_path = f"{rel_prefix}{entry.name}"
+        # Security: never follow or package symlinks.
+        if entry.is_symlink():
+            print(f"[WARN] Skipping symlink: {entry.path}")
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            if entry.name in EXCLUDED_DIRS or is_ignored(rel_path, True, patterns):
+                continue
+            yield from iter_skill_files(Path(entry.path), patterns, f"{rel_path}/")
+        elif entry.is_file(follow_symlinks=False):
+            if not rel_prefix and entry.name == SKILLIGNORE_FILE:
+                continue
+            if is_ignored(rel_path, False, patterns):
+                continue
+            yield Path(entry.path), rel_path, entry.stat(follow_symlinks=False)
+
+
+def zip_info_for(arcname: str, st: os.stat_result) -> zipfile.ZipInfo:
+    """ZipInfo for a regular file from an existing stat result (no second stat)."""
+    # ZIP timestamps cannot represent dates before 1980.
+    date_time = time.localtime(max(st.st_mtime, 315532800))[:6]
+    zinfo = zipfile.ZipInfo(arcname, date_time)
+    zinfo.external_attr = (stat.S_IMODE(st.st_mode) | stat.S_IFREG) << 16
+    zinfo.file_size = st.st_size
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    return zinfo
+
+
+class CompressedEntry(NamedTuple):
+    # None means the file is stored as-is and streamed from disk by the writer.
+    data: bytes | None
+    crc: int
+    size: int
+    compress_size: int
+    compress_type: int
+    policy: str
+    seconds: float
+    sha256: str
+
+
+def compression_policy(name: str) -> str:
+    """Pick "store", "deflate" or "probe" for a file from its extension."""
+    suffix = os.path.splitext(name)[1].lower()
+    if suffix in INCOMPRESSIBLE_SUFFIXES:
+        return "store"
+    if suffix in COMPRESSIBLE_SUFFIXES:
+        return "deflate"
+    return "probe"
+
+
+def compress_file(path: str, level: int, policy: str = "deflate") -> CompressedEntry:
+    """Read one file and deflate it for the archive under `policy`.
+
+    "deflate" produces a raw deflate stream (no zlib header, as ZIP stores
+    it) and "probe" deflates a sample first, giving up when it does not
+    shrink enough. Files that are stored instead ("store", a failed probe, or
+    a deflate that did not end up smaller) come back with data=None, so they
+    are never held in memory; the writer streams them with store_file().
+    """
+    started = time.perf_counter()
+    compressor = None
+    deflated = []
+    crc = 0
+    size = 0
+    digest = hashlib.sha256()
+    if policy != "store":
+        with open(path, "rb") as src:
+            while chunk := src.read(READ_CHUNK):
+                if policy == "probe":
+                    sample = chunk[:PROBE_SAMPLE_BYTES]
+                    probe = zlib.compressobj(level, zlib.DEFLATED, -15)
+                    probed = len(probe.compress(sample)) + len(probe.flush())
+                    if probed >= len(sample) * PROBE_MAX_RATIO:
+                        policy = "probe-store"
+                        break
+                    policy = "probe-deflate"
+                compressor = compressor or zlib.compressobj(level, zlib.DEFLATED, -15)
+                deflated.append(compressor.compress(chunk))
+                crc = zlib.crc32(chunk, crc)
+                digest.update(chunk)
+                size += len(chunk)
+
+    if compressor is not None:
+        deflated.append(compressor.flush())
+        data = b"".join(deflated)
+        if len(data) < size:
+            return CompressedEntry(
+                data,
+                crc,
+                size,
+                len(data),
+                zipfile.ZIP_DEFLATED,
+                policy,
+                time.perf_counter() - started,
+                digest.hexdigest(),
+            )
+    if policy in ("deflate", "probe-deflate"):
+        policy = f"{policy}-no-gain"
+    elif policy == "probe":
+        # Empty file: nothing to probe.
+        policy = "probe-store"
+    return CompressedEntry(None, 0, 0, 0, zipfile.ZIP_STORED, policy, time.perf_counter() - started, "")
+
+
+def store_file(zipf: zipfile.ZipFile, zinfo: zipfile.ZipInfo, path: Path) -> str:
+    """Stream a file into the archive uncompressed, chunk by chunk; return its SHA-256.
+
+    ZipFile computes the CRC and sizes as it goes and rewrites the local
+    header afterwards, so the file is never buffered whole.
+    """
+    zinfo.compress_type = zipfile.ZIP_STORED
+    digest = hashlib.sha256()
+    with open(path, "rb") as src, zipf.open(zinfo, "w") as dst:
+        while chunk := src.read(READ_CHUNK):
+            digest.update(chunk)
+            dst.write(chunk)
+    return digest.hexdigest()
+
+
+def compress_entries(entries, level: int, workers: int):
+    """Yield a CompressedEntry for each of `entries`, in order.
+
+    Large files that need deflating (or probing) go to a process pool with a
+    bounded number in flight, so memory stays proportional to the worker
+    count. Small files and files that are stored as-is are handled inline.
+    """
+    policies = [compression_policy(arcname) for _, arcname, _ in entries]
+    large = [
+        i
+        for i, (_, _, st) in enumerate(entries)
+        if st.st_size >= PARALLEL_MIN_BYTES and policies[i] != "store"
+    ]
+    if workers <= 1 or len(large) < 2:
+        for (file_path, _, _), policy in zip(entries, policies):
+            yield compress_file(str(file_path), level, policy)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque(large)
+        futures = {}
+
+        def fill():
+            while pending and len(futures) < workers * 2:
+                idx = pending.popleft()
+                futures[idx] = pool.submit(compress_file, str(entries[idx][0]), level, policies[idx])
+
+        fill()
+        for idx, (file_path, _, _) in enumerate(entries):
+            if idx in futures:
+                result = futures.pop(idx).result()
+                fill()
+                yield result
+            else:
+                yield compress_file(str(file_path), level, policies[idx])
+
+
+def format_policy_summary(stats: dict[str, list]) -> str:
+    """One line per policy: files, bytes in -> out, bytes saved and compression time.
+
+    Reused entries were compressed by an earlier build, so their line shows
+    the sizes and copy time but claims no savings for this run.
+    """
+    lines = ["Compression by policy:"]
+    for policy in sorted(stats):
+        files, size_in, size_out, seconds = stats[policy]
+        if policy == "reused":
+            outcome = "  copied from the previous archive"
+        else:
+            outcome = f"  saved {size_in - size_out:>14,}"
+        lines.append(
+            f"  {policy:<22} {files:>5} files  {size_in:>14,} -> {size_out:>14,} bytes{outcome}  {seconds:>7.3f}s"
+        )
+    return "\n".join(lines)
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as src:
+        while chunk := src.read(READ_CHUNK):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(manifest_path: Path, archive_path: Path, level: int) -> dict:
+    """Return the previous build's entries, or {} when they cannot be reused.
+
+    The manifest only counts if it was written for the archive that is on
+    disk now (same size and mtime) at the same compression level.
+    """
+    try:
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+        archive_stat = archive_path.stat()
+    except (OSError, ValueError):
+        return {}
+    if (
+        not isinstance(manifest, dict)
+        or manifest.get("version") != MANIFEST_VERSION
+        or manifest.get("level") != level
+        or manifest.get("archive") != {"size": archive_stat.st_size, "mtime_ns": archive_stat.st_mtime_ns}
+    ):
+        return {}
+    entries = manifest.get("entries")
+    return entries if isinstance(entries, dict) else {}
+
+
+def write_manifest(manifest_path: Path, archive_path: Path, level: int, entries: dict) -> None:
+    archive_stat = archive_path.stat()
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "level": level,
+        "archive": {"size": archive_stat.st_size, "mtime_ns": archive_stat.st_mtime_ns},
+        "entries": entries,
+    }
+    tmp_path = manifest_path.with_name(manifest_path.name + ".tmp")
+    tmp_path.write_text(json.dumps(manifest, indent=1, sort_keys=True), encoding="utf-8")
+    os.replace(tmp_path, manifest_path)
+
+
+def raw_entry_offset(fp, zinfo: zipfile.ZipInfo) -> int:
+    """Return where the stored (still compressed) bytes of one member of an open archive start."""
+    fp.seek(zinfo.header_offset)
+    header = fp.read(zipfile.sizeFileHeader)
+    if len(header) != zipfile.sizeFileHeader:
+        raise zipfile.BadZipFile(f"Truncated local header for {zinfo.filename}")
+    fields = struct.unpack(zipfile.structFileHeader, header)
+    if fields[0] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f"Bad local header magic for {zinfo.filename}")
+    # Skip the variable-length name and extra field that follow the fixed header.
+    offset = zinfo.header_offset + zipfile.sizeFileHeader + fields[-2] + fields[-1]
+    if offset + zinfo.compress_size > os.fstat(fp.fileno()).st_size:
+        raise zipfile.BadZipFile(f"Truncated data for {zinfo.filename}")
+    return offset
+
+
+def iter_raw_entry(fp, offset: int, length: int):
+    """Yield `length` bytes of an open archive starting at `offset`, in READ_CHUNK pieces."""
+    fp.seek(offset)
+    while length > 0:
+        chunk = fp.read(min(READ_CHUNK, length))
+        if not chunk:
+            raise zipfile.BadZipFile("Archive ended inside a member")
+        length -= len(chunk)
+        yield chunk
+
+
+class ReusedEntry(NamedTuple):
+    zinfo: zipfile.ZipInfo
+    offset: int
+    sha256: str
+
+
+def reusable_entry(previous, old_zip, file_path: Path, arcname: str, st: os.stat_result) -> ReusedEntry | None:
+    """Locate `file_path`'s member in the previous archive if the file is unchanged.
+
+    Size and mtime matching the manifest count as unchanged; when only the
+    mtime differs, the content hash decides.
+    """
+    record = previous.get(arcname)
+    if old_zip is None or not isinstance(record, dict) or record.get("size") != st.st_size:
+        return None
+    try:
+        zinfo = old_zip.getinfo(arcname)
+    except KeyError:
+        return None
+    if zinfo.file_size != st.st_size:
+        return None
+    if record.get("mtime_ns") != st.st_mtime_ns and record.get("sha256") != file_sha256(file_path):
+        return None
+    try:
+        offset = raw_entry_offset(old_zip.fp, zinfo)
+    except zipfile.BadZipFile:
+        return None
+    return ReusedEntry(zinfo, offset, record["sha256"])
+
+
+def append_raw(zipf: zipfile.ZipFile, zinfo: zipfile.ZipInfo, chunks) -> None:
+    """Append an entry whose CRC, sizes and compression are already set on `zinfo`.
+
+    Writes the local header and the encoded `chunks` directly and registers
+    the entry, so ZipFile.close() emits the central directory as for any
+    other member.
+    """
+    zinfo.header_offset = zipf.fp.tell()
+    zipf.fp.write(zinfo.FileHeader())
+    for chunk in chunks:
+        zipf.fp.write(chunk)
+    zipf.filelist.append(zinfo)
+    zipf.NameToInfo[zinfo.filename] = zinfo
+    zipf.start_dir = zipf.fp.tell()
+
+
+def append_compressed(zipf: zipfile.ZipFile, zinfo: zipfile.ZipInfo, entry: CompressedEntry) -> None:
+    """Append an entry deflated by compress_file()."""
+    zinfo.compress_type = entry.compress_type
+    zinfo.CRC = entry.crc
+    zinfo.file_size = entry.size
+    zinfo.compress_size = len(entry.data)
+    append_raw(zipf, zinfo, (entry.data,))
+
+
+def copy_reused(zipf: zipfile.ZipFile, zinfo: zipfile.ZipInfo, src_fp, old: ReusedEntry) -> CompressedEntry:
+    """Copy a member of the previous archive without decompressing it."""
+    started = time.perf_counter()
+    zinfo.compress_type = old.zinfo.compress_type
+    zinfo.CRC = old.zinfo.CRC
+    zinfo.file_size = old.zinfo.file_size
+    zinfo.compress_size = old.zinfo.compress_size
+    append_raw(zipf, zinfo, iter_raw_entry(src_fp, old.offset, old.zinfo.compress_size))
+    return CompressedEntry(
+        None,
+        zinfo.CRC,
+        zinfo.file_size,
+        zinfo.compress_size,
+        zinfo.compress_type,
+        "reused",
+        time.perf_counter() - started,
+        old.sha256,
+    )
+
+
+def archive_mode(archive_path: Path) -> int:
+    """Permission bits for a rebuilt archive: those of the existing one, else 0666 minus the umask."""
+    try:
+        return stat.S_IMODE(archive_path.stat().st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def package_skill(skill_path, output_dir=None, level=DEFAULT_COMPRESS_LEVEL, workers=None, incremental=True):
     """
     Package a skill folder into a .skill file.
 
     Args:
         skill_path: Path to the skill folder
         output_dir: Optional output directory for the .skill file (defaults to current directory)
+        level: Deflate compression level, 0-9
+        workers: Compression processes (defaults to the CPU count)
+        incremental: Copy unchanged entries from the previous archive instead of recompressing them
 
     Returns:
         Path to the created .skill file, or None if error
@@ -71,63 +485,147 @@ def package_skill(skill_path, output_dir=None):
         output_path = Path.cwd()
 
     skill_filename = output_path / f"{skill_name}.skill"
+    archive_path = skill_filename.resolve()
+    manifest_path = archive_path.with_name(archive_path.name + MANIFEST_SUFFIX)
+    patterns = load_skillignore(skill_path)
 
-    EXCLUDED_DIRS = {".git", ".svn", ".hg", "__pycache__", "node_modules"}
+    workers = workers or os.cpu_count() or 1
 
     # Create the .skill file (zip format)
     try:
-        with zipfile.ZipFile(skill_filename, "w", zipfile.ZIP_DEFLATED) as zipf:
-            # Walk through the skill directory
-            for file_path in skill_path.rglob("*"):
-                # Security: never follow or package symlinks.
-                if file_path.is_symlink():
-                    print(f"[WARN] Skipping symlink: {file_path}")
-                    continue
-
-                rel_parts = file_path.relative_to(skill_path).parts
-                if any(part in EXCLUDED_DIRS for part in rel_parts):
-                    continue
-
-                if file_path.is_file():
-                    resolved_file = file_path.resolve()
-                    if not _is_within(resolved_file, skill_path):
-                        print(f"[ERROR] File escapes skill root: {file_path}")
-                        return None
-                    # If output lives under skill_path, avoid writing archive into itself.
-                    if resolved_file == skill_filename.resolve():
-                        print(f"[WARN] Skipping output archive: {file_path}")
-                        continue
-
-                    # Calculate the relative path within the zip.
-                    arcname = Path(skill_name) / file_path.relative_to(skill_path)
-                    zipf.write(file_path, arcname)
-                    print(f"  Added: {arcname}")
+        # Walk through the skill directory
+        entries = []
+        for file_path, rel_path, st in iter_skill_files(skill_path, patterns):
+            # The walk starts at the resolved root and never follows
+            # symlinks, so the lexical path is already the real one.
+            if not _is_within(file_path, skill_path):
+                print(f"[ERROR] File escapes skill root: {file_path}")
+                return None
+            # If output lives under skill_path, avoid writing archive into itself.
+            if file_path in (archive_path, manifest_path):
+                print(f"[WARN] Skipping output archive: {file_path}")
+                continue
+            # Calculate the relative path within the zip.
+            entries.append((file_path, f"{skill_name}/{rel_path}", st))
+    except Exception as e:
+        print(f"[ERROR] Error creating .skill file: {e}")
+        return None
+
+    # A missing, stale or unreadable previous build just means a full rebuild.
+    previous = load_manifest(manifest_path, archive_path, level) if incremental else {}
+    old_zip = None
+    if previous:
+        try:
+            old_zip = zipfile.ZipFile(archive_path, "r")
+        except (OSError, zipfile.BadZipFile):
+            previous = {}
+
+    tmp_name = None
+    try:
+        started = time.perf_counter()
+        reused = [reusable_entry(previous, old_zip, *entry) for entry in entries]
+        changed = [entry for entry, old in zip(entries, reused) if old is None]
+        total_in = total_out = 0
+        policy_stats: dict[str, list] = {}
+        manifest_entries = {}
+        # Build next to the destination and swap it in at the end, so the
+        # previous archive stays readable for reuse and is never left half-written.
+        fd, tmp_name = tempfile.mkstemp(prefix=f".{skill_name}.", suffix=".skill.tmp", dir=output_path)
+        os.close(fd)
+        # mkstemp creates the file 0600; give the archive the mode it had, or
+        # the one a plain open() would have given it.
+        os.chmod(tmp_name, archive_mode(archive_path))
+        # Files are compressed in parallel but written by this process alone, in walk order.
+        with zipfile.ZipFile(tmp_name, "w", zipfile.ZIP_DEFLATED) as zipf:
+            results = compress_entries(changed, level, workers)
+            for (file_path, arcname, st), old in zip(entries, reused):
+                zinfo = zip_info_for(arcname, st)
+                if old:
+                    entry = copy_reused(zipf, zinfo, old_zip.fp, old)
+                else:
+                    entry = next(results)
+                    if entry.data is None:
+                        stream_started = time.perf_counter()
+                        sha256 = store_file(zipf, zinfo, file_path)
+                        entry = entry._replace(
+                            crc=zinfo.CRC,
+                            size=zinfo.file_size,
+                            compress_size=zinfo.compress_size,
+                            seconds=entry.seconds + time.perf_counter() - stream_started,
+                            sha256=sha256,
+                        )
+                    else:
+                        append_compressed(zipf, zinfo, entry)
+                manifest_entries[arcname] = {
+                    "size": entry.size,
+                    "mtime_ns": st.st_mtime_ns,
+                    "sha256": entry.sha256,
+                    "compress_type": entry.compress_type,
+                }
+                total_in += entry.size
+                total_out += entry.compress_size
+                stats = policy_stats.setdefault(entry.policy, [0, 0, 0, 0.0])
+                stats[0] += 1
+                stats[1] += entry.size
+                stats[2] += entry.compress_size
+                stats[3] += entry.seconds
+                print(f"  {'Reused' if old else 'Added'}: {arcname}")
+        if old_zip is not None:
+            old_zip.close()
+            old_zip = None
+        os.replace(tmp_name, archive_path)
+        tmp_name = None
+        write_manifest(manifest_path, archive_path, level, manifest_entries)
 
+        elapsed = time.perf_counter() - started
+        print(
+            f"\nCompressed {len(changed)} of {len(entries)} files: {total_in:,} -> {total_out:,} bytes "
+            f"in {elapsed:.2f}s (level {level}, {workers} workers)"
+        )
+        if policy_stats:
+            print(format_policy_summary(policy_stats))
         print(f"\n[OK] Successfully packaged skill to: {skill_filename}")
         return skill_filename
 
     except Exception as e:
         print(f"[ERROR] Error creating .skill file: {e}")
         return None
+    finally:
+        if old_zip is not None:
+            old_zip.close()
+        if tmp_name is not None:
+            Path(tmp_name).unlink(missing_ok=True)
 
 
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python utils/package_skill.py <path/to/skill-folder> [output-directory]")
-        print("\nExample:")
-        print("  python utils/package_skill.py skills/public/my-skill")
-        print("  python utils/package_skill.py skills/public/my-skill ./dist")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Package a skill folder into a .skill file.")
+    parser.add_argument("skill_path", help="Path to the skill folder")
+    parser.add_argument("output_dir", nargs="?", default=None, help="Output directory (default: current directory)")
+    parser.add_argument(
+        "--level",
+        type=int,
+        choices=range(10),
+        default=DEFAULT_COMPRESS_LEVEL,
+        metavar="0-9",
+        help=f"Deflate compression level (default: {DEFAULT_COMPRESS_LEVEL})",
+    )
+    parser.add_argument("--jobs", type=int, default=None, help="Compression processes (default: CPU count)")
+    parser.add_argument(
+        "--full", action="store_true", help="Recompress every file instead of reusing unchanged entries"
+    )
+    args = parser.parse_args()
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be >= 1")
 
-    skill_path = sys.argv[1]
-    output_dir = sys.argv[2] if len(sys.argv) > 2 else None
+    skill_path = args.skill_path
+    output_dir = args.output_dir
 
     print(f"Packaging skill: {skill_path}")
     if output_dir:
         print(f"   Output directory: {output_dir}")
     print()
 
-    result = package_skill(skill_path, output_dir)
+    result = package_skill(skill_path, output_dir, level=args.level, workers=args.jobs, incremental=not args.full)
 
     if result:
         sys.exit(0)
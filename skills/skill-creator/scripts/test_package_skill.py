@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 """
-Regression tests for skill packaging security behavior.
+Regression tests for skill packaging: security behavior, file selection,
+compression and incremental rebuilds.
 """
 
+import os
+import stat
 import sys
 import tempfile
 import types
@@ -30,7 +33,7 @@ else:
     sys.modules.pop("quick_validate", None)
 
 
-class TestPackageSkillSecurity(TestCase):
+class SkillDirTestCase(TestCase):
     def setUp(self):
         self.temp_dir = Path(tempfile.mkdtemp(prefix="test_skill_"))
 
@@ -47,6 +50,8 @@ class TestPackageSkillSecurity(TestCase):
         (skill_dir / "script.py").write_text("print('ok')\n")
         return skill_dir
 
+
+class TestPackageSkillSecurity(SkillDirTestCase):
     def test_packages_normal_files(self):
         skill_dir = self.create_skill("normal-skill")
         out_dir = self.temp_dir / "out"
@@ -156,5 +161,262 @@ class TestPackageSkillSecurity(TestCase):
         self.assertNotIn("self-output-skill/self-output-skill.skill", names)
 
 
+class TestPackageSkillBuild(SkillDirTestCase):
+    """File selection, parallel compression, storage policies and incremental rebuilds."""
+
+    def test_prunes_excluded_dirs_without_scanning_them(self):
+        skill_dir = self.create_skill("pruned-skill")
+        deps = skill_dir / "node_modules" / "pkg"
+        deps.mkdir(parents=True)
+        (deps / "index.js").write_text("module.exports = 1\n")
+        out_dir = self.temp_dir / "out"
+        out_dir.mkdir()
+
+        scanned = []
+        real_scandir = package_skill_module.os.scandir
+
+        def recording_scandir(path):
+            scanned.append(Path(path).name)
+            return real_scandir(path)
+
+        with patch.object(package_skill_module.os, "scandir", recording_scandir):
+            result = package_skill(str(skill_dir), str(out_dir))
+
+        self.assertIsNotNone(result)
+        self.assertNotIn("node_modules", scanned)
+        with zipfile.ZipFile(result, "r") as archive:
+            names = set(archive.namelist())
+        self.assertEqual(names, {"pruned-skill/SKILL.md", "pruned-skill/script.py"})
+
+    def test_honors_skillignore_patterns(self):
+        skill_dir = self.create_skill("ignore-skill")
+        (skill_dir / ".skillignore").write_text("# build output\n*.log\nbuild/\ndocs/drafts/*\n")
+        (skill_dir / "debug.log").write_text("noise\n")
+        (skill_dir / "build").mkdir()
+        (skill_dir / "build" / "out.bin").write_bytes(b"\0")
+        drafts = skill_dir / "docs" / "drafts"
+        drafts.mkdir(parents=True)
+        (drafts / "wip.md").write_text("wip\n")
+        (skill_dir / "docs" / "guide.md").write_text("guide\n")
+        out_dir = self.temp_dir / "out"
+        out_dir.mkdir()
+
+        result = package_skill(str(skill_dir), str(out_dir))
+
+        self.assertIsNotNone(result)
+        with zipfile.ZipFile(result, "r") as archive:
+            names = set(archive.namelist())
+        self.assertEqual(
+            names,
+            {"ignore-skill/SKILL.md", "ignore-skill/script.py", "ignore-skill/docs/guide.md"},
+        )
+
+    def test_parallel_compression_writes_valid_archive_in_walk_order(self):
+        skill_dir = self.create_skill("big-skill")
+        data_dir = skill_dir / "data"
+        data_dir.mkdir()
+        contents = {}
+        for i in range(4):
+            payload = (f"row {i} ".encode() * 70000) + os.urandom(1000)
+            (data_dir / f"part{i}.bin").write_bytes(payload)
+            contents[f"big-skill/data/part{i}.bin"] = payload
+        out_dir = self.temp_dir / "out"
+        out_dir.mkdir()
+
+        result = package_skill(str(skill_dir), str(out_dir), level=9, workers=2)
+
+        self.assertIsNotNone(result)
+        with zipfile.ZipFile(result, "r") as archive:
+            self.assertIsNone(archive.testzip())
+            names = archive.namelist()
+            for name, payload in contents.items():
+                self.assertEqual(archive.read(name), payload)
+                self.assertLess(archive.getinfo(name).compress_size, len(payload))
+        self.assertEqual(
+            names,
+            ["big-skill/SKILL.md", *sorted(contents), "big-skill/script.py"],
+        )
+
+    def test_stores_incompressible_files_and_deflates_text(self):
+        skill_dir = self.create_skill("media-skill")
+        assets = skill_dir / "assets"
+        assets.mkdir()
+        noise = os.urandom(200_000)
+        (assets / "photo.png").write_bytes(noise)
+        (assets / "blob.dat").write_bytes(noise)
+        (assets / "table.dat").write_bytes(b"id,value\n" * 20_000)
+        (assets / "empty.dat").write_bytes(b"")
+
+        with patch("builtins.print") as mock_print:
+            result = package_skill(str(skill_dir), str(self.temp_dir))
+
+        self.assertIsNotNone(result)
+        with zipfile.ZipFile(result, "r") as archive:
+            self.assertIsNone(archive.testzip())
+            info = {i.filename: i for i in archive.infolist()}
+            self.assertEqual(archive.read("media-skill/assets/photo.png"), noise)
+        self.assertEqual(info["media-skill/assets/photo.png"].compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(info["media-skill/assets/blob.dat"].compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(info["media-skill/assets/empty.dat"].compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(info["media-skill/assets/table.dat"].compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(info["media-skill/SKILL.md"].compress_type, zipfile.ZIP_DEFLATED)
+        output = "\n".join(str(c.args[0]) for c in mock_print.call_args_list if c.args)
+        self.assertIn("Compression by policy:", output)
+        for policy in ("store", "deflate", "probe-store", "probe-deflate"):
+            self.assertRegex(output, rf"\n  {policy} +\d+ files")
+
+    def test_deflate_falls_back_to_stored_without_gain(self):
+        path = self.temp_dir / "noise.txt"
+        payload = os.urandom(50_000)
+        path.write_bytes(payload)
+
+        entry = package_skill_module.compress_file(str(path), 6, "deflate")
+
+        self.assertEqual(entry.compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(entry.policy, "deflate-no-gain")
+        self.assertIsNone(entry.data)
+
+    def test_stored_files_are_streamed_in_chunks(self):
+        skill_dir = self.create_skill("model-skill")
+        payload = os.urandom(300_000)
+        (skill_dir / "model.onnx").write_bytes(payload)
+        (skill_dir / "weights.bin").write_bytes(payload)
+        reads = []
+        real_open = open
+
+        class RecordingFile:
+            def __init__(self, f):
+                self.f = f
+
+            def read(self, n=-1):
+                reads.append(n)
+                return self.f.read(n)
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                self.f.close()
+
+        def recording_open(path, mode="r", *args, **kwargs):
+            f = real_open(path, mode, *args, **kwargs)
+            return RecordingFile(f) if str(path).endswith((".onnx", ".bin")) else f
+
+        with patch.object(package_skill_module, "READ_CHUNK", 64 * 1024), patch(
+            "package_skill.open", recording_open, create=True
+        ):
+            result = package_skill(str(skill_dir), str(self.temp_dir))
+
+        self.assertIsNotNone(result)
+        self.assertTrue(reads)
+        self.assertTrue(all(0 < n <= 64 * 1024 for n in reads))
+        with zipfile.ZipFile(result, "r") as archive:
+            self.assertIsNone(archive.testzip())
+            for name in ("model-skill/model.onnx", "model-skill/weights.bin"):
+                self.assertEqual(archive.getinfo(name).compress_type, zipfile.ZIP_STORED)
+                self.assertEqual(archive.read(name), payload)
+
+    def test_incremental_rebuild_reuses_unchanged_entries(self):
+        skill_dir = self.create_skill("inc-skill")
+        (skill_dir / "notes.txt").write_text("notes " * 5000)
+        (skill_dir / "touched.txt").write_text("same content " * 100)
+        out_dir = self.temp_dir / "out"
+        out_dir.mkdir()
+        first = package_skill(str(skill_dir), str(out_dir))
+        self.assertIsNotNone(first)
+        manifest_path = out_dir / "inc-skill.skill.manifest.json"
+        self.assertTrue(manifest_path.exists())
+
+        (skill_dir / "SKILL.md").write_text((skill_dir / "SKILL.md").read_text() + "\nMore.\n")
+        later = (skill_dir / "touched.txt").stat().st_mtime_ns + 5_000_000_000
+        os.utime(skill_dir / "touched.txt", ns=(later, later))
+        real_compress = package_skill_module.compress_file
+        with patch.object(package_skill_module, "compress_file", side_effect=real_compress) as mock_compress:
+            second = package_skill(str(skill_dir), str(out_dir))
+
+        self.assertEqual(second, first)
+        self.assertEqual([c.args[0] for c in mock_compress.call_args_list], [str(skill_dir / "SKILL.md")])
+        with zipfile.ZipFile(second, "r") as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.read("inc-skill/notes.txt").decode(), "notes " * 5000)
+            self.assertTrue(archive.read("inc-skill/SKILL.md").decode().endswith("More.\n"))
+        self.assertEqual([p.name for p in out_dir.iterdir() if p.name.endswith(".tmp")], [])
+
+        with patch.object(package_skill_module, "compress_file", side_effect=real_compress) as mock_compress:
+            package_skill(str(skill_dir), str(out_dir), incremental=False)
+        self.assertEqual(mock_compress.call_count, 4)
+
+    def test_policy_summary_claims_no_savings_for_reused_entries(self):
+        summary = package_skill_module.format_policy_summary(
+            {"deflate": [1, 1000, 400, 0.5], "reused": [3, 9000, 2000, 0.01]}
+        )
+        lines = {line.split()[0]: line for line in summary.splitlines()[1:]}
+        self.assertIn("saved            600", lines["deflate"])
+        self.assertNotIn("saved", lines["reused"])
+        self.assertIn("copied from the previous archive", lines["reused"])
+
+    def test_incremental_rebuild_copies_reused_entries_in_chunks(self):
+        skill_dir = self.create_skill("chunk-skill")
+        text = "".join(f"line {i}\n" for i in range(20000))
+        media = os.urandom(100_000)
+        (skill_dir / "data.txt").write_text(text)
+        (skill_dir / "clip.mp4").write_bytes(media)
+        out_dir = self.temp_dir / "out"
+        out_dir.mkdir()
+        package_skill(str(skill_dir), str(out_dir))
+
+        chunks = []
+        real_iter = package_skill_module.iter_raw_entry
+
+        def recording_iter(*args):
+            for chunk in real_iter(*args):
+                chunks.append(len(chunk))
+                yield chunk
+
+        with patch.object(package_skill_module, "READ_CHUNK", 4096), patch.object(
+            package_skill_module, "iter_raw_entry", recording_iter
+        ):
+            result = package_skill(str(skill_dir), str(out_dir))
+
+        self.assertGreater(len(chunks), 25)
+        self.assertLessEqual(max(chunks), 4096)
+        with zipfile.ZipFile(result, "r") as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.read("chunk-skill/data.txt").decode(), text)
+            self.assertEqual(archive.read("chunk-skill/clip.mp4"), media)
+
+    def test_archive_gets_default_permissions_and_keeps_them_on_rebuild(self):
+        skill_dir = self.create_skill("mode-skill")
+        out_dir = self.temp_dir / "out"
+        out_dir.mkdir()
+        old_umask = os.umask(0o022)
+        try:
+            result = package_skill(str(skill_dir), str(out_dir))
+            self.assertEqual(stat.S_IMODE(result.stat().st_mode), 0o644)
+
+            result.chmod(0o640)
+            (skill_dir / "script.py").write_text("print('changed')\n")
+            package_skill(str(skill_dir), str(out_dir))
+            self.assertEqual(stat.S_IMODE(result.stat().st_mode), 0o640)
+        finally:
+            os.umask(old_umask)
+
+    def test_incremental_rebuild_ignores_manifest_for_replaced_archive(self):
+        skill_dir = self.create_skill("stale-skill")
+        out_dir = self.temp_dir / "out"
+        out_dir.mkdir()
+        result = package_skill(str(skill_dir), str(out_dir))
+        with zipfile.ZipFile(result, "w") as archive:
+            archive.writestr("stale-skill/SKILL.md", "something else")
+
+        real_compress = package_skill_module.compress_file
+        with patch.object(package_skill_module, "compress_file", side_effect=real_compress) as mock_compress:
+            package_skill(str(skill_dir), str(out_dir))
+
+        self.assertEqual(mock_compress.call_count, 2)
+        with zipfile.ZipFile(result, "r") as archive:
+            self.assertEqual(archive.read("stale-skill/SKILL.md").decode(), (skill_dir / "SKILL.md").read_text())
+
+
 if __name__ == "__main__":
     main()